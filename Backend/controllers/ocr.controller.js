@@ -169,7 +169,7 @@ exports.processImage = async (req, res) => {
     try {
       // Utiliser un timeout pour l'analyse ML aussi
       mlAnalysis = await Promise.race([
-        pythonService.analyzeWithSimpleParser(req.processedImagePath, text),
+        pythonService.analyzeWithSimpleParser(req.processedImagePath, text, req.user && req.user.entrepriseId),
         new Promise((_, reject) => 
           setTimeout(() => reject(new Error('ML Analysis Timeout')), ML_ANALYSIS_TIMEOUT)
         )
@@ -1,58 +1,418 @@
-import spacy
-from spacy.training import Example
 import json
 import os
 import pickle
+import random
 import re
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+from pattern_registry import TimeBudget, get_registry
+from instrumentation import get_logger, StageTimer
+from training_queue import feedback_to_training_sample
+from model_registry import ModelRegistry, load_language
+from text_similarity import is_similar, longest_common_substring
+from document_classifier import add_examples, classify, get_classifier, train_classifier
+from label_index import extract_values
+from vendor_gazetteer import get_gazetteer, same_name, stage_feedback_names
+from text_normalizer import normalize_text
+from company_overlay import learn_from_feedback as learn_company_names
+from line_items import extract_line_items, normalized_tokens
+from amount_index import AmountIndex, detect_currency, parse_amount, solve_amounts
+from span_alignment import normalize_value, snap_to_tokens
+from simple_invoice_parser import (RULES_VERSION, TYPE_PATTERN_SETS, TYPE_PATTERNS, TYPE_REGISTRIES,
+                                   TYPE_SPECIFIC_PATTERNS)
+
+logger = get_logger("adaptive")
+
+ENTITY_LABELS = ("DATE", "MONTANT_HT", "MONTANT_TTC", "TVA", "REFERENCE", "ADDRESS", "RECIPIENT", "PHONE")
+
+# Étiquettes (NER et regex) retenues par type de document; type inconnu: toutes.
+# Un ticket de caisse n'a pas de destinataire.
+DOCUMENT_TYPE_LABELS = {
+    "invoice": set(ENTITY_LABELS),
+    "delivery_note": set(ENTITY_LABELS),
+    "purchase_order": set(ENTITY_LABELS),
+    "receipt": set(ENTITY_LABELS) - {"RECIPIENT"},
+}
+
+# Champs de l'index approximatif des libellés (label_index) -> étiquettes NER
+LABEL_INDEX_FIELDS = {
+    "date": "DATE",
+    "montantHT": "MONTANT_HT",
+    "montantTTC": "MONTANT_TTC",
+    "tva": "TVA",
+    "reference": "REFERENCE",
+    "vendor": "RECIPIENT",
+    "phone": "PHONE",
+    "address": "ADDRESS",
+}
+LABEL_FIELDS = {label: field for field, label in LABEL_INDEX_FIELDS.items()}
+
+# Montants vérifiés par solve_amounts (HT + TVA = TTC) -> étiquettes NER
+SOLVED_AMOUNT_LABELS = {"MONTANT_HT": "montantHT", "TVA": "tva", "MONTANT_TTC": "montantTTC"}
+
+# Règles compilées du parser simple (par type de document) pour les références: une
+# valeur trouvée aussi par une autre règle est corroborée, un pattern propre au type du
+# document est plus sûr qu'un pattern général
+DOCUMENT_RULE_FIELDS = {"reference": "REFERENCE"}
+CORROBORATED_CONFIDENCE = 0.85
+TYPE_RULE_CONFIDENCE = 0.8
+GENERAL_RULE_CONFIDENCE = 0.6
+
+# Nom connu (vendor_gazetteer) qui contredit le nom écrit après son libellé: il passe
+# sous la valeur libellée
+CONTRADICTED_NAME_CONFIDENCE = 0.6
+
+# Cascade (cascade=True): les règles compilées d'abord, puis le NER seulement pour les
+# champs requis absents ou dont la meilleure valeur a une confiance sous le seuil
+CASCADE_REQUIRED_LABELS = ("DATE", "MONTANT_HT", "MONTANT_TTC", "TVA", "RECIPIENT", "REFERENCE")
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", "0.7"))
+# Étage qui a produit la meilleure valeur d'un champ (résultat "tiers")
+TIER_RULES = "rules"
+TIER_NER = "ner"
+
+# Inférence par fenêtres pour les longs documents (relevés, bons de livraison groupés):
+# au-delà de CHUNK_CHARS caractères, le texte est découpé aux sauts de page puis en
+# fenêtres d'au plus WINDOW_TOKENS mots (et WINDOW_CHARS caractères) qui se chevauchent
+# de WINDOW_OVERLAP mots
+CHUNK_CHARS = 20000
+WINDOW_TOKENS = 1000
+WINDOW_CHARS = 20000
+WINDOW_OVERLAP = 64
+WINDOW_BATCH_SIZE = 8
+PAGE_BREAK = "\f"
+
+# Patterns regex de secours (remplacés par ceux enregistrés avec le modèle), écrits pour
+# une exécution linéaire (voir regex_fuzz)
+DEFAULT_PATTERNS = {
+    "DATE": [r"(\d{1,2}[\/\.-]\d{1,2}[\/\.-]\d{2,4})"],
+    "MONTANT_HT": [r"(?:total|montant|(?<!\s))\s+ht\s*(?::\s*)?(\d+[\s\.,]*\d*\s*(?:€|EUR)?)"],
+    "MONTANT_TTC": [r"(?:total|montant|(?<!\s))\s+ttc\s*(?::\s*)?(\d+[\s\.,]*\d*\s*(?:€|EUR)?)"],
+    "TVA": [r"(?:tva|tax)\s*(?::\s*)?(\d+[\s\.,]*\d*\s*(?:%|€|EUR)?)"],
+    "REFERENCE": [r"(?:ref|référence|facture)\s*(?::\s*)?([A-Z0-9]{4,}[-\/][A-Z0-9]{4,})"],
+    "PHONE": [r"(?:tel|téléphone|tél)\s*(?::\s*)?((?:\+\d{2,3})?[\s\.]?\d{1,2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2})"]
+}
+
+# Versions précédentes de ces patterns, à retour arrière quadratique, encore présentes
+# dans le `_metadata.json` des modèles entraînés avant leur réécriture
+LEGACY_PATTERNS = {
+    r"(?:total|montant)?\s+ht\s*:?\s*(\d+[\s\.,]*\d*\s*(?:€|EUR)?)":
+        DEFAULT_PATTERNS["MONTANT_HT"][0],
+    r"(?:total|montant)?\s+ttc\s*:?\s*(\d+[\s\.,]*\d*\s*(?:€|EUR)?)":
+        DEFAULT_PATTERNS["MONTANT_TTC"][0],
+    r"(?:tva|tax)\s*:?\s*(\d+[\s\.,]*\d*\s*(?:%|€|EUR)?)":
+        DEFAULT_PATTERNS["TVA"][0],
+    r"(?:ref|référence|facture)\s*:?\s*([A-Z0-9]{4,}[-\/][A-Z0-9]{4,})":
+        DEFAULT_PATTERNS["REFERENCE"][0],
+    r"(?:tel|téléphone|tél)\s*:?\s*((?:\+\d{2,3})?[\s\.]?\d{1,2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2})":
+        DEFAULT_PATTERNS["PHONE"][0],
+}
+
+TOKEN_PATTERN = re.compile(r"\S+")
+
+# Entité d'une fenêtre ramenée aux positions du texte complet
+EntitySpan = namedtuple("EntitySpan", ["start_char", "end_char", "label_", "text"])
+
+
+def _page_windows(text, window_tokens, overlap_tokens, window_chars):
+    """Fenêtres (début, fin) de chaque page; deux fenêtres d'une même page partagent `overlap_tokens` mots"""
+    page_start = 0
+    while page_start <= len(text):
+        page_end = text.find(PAGE_BREAK, page_start)
+        if page_end < 0:
+            page_end = len(text)
+        tokens = deque()
+        fresh = 0
+        for match in TOKEN_PATTERN.finditer(text, page_start, page_end):
+            tokens.append(match.span())
+            fresh += 1
+            if len(tokens) >= window_tokens or tokens[-1][1] - tokens[0][0] >= window_chars:
+                yield tokens[0][0], tokens[-1][1]
+                keep = min(overlap_tokens, len(tokens) - 1)
+                while len(tokens) > keep:
+                    tokens.popleft()
+                fresh = 0
+        if fresh:
+            yield tokens[0][0], tokens[-1][1]
+        page_start = page_end + 1
+
+
+def text_windows(text, window_tokens=WINDOW_TOKENS, overlap_tokens=WINDOW_OVERLAP, window_chars=WINDOW_CHARS):
+    """
+    Fenêtres (début, fin, début attribué, fin attribuée) du texte, générées au fur et à
+    mesure. Les zones attribuées se suivent sans se recouvrir: une entité est gardée par
+    la fenêtre à laquelle sa position de début est attribuée (milieu du chevauchement),
+    ce qui élimine les doublons aux jointures.
+    """
+    overlap_tokens = min(overlap_tokens, window_tokens - 1)
+    previous = None
+    owned_from = 0
+    for start, end in _page_windows(text, window_tokens, overlap_tokens, window_chars):
+        if previous is not None:
+            boundary = (start + previous[1]) // 2 if start < previous[1] else start
+            yield previous[0], previous[1], owned_from, boundary
+            owned_from = boundary
+        previous = (start, end)
+    if previous is not None:
+        yield previous[0], previous[1], owned_from, len(text)
+
+def field_tiers(entities):
+    """Étage (règles ou NER) de la meilleure valeur de chaque champ"""
+    return {key: TIER_NER if values[0]["source"] == "ml_model" else TIER_RULES
+            for key, values in entities.items() if values}
+
 class AdaptiveInvoiceParser:
-    def __init__(self, model_path=None):
-        # Charger un modèle existant ou en créer un nouveau
-        try:
-            self.nlp = spacy.load(model_path) if model_path else spacy.blank("fr")
-            self.setup_pipeline()
-        except:
-            self.nlp = spacy.blank("fr")
-            self.setup_pipeline()
+    def __init__(self, model_path=None, training_queue=None, shared_model=True):
+        # Le pipeline spaCy (et spaCy lui-même) n'est chargé qu'au premier accès à
+        # self.nlp. Avec shared_model, il vient du cache LRU du registre et peut être
+        # partagé entre plusieurs parsers.
+        self.shared_model = bool(model_path) and shared_model
+        self.model_path = model_path
+        self._nlp = None
+        # Un NER jamais entraîné n'apporte rien: sans modèle, seules les règles regex
+        # sont appliquées et spaCy n'est pas chargé pour extraire
+        self.ner_trained = bool(model_path)
         
         self.training_data = []
         self.model_version = 1
         self.last_trained = datetime.now().isoformat()
+        # File d'entraînement en arrière-plan (training_queue.FeedbackQueue); sans file,
+        # le réentraînement a lieu directement dans record_feedback
+        self.training_queue = training_queue
         
-        # Fallback regex patterns pour la robustesse
-        self.patterns = {
-            "DATE": [r"(\d{1,2}[\/\.-]\d{1,2}[\/\.-]\d{2,4})"],
-            "MONTANT_HT": [r"(?:total|montant)?\s+ht\s*:?\s*(\d+[\s\.,]*\d*\s*(?:€|EUR)?)"],
-            "MONTANT_TTC": [r"(?:total|montant)?\s+ttc\s*:?\s*(\d+[\s\.,]*\d*\s*(?:€|EUR)?)"],
-            "TVA": [r"(?:tva|tax)\s*:?\s*(\d+[\s\.,]*\d*\s*(?:%|€|EUR)?)"],
-            "REFERENCE": [r"(?:ref|référence|facture)\s*:?\s*([A-Z0-9]{4,}[-\/][A-Z0-9]{4,})"],
-            "PHONE": [r"(?:tel|téléphone|tél)\s*:?\s*((?:\+\d{2,3})?[\s\.]?\d{1,2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2}[\s\.\-]?\d{2})"]
-        }
+        # Fallback regex patterns pour la robustesse (compilés dans self.registry)
+        self.patterns = {label: list(sources) for label, sources in DEFAULT_PATTERNS.items()}
+        
+        # Version, date d'entraînement et patterns enregistrés avec le modèle
+        if model_path:
+            self._apply_metadata(model_path)
+    
+    @property
+    def patterns(self):
+        """Patterns de secours par type d'entité"""
+        return self._patterns
+    
+    @patterns.setter
+    def patterns(self, patterns):
+        # Registre compilé partagé, obtenu une fois par jeu de patterns
+        self._patterns = patterns
+        self.registry = get_registry(patterns)
+    
+    @property
+    def nlp(self):
+        """Pipeline spaCy, chargé à la première utilisation"""
+        if self._nlp is None:
+            self._load_pipeline()
+        return self._nlp
+    
+    @nlp.setter
+    def nlp(self, value):
+        self._nlp = value
+    
+    def _load_pipeline(self):
+        """Charge le modèle existant ou crée un pipeline vierge"""
+        import spacy
+        
+        try:
+            self._nlp = load_language(self.model_path, shared=self.shared_model) if self.model_path else spacy.blank("fr")
+            self.setup_pipeline()
+        except:
+            self.model_path = None
+            self.shared_model = False
+            self.ner_trained = False
+            self._nlp = spacy.blank("fr")
+            self.setup_pipeline()
+    
+    def warm_up(self):
+        """Charge dès maintenant le pipeline s'il sera utilisé pour l'extraction"""
+        if self.ner_trained:
+            self.nlp
+        return self._nlp is not None
     
     def setup_pipeline(self):
         # Si le pipeline n'existe pas déjà
-        if "ner" not in self.nlp.pipe_names:
-            ner = self.nlp.create_pipe("ner") if hasattr(self.nlp, 'create_pipe') else self.nlp.add_pipe("ner")
-            self.nlp.add_pipe("ner") if hasattr(self.nlp, 'add_pipe') and "ner" not in self.nlp.pipe_names else None
-        else:
-            ner = self.nlp.get_pipe("ner")
+        created = "ner" not in self.nlp.pipe_names
+        ner = self.nlp.add_pipe("ner") if created else self.nlp.get_pipe("ner")
         
         # Ajouter les étiquettes d'entité
-        for label in ["DATE", "MONTANT_HT", "MONTANT_TTC", "TVA", "REFERENCE", "ADDRESS", "RECIPIENT", "PHONE"]:
+        for label in ENTITY_LABELS:
             try:
                 ner.add_label(label)
             except:
                 # Si l'étiquette existe déjà, passer à la suivante
                 pass
+        
+        # Un composant NER neuf doit être initialisé avant de pouvoir annoter
+        if created:
+            self.nlp.initialize()
     
-    def extract_entities(self, text):
-        """Extrait les entités d'un texte en utilisant le modèle NER et des règles de secours"""
-        doc = self.nlp(text)
-        entities = {}
+    @property
+    def cache_version(self):
+        """
+        Version du modèle, des règles (patterns des deux parsers et libellés), du classifieur
+        de type et du répertoire des noms, pour le cache des résultats: un déploiement qui
+        change les règles invalide aussi les résultats adaptatifs
+        """
+        return (f"{self.model_version}-{RULES_VERSION}-{self.registry.fingerprint[:12]}-"
+                f"{get_classifier().version}-{get_gazetteer().version}")
+    
+    def extract_entities(self, text, timer=None, overlay=None, cascade=False):
+        """
+        Extrait les entités d'un texte en utilisant le modèle NER et des règles de secours,
+        avec la surcouche de l'entreprise (company_overlay.CompanyOverlay) si elle est donnée.
+        
+        Avec cascade=True, les règles passent d'abord et le NER n'est lancé que pour les
+        champs requis absents ou peu sûrs (voir fields_needing_ner): un document propre
+        coûte le prix des regex.
+        """
+        timer = timer or StageTimer()
+        if not self.ner_trained:
+            return self._entities_from_doc(None, text, timer, overlay)
+        if cascade:
+            result = self._entities_from_doc(None, text, timer, overlay)
+            needed = self.fields_needing_ner(result, overlay)
+            if needed:
+                with timer.stage("ner"):
+                    doc = self._windowed_entities(text) if len(text) > CHUNK_CHARS else self.nlp(text)
+                with timer.stage("merge"):
+                    self._merge_ner(result, doc, needed, overlay)
+            result["cascade"] = {"ner_labels": sorted(needed)}
+            result["processing_time"] = round(timer.elapsed(), 6)
+            result["timings"] = timer.as_dict()
+            return result
+        with timer.stage("ner"):
+            doc = self._windowed_entities(text) if len(text) > CHUNK_CHARS else self.nlp(text)
+        return self._entities_from_doc(doc, text, timer, overlay)
+    
+    def fields_needing_ner(self, result, overlay=None):
+        """
+        Étiquettes requises (pour le type du document) sans valeur, ou dont la meilleure
+        valeur a une confiance sous CASCADE_MIN_CONFIDENCE (ou sous le seuil de l'entreprise)
+        """
+        labels = DOCUMENT_TYPE_LABELS.get(result["document_type"]["type"])
+        needed = set()
+        for label in CASCADE_REQUIRED_LABELS:
+            if labels is not None and label not in labels:
+                continue
+            values = result["entities"].get(label.lower())
+            minimum = CASCADE_MIN_CONFIDENCE
+            if overlay and label in LABEL_FIELDS:
+                minimum = max(minimum, overlay.threshold(LABEL_FIELDS[label]))
+            if not values or values[0]["confidence"] < minimum:
+                needed.add(label)
+        return needed
+    
+    def _merge_ner(self, result, doc, needed, overlay=None):
+        """Place en tête les entités du NER pour les étiquettes `needed` d'un résultat des règles"""
+        entities = result["entities"]
+        for key, found in self._ml_entities(doc, needed).items():
+            values = {entity["value"] for entity in found}
+            entities[key] = found + [entity for entity in entities.get(key, []) if entity["value"] not in values]
+        if overlay:
+            self.apply_thresholds(overlay, entities)
+        result["tiers"] = field_tiers(entities)
+    
+    def _windowed_entities(self, text, batch_size=WINDOW_BATCH_SIZE):
+        """
+        Entités d'un long texte, fenêtre par fenêtre (voir text_windows): seules
+        `batch_size` fenêtres sont en mémoire à la fois, les positions sont celles du texte complet
+        """
+        return next(self._pipe_windows([(text, None)], batch_size))[1]
+    
+    def _pipe_windows(self, items, batch_size, n_process=1):
+        """
+        Passe NER de textes (texte, contexte) en un seul flux nlp.pipe, quelle que soit leur
+        longueur: un texte court est une seule entrée (Doc), un texte de plus de CHUNK_CHARS
+        caractères est découpé par text_windows et ses fenêtres suivent dans le même flux
+        (liste d'EntitySpan aux positions du texte complet).
+        Génère (texte, Doc ou liste d'EntitySpan, contexte) dans l'ordre des textes: le
+        pool de processus (n_process) n'est créé qu'une fois pour tout le flux.
+        """
+        texts = {}
+        
+        def windows():
+            for index, (text, context) in enumerate(items):
+                texts[index] = (text, context)
+                if len(text) <= CHUNK_CHARS:
+                    yield text, (index, None, True)
+                    continue
+                # Fenêtre suivante lue d'avance pour marquer la dernière du texte
+                parts = text_windows(text)
+                window = next(parts, (0, 0, 0, 0))
+                while window is not None:
+                    following = next(parts, None)
+                    yield text[window[0]:window[1]], (index, window, following is None)
+                    window = following
+        
+        spans = []
+        for doc, (index, window, last) in self.nlp.pipe(windows(), as_tuples=True, batch_size=batch_size,
+                                                        n_process=n_process):
+            if window is None:
+                text, context = texts.pop(index)
+                yield text, doc, context
+                continue
+            start, _, owned_from, owned_to = window
+            for ent in doc.ents:
+                if owned_from <= start + ent.start_char < owned_to:
+                    spans.append(EntitySpan(start + ent.start_char, start + ent.end_char, ent.label_, ent.text))
+            if last:
+                text, context = texts.pop(index)
+                yield text, spans, context
+                spans = []
+    
+    def extract_entities_batch(self, texts, batch_size=64, n_process=1, overlay=None, cascade=False):
+        """
+        Extrait les entités de plusieurs textes en une passe avec nlp.pipe: les textes et
+        les fenêtres des longs textes forment un seul flux (voir _pipe_windows), les règles
+        sont appliquées document par document à la sortie du NER.
+        Les résultats sont retournés (sous forme de générateur) dans l'ordre des textes.
+        Avec cascade=True, seuls les textes dont un champ requis manque passent par le NER.
+        """
+        if not self.ner_trained:
+            for text in texts:
+                yield self._entities_from_doc(None, text, overlay=overlay)
+            return
+        if cascade:
+            yield from self._cascade_batch(texts, batch_size, n_process, overlay)
+            return
+        
+        for text, doc, _ in self._pipe_windows(((text, None) for text in texts), batch_size, n_process):
+            yield self._entities_from_doc(doc, text, overlay=overlay)
+    
+    def _cascade_batch(self, texts, batch_size, n_process, overlay=None):
+        """
+        Cascade en flux: règles pour chaque texte, puis un seul flux nlp.pipe pour ceux
+        qui en ont besoin; les résultats sortent dans l'ordre des textes
+        """
+        # Résultats dans l'ordre des textes: [résultat, champs encore attendus du NER]
+        waiting = deque()
+        
+        def needing_ner():
+            for text in texts:
+                result = self._entities_from_doc(None, text, overlay=overlay)
+                needed = self.fields_needing_ner(result, overlay)
+                result["cascade"] = {"ner_labels": sorted(needed)}
+                entry = [result, needed]
+                waiting.append(entry)
+                if needed:
+                    yield text, entry
         
-        # Récupérer les entités détectées par le modèle ML
-        for ent in doc.ents:
+        for _, doc, entry in self._pipe_windows(needing_ner(), batch_size, n_process):
+            self._merge_ner(entry[0], doc, entry[1], overlay)
+            entry[1] = None
+            while waiting and not waiting[0][1]:
+                yield waiting.popleft()[0]
+        while waiting:
+            yield waiting.popleft()[0]
+    
+    def _ml_entities(self, doc, labels=None):
+        """Entités du NER (Doc ou liste d'EntitySpan) par clé, limitées aux étiquettes `labels`"""
+        entities = {}
+        for ent in (doc.ents if hasattr(doc, "ents") else doc or ()):
+            if labels is not None and ent.label_ not in labels:
+                continue
             key = ent.label_.lower()
             if key not in entities:
                 entities[key] = []
@@ -63,111 +423,421 @@ class AdaptiveInvoiceParser:
             entities[key].append({
                 "value": ent.text,
                 "confidence": confidence,
-                "source": "ml_model"
+                "source": "ml_model",
+                "start": ent.start_char,
+                "end": ent.end_char
             })
+        return entities
+    
+    def _entities_from_doc(self, doc, text, timer=None, overlay=None):
+        """
+        Construit le résultat d'extraction à partir d'un Doc déjà annoté, des entités
+        d'un texte traité par fenêtres (liste d'EntitySpan), ou de None (regex seules).
+        Les règles sont évaluées dans la limite du budget du document (TimeBudget).
+        """
+        timer = timer or StageTimer()
+        budget = TimeBudget()
+        entities = {}
+        
+        # Texte normalisé une fois pour les règles (le NER lit le texte d'origine)
+        with timer.stage("normalize"):
+            normalized = normalize_text(text)
+            clean = normalized.text
+        
+        # Seules les étiquettes qui s'appliquent au type du document sont retenues
+        with timer.stage("classify"):
+            document_type = classify(clean)
+            labels = DOCUMENT_TYPE_LABELS.get(document_type["type"])
+        
+        with timer.stage("merge"):
+            # Récupérer les entités détectées par le modèle ML
+            entities.update(self._ml_entities(doc, labels))
+            
+            # Valeurs qui suivent un libellé connu, même abîmé par l'OCR ("TotalenTTC")
+            labeled = extract_values(clean)
+            
+            # Un nom confirmé (vendor_gazetteer) passe devant le NER, sauf s'il contredit
+            # le nom écrit après son libellé: il ne vient alors qu'après la valeur libellée
+            known_name = None
+            if labels is None or "RECIPIENT" in labels:
+                # Les noms confirmés par l'entreprise passent devant le répertoire commun
+                known_name = (overlay.match_name(clean) if overlay else None) or get_gazetteer().match(clean)
+            if known_name:
+                labeled_name = labeled.get("vendor")
+                candidate = {"value": known_name["value"], "confidence": known_name["confidence"], "source": "gazetteer"}
+                if labeled_name and not same_name(known_name["value"], labeled_name["value"]):
+                    candidate["confidence"] = CONTRADICTED_NAME_CONFIDENCE
+                    entities.setdefault("recipient", []).append(candidate)
+                else:
+                    entities["recipient"] = [candidate] + [
+                        entity for entity in entities.get("recipient", []) if entity["value"] != known_name["raw"]]
         
         # Utiliser les règles regex comme fallback pour les entités manquantes
-        self.apply_regex_rules(text, entities)
+        with timer.stage("regex"):
+            if overlay:
+                self.apply_overlay(overlay, clean, entities, labels, budget)
+            self.apply_regex_rules(clean, entities, labels, budget, labeled)
+            self.score_amounts(clean, entities, labels)
+            self.corroborate_rules(clean, document_type["type"], entities, labels, budget)
+            if overlay:
+                self.apply_thresholds(overlay, entities)
+        
+        # Lignes d'articles, contrôlées par quantité × prix unitaire et par le montant HT
+        line_items = None
+        if budget.allows("line_items"):
+            with timer.stage("line_items"):
+                montant_ht = entities["montant_ht"][0]["value"] if entities.get("montant_ht") else None
+                line_items = extract_line_items(normalized_tokens(normalized), montant_ht, detect_currency(clean))
         
-        return {"entities": entities}
+        result = {"entities": entities, "document_type": document_type, "line_items": line_items,
+                  "tiers": field_tiers(entities), "processing_time": round(timer.elapsed(), 6), "timings": timer.as_dict()}
+        if budget.skipped:
+            result["budget"] = budget.as_dict()
+            logger.warning("Budget des règles dépassé (%d ms), non évalués: %s", budget.milliseconds, budget.skipped)
+        return result
+    
+    def apply_overlay(self, overlay, text, entities, labels=None, budget=None):
+        """Place en tête les valeurs trouvées par les patterns propres à l'entreprise"""
+        for field, match in overlay.match_patterns(text, budget).items():
+            label = LABEL_INDEX_FIELDS.get(field)
+            if label is None or (labels is not None and label not in labels):
+                continue
+            key = label.lower()
+            value = match.value.strip()
+            entities[key] = [{
+                "value": value,
+                "confidence": 0.9,
+                "source": "company_pattern"
+            }] + [entity for entity in entities.get(key, []) if entity["value"] != value]
+    
+    def score_amounts(self, text, entities, labels=None):
+        """
+        Confiance des montants d'après leur cohérence (HT + TVA = TTC, voir solve_amounts):
+        une valeur confirmée prend la confiance de la combinaison, une valeur manquante est
+        ajoutée, et les valeurs de chaque montant sont triées par confiance décroissante
+        """
+        amounts = solve_amounts(AmountIndex(text))
+        if not amounts:
+            return
+        for label, field in SOLVED_AMOUNT_LABELS.items():
+            if (labels is not None and label not in labels) or amounts[field] is None:
+                continue
+            key = label.lower()
+            solved = parse_amount(amounts[field], amounts["currency"])
+            candidates = entities.setdefault(key, [])
+            matching = [entity for entity in candidates
+                        if parse_amount(entity["value"], amounts["currency"]) == solved]
+            if matching:
+                for entity in matching:
+                    entity["confidence"] = max(entity["confidence"], amounts["confidence"])
+            else:
+                candidates.append({
+                    "value": amounts[field],
+                    "confidence": amounts["confidence"],
+                    "source": "amount_solver"
+                })
+            candidates.sort(key=lambda entity: entity["confidence"], reverse=True)
     
-    def apply_regex_rules(self, text, entities):
-        """Applique des règles basées sur des expressions régulières pour compléter l'extraction"""
-        for entity_type, patterns in self.patterns.items():
+    def corroborate_rules(self, text, document_type, entities, labels=None, budget=None):
+        """
+        Confiance des références d'après les règles compilées du parser simple pour ce
+        type de document: une valeur qu'elles retrouvent passe à CORROBORATED_CONFIDENCE,
+        sinon la leur est ajoutée avec la confiance de son pattern
+        """
+        patterns = TYPE_PATTERN_SETS.get(document_type, TYPE_PATTERN_SETS[None])
+        scan = TYPE_REGISTRIES.get(document_type, TYPE_REGISTRIES[None]).scan(text, budget)
+        for field, label in DOCUMENT_RULE_FIELDS.items():
+            if labels is not None and label not in labels:
+                continue
+            match = scan.first(field)
+            value = match.value.strip() if match else ""
+            if not value:
+                continue
+            key = label.lower()
+            candidates = entities.setdefault(key, [])
+            matching = [entity for entity in candidates if normalize_value(entity["value"]) == normalize_value(value)]
+            if matching:
+                for entity in matching:
+                    entity["confidence"] = max(entity["confidence"], CORROBORATED_CONFIDENCE)
+            else:
+                source = patterns[field][match.priority]
+                specific = source in TYPE_SPECIFIC_PATTERNS.get(field, {}) or \
+                    source in TYPE_PATTERNS.get(document_type, {}).get(field, [])
+                candidates.append({
+                    "value": value,
+                    "confidence": TYPE_RULE_CONFIDENCE if specific else GENERAL_RULE_CONFIDENCE,
+                    "source": "document_rules"
+                })
+            candidates.sort(key=lambda entity: entity["confidence"], reverse=True)
+    
+    def apply_thresholds(self, overlay, entities):
+        """Écarte les valeurs sous le seuil de confiance fixé par l'entreprise pour leur champ"""
+        for field, threshold in overlay.thresholds.items():
+            key = LABEL_INDEX_FIELDS.get(field, "").lower()
+            if key in entities:
+                kept = [entity for entity in entities[key] if entity["confidence"] >= threshold]
+                if kept:
+                    entities[key] = kept
+                else:
+                    del entities[key]
+    
+    def apply_regex_rules(self, text, entities, labels=None, budget=None, labeled=None):
+        """
+        Applique des règles basées sur des expressions régulières pour compléter l'extraction
+        (seulement pour les étiquettes `labels` si elles sont données), dans la limite du
+        budget du document s'il est donné. `labeled` évite de recalculer les valeurs
+        libellées (extract_values) quand l'appelant les a déjà.
+        """
+        # Valeurs qui suivent un libellé connu, même abîmé par l'OCR ("TotalenTTC"): elles
+        # complètent les champs vides et passent devant un nom connu qui les contredit
+        if labeled is None:
+            labeled = extract_values(text)
+        for field, found in labeled.items():
+            label = LABEL_INDEX_FIELDS[field]
+            key = label.lower()
+            current = entities.get(key, [])
+            if (labels is not None and label not in labels) or \
+                    any(entity["source"] != "gazetteer" or entity["confidence"] > CONTRADICTED_NAME_CONFIDENCE
+                        for entity in current):
+                continue
+            entities[key] = [{
+                "value": found["value"],
+                "confidence": 0.75 if found["distance"] == 0 else 0.65,
+                "source": "label_index"
+            }] + current
+        
+        scan = self.registry.scan(text, budget)
+        
+        for entity_type in self.patterns:
+            if labels is not None and entity_type not in labels:
+                continue
             key = entity_type.lower()
             
             # Ne pas appliquer les règles si l'entité est déjà détectée par le modèle ML
             if key in entities and entities[key]:
                 continue
             
-            for pattern in patterns:
-                matches = re.finditer(pattern, text, re.IGNORECASE)
+            # Une seule correspondance par règle suffit
+            for match in scan.first_per_pattern(entity_type):
+                if key not in entities:
+                    entities[key] = []
                 
-                for match in matches:
-                    if key not in entities:
-                        entities[key] = []
-                    
-                    value = match.group(1) if match.groups() else match.group(0)
-                    entities[key].append({
-                        "value": value.strip(),
-                        "confidence": 0.7,  # Confiance plus faible pour les règles
-                        "source": "regex"
-                    })
-                    
-                    # Une seule correspondance par règle suffit
-                    break
+                entities[key].append({
+                    "value": match.value.strip(),
+                    "confidence": 0.7,  # Confiance plus faible pour les règles
+                    "source": "regex"
+                })
     
-    def record_feedback(self, text, original_entities, corrected_entities):
-        """Enregistre les corrections pour un apprentissage ultérieur"""
+    def record_feedback(self, text, original_entities, corrected_entities, company=None):
+        """
+        Enregistre les corrections pour un apprentissage ultérieur. Les noms confirmés vont
+        dans la surcouche de l'entreprise `company` si elle est donnée, sinon en attente du
+        répertoire commun (vendor_gazetteer.promote_names); le modèle partagé apprend de
+        tous les feedbacks.
+        """
         # Conversion des entités au format d'entraînement spaCy
-        training_entities = []
+        alignment = {}
+        sample = feedback_to_training_sample(text, corrected_entities, alignment)
         
-        for entity_name, entities in corrected_entities.items():
-            if not entities:
-                continue
-                
-            # Prendre la première entité si c'est une liste
-            entity_value = entities[0]["value"] if isinstance(entities, list) and "value" in entities[0] else entities
-            
-            # Trouver la position de l'entité dans le texte
-            start_idx = text.find(entity_value)
-            if start_idx >= 0:
-                end_idx = start_idx + len(entity_value)
-                training_entities.append((start_idx, end_idx, entity_name.upper()))
+        # Les noms confirmés servent dès la prochaine extraction de l'entreprise, sans réentraînement
+        names_added = learn_company_names(company, text, corrected_entities) if company else 0
+        names_staged = 0 if company else stage_feedback_names(text, corrected_entities)
+        
+        # Avec une file d'entraînement, le réentraînement se fait en arrière-plan
+        if sample and self.training_queue is not None:
+            self.training_queue.put(sample)
+            return {
+                "recorded": True,
+                "queued": True,
+                "pending_samples": self.training_queue.pending_count(),
+                "model_version": self.model_version,
+                "alignment": alignment,
+                "known_names_added": names_added,
+                "known_names_staged": names_staged
+            }
+        
+        recorded = sample is not None
+        
+        # Un type de document corrigé réapprend le classifieur de type
+        if sample and "cats" in sample[1] and add_examples([sample]):
+            train_classifier()
+            sample = (sample[0], {"entities": sample[1]["entities"]}) if sample[1]["entities"] else None
         
         # Ajouter aux données d'entraînement
-        if training_entities:
-            self.training_data.append((text, {"entities": training_entities}))
+        if sample:
+            self.training_data.append(sample)
             
             # Si nous avons suffisamment de données, réentraîner
             if len(self.training_data) >= 10:  # Seuil plus bas pour les tests
                 self.train()
         
         return {
-            "recorded": len(training_entities) > 0,
+            "recorded": recorded,
             "pending_samples": len(self.training_data),
-            "model_version": self.model_version
+            "model_version": self.model_version,
+            "alignment": alignment,
+            "known_names_added": names_added,
+            "known_names_staged": names_staged
         }
     
-    def train(self, iterations=30):
-        """Entraîne ou réentraîne le modèle NER avec les données de feedback"""
-        if not self.training_data:
+    def train(self, iterations=30, max_seconds=None, dropout=0.2, batch_start=4.0, batch_stop=32.0,
+              batch_compound=1.001, dev_fraction=0.2, patience=3, seed=0, models_dir=None, corpus=None):
+        """
+        Entraîne ou réentraîne le modèle NER avec les données de feedback.
+        
+        L'entraînement reprend les poids du modèle courant (resume_training) au lieu de
+        les réinitialiser. Les exemples sont mélangés à chaque époque et regroupés en
+        minibatches de taille croissante (batch_start -> batch_stop). Une partie des
+        feedbacks (dev_fraction) est mise de côté pour l'arrêt anticipé: l'entraînement
+        s'arrête après `patience` époques sans amélioration du F1 et garde les meilleurs
+        poids. `iterations` (époques) et `max_seconds` bornent le budget.
+        
+        Avec `corpus` (training_corpus.TrainingCorpus), les exemples sont lus au fil des
+        fichiers DocBin du corpus compilé à chaque époque, et son jeu "dev" sert à l'arrêt
+        anticipé; sinon ils sont construits depuis self.training_data.
+        
+        Le modèle entraîné est publié de façon atomique dans `models_dir` (voir
+        model_registry.ModelRegistry.publish).
+        """
+        if corpus is not None and not corpus.count("train"):
+            return {"status": "no_data", "model_version": self.model_version}
+        if corpus is None and not self.training_data:
             return {"status": "no_data", "model_version": self.model_version}
             
-        print(f"Début d'entraînement avec {len(self.training_data)} échantillons...")
+        sample_count = corpus.count("train") + corpus.count("dev") if corpus is not None else len(self.training_data)
+        logger.info("Début d'entraînement avec %d échantillons...", sample_count)
         
-        # Convertir les données en format d'entraînement Spacy
-        examples = []
-        for text, annots in self.training_data:
-            doc = self.nlp.make_doc(text)
-            example = Example.from_dict(doc, annots)
-            examples.append(example)
+        # Un pipeline partagé (cache du registre) n'est jamais modifié: entraîner une copie
+        # (s'il n'est pas encore chargé, self.nlp chargera directement la copie)
+        if self.shared_model:
+            self.shared_model = False
+            if self._nlp is not None:
+                self.nlp = load_language(self.model_path, shared=False)
         
-        # Désactiver les autres composants de pipeline pendant l'entraînement
-        other_pipes = [pipe for pipe in self.nlp.pipe_names if pipe != "ner"]
+        from spacy.training import Example
+        from spacy.util import minibatch
+        from thinc.api import compounding
         
-        with self.nlp.disable_pipes(*other_pipes):
-            # Initialiser l'optimiseur
-            optimizer = self.nlp.begin_training()
+        ner = self.nlp.get_pipe("ner")
+        rng = random.Random(seed)
+        # Entités écartées faute d'alignement sur les jetons (le corpus compilé les compte à l'ajout)
+        misaligned_entities = 0
+        if corpus is not None:
+            # Corpus compilé: exemples relus fichier par fichier à chaque époque
+            for label in corpus.labels:
+                if label not in ner.labels:
+                    ner.add_label(label)
+            dev_examples = list(corpus.examples(self.nlp, "dev"))
+            train_count = corpus.count("train")
+            epoch_examples = lambda: corpus.examples(self.nlp, "train", rng)
+            entity_types = set(corpus.labels)
+        else:
+            # Convertir les données en format d'entraînement Spacy, entités calées sur
+            # les jetons comme dans le corpus compilé (training_corpus)
+            examples = []
+            for text, annots in self.training_data:
+                doc = self.nlp.make_doc(text)
+                spans, misaligned = snap_to_tokens(doc, annots.get("entities", []))
+                misaligned_entities += misaligned
+                for span in spans:
+                    if span.label_ not in ner.labels:
+                        ner.add_label(span.label_)
+                entities = [(span.start_char, span.end_char, span.label_) for span in spans]
+                examples.append(Example.from_dict(doc, {**annots, "entities": entities}))
+            
+            # Séparer un jeu de validation pour l'arrêt anticipé (s'il y a assez d'exemples)
+            rng.shuffle(examples)
+            dev_size = int(len(examples) * dev_fraction) if len(examples) >= 5 else 0
+            dev_examples, train_examples = examples[:dev_size], examples[dev_size:]
+            train_count = len(train_examples)
             
-            # Entraîner le modèle
-            for i in range(iterations):
+            def epoch_examples():
+                rng.shuffle(train_examples)
+                return train_examples
+            entity_types = {label for _, annots in self.training_data for _, _, label in annots["entities"]}
+        
+        loss_curve = []
+        best_score, best_weights, best_epoch = None, None, 0
+        epochs_without_improvement = 0
+        examples_seen = 0
+        started = time.perf_counter()
+        
+        # Ne mettre à jour que le composant NER
+        with self.nlp.select_pipes(enable=["ner"]):
+            # Reprendre l'entraînement à partir des poids actuels
+            optimizer = self.nlp.resume_training()
+            batch_sizes = compounding(batch_start, batch_stop, batch_compound)
+            
+            for epoch in range(iterations):
                 losses = {}
-                for example in examples:
-                    self.nlp.update([example], drop=0.5, sgd=optimizer, losses=losses)
+                for batch in minibatch(epoch_examples(), size=batch_sizes):
+                    self.nlp.update(batch, drop=dropout, sgd=optimizer, losses=losses)
+                    examples_seen += len(batch)
+                
+                epoch_point = {"epoch": epoch + 1, "loss": round(float(losses.get("ner", 0.0)), 4)}
                 
-                print(f"Itération {i+1}/{iterations}, pertes: {losses}")
+                if dev_examples:
+                    score = self.nlp.evaluate(dev_examples).get("ents_f") or 0.0
+                    epoch_point["dev_f1"] = round(float(score), 4)
+                    if best_score is None or score > best_score:
+                        best_score, best_epoch = score, epoch + 1
+                        best_weights = ner.to_bytes()
+                        epochs_without_improvement = 0
+                    else:
+                        epochs_without_improvement += 1
+                
+                loss_curve.append(epoch_point)
+                logger.info("Itération %d/%d, pertes: %s", epoch + 1, iterations, losses)
+                
+                if dev_examples and epochs_without_improvement >= patience:
+                    logger.info("Arrêt anticipé après %d époques sans amélioration", patience)
+                    break
+                if max_seconds is not None and time.perf_counter() - started >= max_seconds:
+                    logger.info("Budget de temps d'entraînement atteint (%ss)", max_seconds)
+                    break
         
-        # Mettre à jour les métadonnées
-        self.model_version += 1
-        self.last_trained = datetime.now().isoformat()
+        # Garder les poids de la meilleure époque sur le jeu de validation
+        if best_weights is not None and best_epoch != len(loss_curve):
+            ner.from_bytes(best_weights)
+        
+        dev_metrics = None
+        if dev_examples:
+            scores = self.nlp.evaluate(dev_examples)
+            dev_metrics = {
+                "precision": round(float(scores.get("ents_p") or 0.0), 4),
+                "recall": round(float(scores.get("ents_r") or 0.0), 4),
+                "f1Score": round(float(scores.get("ents_f") or 0.0), 4)
+            }
         
-        # Sauvegarder le modèle
-        model_dir = os.path.join(os.path.dirname(__file__), "models")
-        os.makedirs(model_dir, exist_ok=True)
+        elapsed = time.perf_counter() - started
+        training_stats = {
+            "epochs": len(loss_curve),
+            "best_epoch": best_epoch or len(loss_curve),
+            "best_dev_f1": round(best_score, 4) if best_score is not None else None,
+            "train_examples": train_count,
+            "dev_examples": len(dev_examples),
+            "misaligned_entities": misaligned_entities,
+            "seconds": round(elapsed, 3),
+            "examples_per_second": round(examples_seen / elapsed, 2) if elapsed > 0 else None,
+            "loss_curve": loss_curve
+        }
         
-        model_path = os.path.join(model_dir, f"invoice_model_v{self.model_version}")
-        self.nlp.to_disk(model_path)
+        # Mettre à jour les métadonnées et publier le modèle (staging, renommage, manifeste)
+        self.last_trained = datetime.now().isoformat()
+        self.model_version, model_path = ModelRegistry(models_dir).publish(
+            self.nlp,
+            {
+                "last_trained": self.last_trained,
+                "patterns": self.patterns,
+                "training_data_count": sample_count,
+                "training": {key: value for key, value in training_stats.items() if key != "loss_curve"}
+            },
+            metrics=dev_metrics,
+            sample_count=sample_count,
+            entity_types=entity_types
+        )
+        self.model_path = model_path
+        self.ner_trained = True
         
         # Réinitialiser les données d'entraînement après sauvegarde
         self.training_data = []
@@ -175,88 +845,77 @@ class AdaptiveInvoiceParser:
         return {
             "status": "success",
             "model_version": self.model_version,
-            "model_path": model_path
+            "model_path": model_path,
+            "training": training_stats,
+            "dev_metrics": dev_metrics
         }
     
-    def evaluate(self, test_data):
-        """Évalue les performances du modèle sur un jeu de test"""
+    def evaluate(self, test_data, n_process=1, batch_size=64):
+        """
+        Évalue les performances du modèle sur un jeu de test.
+        
+        Avec n_process > 1 (borné au nombre de processeurs), chaque processus du pool
+        charge son propre modèle puis extrait (règles et NER) et compare ses documents:
+        tout le travail par document est réparti. Sinon l'extraction passe par
+        extract_entities_batch. Retourne les métriques globales et, dans "per_entity",
+        la précision et le rappel par type.
+        """
         if not test_data:
             return {"error": "No test data provided"}
-            
-        true_positives = 0
-        false_positives = 0
-        false_negatives = 0
         
-        for item in test_data:
-            text = item["text"]
-            expected = item["entities"]
-            
-            # Prédiction
-            extracted = self.extract_entities(text)["entities"]
-            
-            # Comparaison des résultats
-            for entity_type, expected_values in expected.items():
-                extracted_values = extracted.get(entity_type, [])
-                
-                # Convertir en liste si ce n'est pas déjà le cas
-                if not isinstance(expected_values, list):
-                    expected_values = [expected_values]
-                
-                expected_texts = [val["value"] if isinstance(val, dict) else val for val in expected_values]
-                extracted_texts = [val["value"] for val in extracted_values]
-                
-                # Compter les vrais/faux positifs et faux négatifs
-                for ext in extracted_texts:
-                    if any(self._is_similar(ext, exp) for exp in expected_texts):
-                        true_positives += 1
-                    else:
-                        false_positives += 1
-                
-                for exp in expected_texts:
-                    if not any(self._is_similar(exp, ext) for ext in extracted_texts):
-                        false_negatives += 1
+        test_data = list(test_data)
+        n_process = min(n_process, os.cpu_count() or 1, len(test_data))
+        if n_process > 1:
+            # Le modèle est relu sur le disque: les processus ne reçoivent que son chemin
+            model_path = self.model_path if self.ner_trained else None
+            chunk_size = max(1, len(test_data) // (n_process * 4))
+            with ProcessPoolExecutor(max_workers=n_process, initializer=_init_evaluation_worker,
+                                     initargs=(model_path, self.patterns)) as pool:
+                item_counts = list(pool.map(_evaluate_item, test_data, chunksize=chunk_size))
+        else:
+            predictions = self.extract_entities_batch((item["text"] for item in test_data), batch_size=batch_size)
+            item_counts = [_score_item((item["entities"], prediction["entities"]))
+                           for item, prediction in zip(test_data, predictions)]
         
-        # Calcul des métriques
-        precision = true_positives / (true_positives + false_positives) if true_positives + false_positives > 0 else 0
-        recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives > 0 else 0
-        f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
+        # Agrégation par type d'entité: [vrais positifs, faux positifs, faux négatifs]
+        per_type = {}
+        for counts in item_counts:
+            for entity_type, (tp, fp, fn) in counts.items():
+                totals = per_type.setdefault(entity_type, [0, 0, 0])
+                totals[0] += tp
+                totals[1] += fp
+                totals[2] += fn
         
-        return {
-            "precision": precision,
-            "recall": recall,
-            "f1_score": f1,
-            "true_positives": true_positives,
-            "false_positives": false_positives,
-            "false_negatives": false_negatives
-        }
+        true_positives = sum(totals[0] for totals in per_type.values())
+        false_positives = sum(totals[1] for totals in per_type.values())
+        false_negatives = sum(totals[2] for totals in per_type.values())
+        
+        result = _metrics(true_positives, false_positives, false_negatives)
+        result["per_entity"] = {entity_type: _metrics(*totals) for entity_type, totals in sorted(per_type.items())}
+        return result
     
     def _is_similar(self, str1, str2, threshold=0.7):
         """Vérifie si deux chaînes sont similaires selon une certaine mesure"""
         # Simple implémentation basée sur la longueur de la sous-chaîne commune la plus longue
-        return self._longest_common_substring(str1, str2) >= threshold * max(len(str1), len(str2))
+        return is_similar(str1, str2, threshold)
     
     def _longest_common_substring(self, s1, s2):
-        """Calcule la longueur de la plus longue sous-chaîne commune"""
-        s1, s2 = s1.lower(), s2.lower()
-        m = [[0] * (1 + len(s2)) for _ in range(1 + len(s1))]
-        longest, x_longest = 0, 0
-        
-        for x in range(1, 1 + len(s1)):
-            for y in range(1, 1 + len(s2)):
-                if s1[x-1] == s2[y-1]:
-                    m[x][y] = m[x-1][y-1] + 1
-                    if m[x][y] > longest:
-                        longest = m[x][y]
-                        x_longest = x
-                else:
-                    m[x][y] = 0
-        
-        return longest
+        """Calcule la longueur de la plus longue sous-chaîne commune (automate des suffixes)"""
+        return longest_common_substring(s1, s2)
     
     def save_model(self, path=None):
-        """Sauvegarde le modèle et ses métadonnées"""
+        """
+        Sauvegarde le modèle et ses métadonnées. Sans chemin, le modèle est publié comme
+        nouvelle version dans le registre (manifeste et politique de rétention).
+        """
         if not path:
-            path = os.path.join(os.path.dirname(__file__), "models", f"invoice_model_v{self.model_version}")
+            self.model_version, path = ModelRegistry().publish(self.nlp, {
+                "last_trained": self.last_trained,
+                "patterns": self.patterns,
+                "training_data_count": len(self.training_data)
+            }, sample_count=len(self.training_data))
+            self.model_path = path
+            return {"status": "success", "path": path}
         
         os.makedirs(os.path.dirname(path), exist_ok=True)
         
@@ -280,20 +939,89 @@ class AdaptiveInvoiceParser:
         """Charge un modèle sauvegardé avec ses métadonnées"""
         try:
             # Charger le modèle spaCy
-            self.nlp = spacy.load(path)
+            self.nlp = load_language(path, shared=False)
+            self.ner_trained = True
             
             # Charger les métadonnées
             with open(f"{path}_metadata.json", "r") as f:
                 metadata = json.load(f)
-            
-            self.model_version = metadata.get("model_version", 1)
-            self.last_trained = metadata.get("last_trained", datetime.now().isoformat())
-            self.patterns = metadata.get("patterns", self.patterns)
+            self._apply_metadata(path, metadata)
             
             return {"status": "success", "model_version": self.model_version}
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+    def _apply_metadata(self, path, metadata=None):
+        """Applique les métadonnées d'un modèle (fichier `<path>_metadata.json` s'il existe)"""
+        if metadata is None:
+            try:
+                with open(f"{path}_metadata.json", "r") as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                return
+        
+        self.model_version = metadata.get("model_version", self.model_version)
+        self.last_trained = metadata.get("last_trained", self.last_trained)
+        self.patterns = {
+            label: [LEGACY_PATTERNS.get(source, source) for source in sources]
+            for label, sources in metadata.get("patterns", self.patterns).items()
+        }
+
+# Parser du processus d'évaluation, chargé une fois par processus (voir evaluate)
+_evaluation_parser = None
+
+def _init_evaluation_worker(model_path, patterns):
+    global _evaluation_parser
+    _evaluation_parser = AdaptiveInvoiceParser(model_path, shared_model=False)
+    _evaluation_parser.patterns = patterns
+    _evaluation_parser.warm_up()
+
+def _evaluate_item(item):
+    """Extrait puis compare un document, dans un processus d'évaluation"""
+    prediction = _evaluation_parser.extract_entities(item["text"])
+    return _score_item((item["entities"], prediction["entities"]))
+
+def _score_item(pair):
+    """
+    Compare les entités attendues et extraites d'un document.
+    Retourne {type: (vrais positifs, faux positifs, faux négatifs)}.
+    """
+    expected, extracted = pair
+    counts = {}
+    
+    for entity_type, expected_values in expected.items():
+        extracted_values = extracted.get(entity_type, [])
+        
+        # Convertir en liste si ce n'est pas déjà le cas
+        if not isinstance(expected_values, list):
+            expected_values = [expected_values]
+        
+        expected_texts = [val["value"] if isinstance(val, dict) else val for val in expected_values]
+        extracted_texts = [val["value"] for val in extracted_values]
+        
+        # Compter les vrais/faux positifs et faux négatifs
+        tp = sum(1 for ext in extracted_texts if any(is_similar(ext, exp) for exp in expected_texts))
+        fp = len(extracted_texts) - tp
+        fn = sum(1 for exp in expected_texts if not any(is_similar(exp, ext) for ext in extracted_texts))
+        counts[entity_type] = (tp, fp, fn)
+    
+    return counts
+
+def _metrics(true_positives, false_positives, false_negatives):
+    """Précision, rappel et F1 à partir des comptes"""
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives > 0 else 0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives > 0 else 0
+    f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
+    
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1_score": f1,
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives
+    }
+
 # Point d'entrée pour les tests
 if __name__ == "__main__":
     parser = AdaptiveInvoiceParser()
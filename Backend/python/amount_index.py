@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Index des montants d'un document et contrôle de cohérence HT + TVA = TTC.
+
+- `parse_amount`: convertit un montant écrit à la française (1 103,36), à la
+  tunisienne (1103,361 DT, trois décimales pour les millimes) ou à l'anglaise
+  (1,103.36) en Decimal, sans passer par float.
+- `AmountIndex`: relève une seule fois tous les montants candidats du texte, avec leur
+  devise (DT, TND, DIN, EUR) et le libellé qui les précède (HT, TVA, TTC). Les valeurs
+  sont rangées par intervalles de 2 centimes dans un dictionnaire pour des recherches en O(1) avec
+  tolérance d'arrondi.
+- `solve_amounts`: pour chaque HT candidat et chaque taux de TVA plausible, cherche le
+  TTC (HT × (1 + taux)) puis la TVA dans l'index: O(montants × taux) recherches au lieu
+  d'essayer tous les triplets. La combinaison retenue est accompagnée d'un score de
+  confiance.
+"""
+
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+# Devises reconnues -> code normalisé
+CURRENCIES = {"€": "EUR", "EUR": "EUR", "DT": "TND", "TND": "TND", "DIN": "TND"}
+
+# Nombre de décimales usuel par devise (le dinar compte 1000 millimes)
+CURRENCY_DECIMALS = {"EUR": 2, "TND": 3}
+
+# Taux de TVA essayés en plus de ceux écrits dans le document (Tunisie, France)
+DEFAULT_RATES = ("19", "13", "7", "20", "10", "5.5", "2.1", "18", "12", "6")
+
+# Les calculs du solveur se font en entiers, en millièmes d'unité (millimes, dixièmes
+# de centime): les montants relevés ont au plus trois décimales
+MILLI = 1000
+
+# Écart toléré entre une valeur calculée et un montant du document (arrondis
+# successifs), en millièmes
+TOLERANCE = 11
+
+# Largeur des intervalles de l'index, en millièmes (plus large que TOLERANCE)
+BUCKET_WIDTH = 20
+
+# Timbre fiscal tunisien, ajouté au TTC de certaines factures
+STAMP_DUTIES = {"TND": (Decimal("0.600"), Decimal("1.000"))}
+
+
+# Montants décimaux (1103,361 ; 1.103,36 ; 1,103.36), ou entiers suivis d'une devise
+AMOUNT_PATTERN = re.compile(
+    r"(?<![\w.,])(\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,3})?|\d+[.,]\d{1,3}|\d+(?=\s*(?:€|EUR|DT|TND|DIN)))"
+    r"(?![\d/-]\d|\d)\s*(€|EUR|DT|TND|DIN)?"
+)
+# Montants avec séparateur de milliers espace (1 103,36): ambigus dans les lignes
+# d'articles ("10 100,00"), ils sont ajoutés en plus des montants compacts
+SPACED_AMOUNT_PATTERN = re.compile(
+    r"(?<![\w.,])(\d{1,3}(?:[ \u00a0\u202f]\d{3})+[.,]\d{1,3})(?!\d)\s*(€|EUR|DT|TND|DIN)?"
+)
+RATE_PATTERN = re.compile(r"(\d{1,2}(?:[.,]\d{1,2})?)\s*%")
+CURRENCY_PATTERN = re.compile(r"€|\b(?:EUR|DT|TND|DIN)\b|(?<=\d)(?:DT|TND|DIN)\b")
+LABEL_PATTERN = re.compile(
+    r"(TTC|T\.T\.C|toutes\s*taxes\s*comprises|HT|H\.T|hors\s*taxes?|TVA|taxe)", re.IGNORECASE
+)
+
+# Longueur maximale du libellé cherché avant un montant (sur la même ligne)
+LABEL_WINDOW = 30
+
+Amount = namedtuple("Amount", ["value", "millis", "text", "start", "end", "currency", "label"])
+
+
+def detect_currency(text):
+    """Devise majoritaire du document (code normalisé), ou None"""
+    counts = {}
+    for match in CURRENCY_PATTERN.finditer(text):
+        code = CURRENCIES[match.group(0)]
+        counts[code] = counts.get(code, 0) + 1
+    return max(counts, key=counts.get) if counts else None
+
+
+def parse_amount(text, currency=None):
+    """
+    Convertit un montant en Decimal (None si illisible). Avec deux séparateurs différents,
+    le dernier est décimal (1.103,36 ; 1,103.36). Un séparateur répété sépare les milliers
+    (1.103.361). Un point unique suivi de trois chiffres est décimal pour le dinar
+    (millimes) et sépare les milliers pour l'euro (1.103 € = 1103).
+    """
+    digits = "".join(char for char in text if char.isdigit() or char in ",.")
+    if not digits or not digits[0].isdigit() or not digits[-1].isdigit():
+        return None
+
+    commas, dots = digits.count(","), digits.count(".")
+    if commas and dots:
+        decimal_separator = "," if digits.rfind(",") > digits.rfind(".") else "."
+    elif commas + dots > 1:
+        # Séparateur répété: groupes de trois chiffres obligatoires
+        separator = "," if commas else "."
+        if any(len(group) != 3 for group in digits.split(separator)[1:]):
+            return None
+        decimal_separator = None
+    elif commas + dots == 1:
+        separator = "," if commas else "."
+        fraction = digits.rsplit(separator, 1)[1]
+        thousands = separator == "." and len(fraction) == 3 and currency == "EUR"
+        decimal_separator = None if thousands else separator
+    else:
+        decimal_separator = None
+
+    if decimal_separator is None:
+        digits = digits.replace(",", "").replace(".", "")
+    else:
+        integer, fraction = digits.rsplit(decimal_separator, 1)
+        digits = integer.replace(",", "").replace(".", "") + "." + fraction
+
+    try:
+        return Decimal(digits)
+    except InvalidOperation:
+        return None
+
+
+def format_amount(value):
+    """Forme texte d'un montant (point décimal, sans séparateur de milliers)"""
+    return format(value, "f")
+
+
+def _label(text, start, floor):
+    """Libellé (HT, TVA ou TTC) écrit juste avant un montant, sur la même ligne"""
+    window_start = max(floor, start - LABEL_WINDOW, text.rfind("\n", 0, start) + 1)
+    labels = LABEL_PATTERN.findall(text, window_start, start)
+    if not labels:
+        return None
+    label = labels[-1].upper().replace(".", "").replace(" ", "")
+    if label.startswith("TTC") or label.startswith("TOUTES"):
+        return "TTC"
+    if label.startswith("HT") or label.startswith("HORS"):
+        return "HT"
+    return "TVA"
+
+
+class AmountIndex:
+    """Montants candidats d'un document, parsés une fois et indexés par valeur"""
+
+    def __init__(self, text):
+        self.text = text
+        self.currency = detect_currency(text)
+        self.amounts = []
+        self._buckets = {}
+
+        seen = set()
+        matches = [m for pattern in (AMOUNT_PATTERN, SPACED_AMOUNT_PATTERN) for m in pattern.finditer(text)]
+        matches.sort(key=lambda m: m.start(1))
+        previous_end = 0
+        for match in matches:
+            span = match.span(1)
+            if span in seen:
+                continue
+            seen.add(span)
+            currency = CURRENCIES[match.group(2)] if match.group(2) else self.currency
+            value = parse_amount(match.group(1), currency)
+            if value is None:
+                continue
+            amount = Amount(value, int(value * MILLI), match.group(1), span[0], span[1], currency,
+                            _label(text, span[0], previous_end))
+            previous_end = span[1]
+            self.amounts.append(amount)
+            # Chaque montant est rangé dans son intervalle et les deux voisins: une
+            # recherche à TOLERANCE près ne consulte qu'une seule entrée
+            key = amount.millis // BUCKET_WIDTH
+            for bucket in (key - 1, key, key + 1):
+                self._buckets.setdefault(bucket, []).append(amount)
+
+        # Taux écrits dans le document (TVA19%, TVA 20 %), en pourcentage
+        self.rates = []
+        for match in RATE_PATTERN.finditer(text):
+            rate = parse_amount(match.group(1))
+            if rate is not None and 0 < rate < 50 and rate not in self.rates:
+                self.rates.append(rate)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def values(self):
+        """Valeurs distinctes en millièmes, par ordre décroissant"""
+        return sorted({amount.millis for amount in self.amounts}, reverse=True)
+
+    def find(self, millis, tolerance=TOLERANCE, label=None):
+        """
+        Montant du document le plus proche de `millis` (en millièmes) à `tolerance`
+        près, ou None. À écart égal, un montant précédé du libellé `label` est préféré.
+        """
+        candidates = self._buckets.get(millis // BUCKET_WIDTH)
+        if not candidates:
+            return None
+        best, best_rank = None, None
+        for amount in candidates:
+            gap = abs(amount.millis - millis)
+            rank = (gap, amount.label != label)
+            if gap <= tolerance and (best is None or rank < best_rank):
+                best, best_rank = amount, rank
+        return best
+
+    def labeled(self, label):
+        """Montants précédés du libellé donné, dans l'ordre du document"""
+        return [amount for amount in self.amounts if amount.label == label]
+
+
+def solve_amounts(index, rates=None):
+    """
+    Retourne la combinaison (HT, taux, TVA, TTC) la plus cohérente du document, ou None:
+    {"montantHT", "tauxTVA", "tva", "montantTTC", "currency", "confidence"}, plus
+    "timbreFiscal" quand le TTC inclut le timbre fiscal tunisien.
+    """
+    if len(index) < 2:
+        return None
+
+    candidate_rates = list(index.rates)
+    for rate in rates or DEFAULT_RATES:
+        rate = Decimal(rate)
+        if rate not in candidate_rates:
+            candidate_rates.append(rate)
+    # Taux en dix-millièmes (19 % -> 1900, 5,5 % -> 550) pour un calcul en entiers
+    scaled_rates = [(rate, int(rate * 100)) for rate in candidate_rates]
+
+    # Arrondi de la TVA calculée au pas de la devise (0,01 € ou 0,001 DT), en millièmes
+    quantum = 10 ** (3 - CURRENCY_DECIMALS.get(index.currency, 2))
+    stamps = (0,) + tuple(int(stamp * MILLI) for stamp in STAMP_DUTIES.get(index.currency, ()))
+    largest = index.values()[0]
+
+    best = None
+    for ht in index.values():
+        if ht <= 0:
+            continue
+        for rate, scaled_rate in scaled_rates:
+            tva_value = (ht * scaled_rate + 5000 * quantum) // (10000 * quantum) * quantum
+            for stamp in stamps:
+                ttc = index.find(ht + tva_value + stamp, label="TTC")
+                if ttc is None or ttc.millis <= ht:
+                    continue
+                tva = index.find(ttc.millis - stamp - ht, label="TVA") or index.find(tva_value, label="TVA")
+                ht_amount = index.find(ht, label="HT")
+                confidence = _confidence(index, ht_amount, tva, ttc, rate, largest)
+                if best is None or (confidence, ttc.millis) > best[:2]:
+                    best = (confidence, ttc.millis, ht_amount, rate, tva, ttc, stamp)
+                break
+
+    if best is None:
+        return None
+
+    confidence, _, ht_amount, rate, tva, ttc, stamp = best
+    if tva is not None:
+        tva_value = tva.value
+    else:
+        # TVA déduite, au pas de la devise; le timbre fiscal n'existe qu'en dinars
+        tva_value = ttc.value - ht_amount.value
+        if stamp:
+            tva_value -= Decimal(stamp).scaleb(-3)
+        tva_value = tva_value.quantize(Decimal(1).scaleb(-CURRENCY_DECIMALS.get(index.currency, 2)))
+    solution = {
+        "montantHT": format_amount(ht_amount.value),
+        "tauxTVA": format_amount(rate.normalize()),
+        "tva": format_amount(tva_value),
+        "montantTTC": format_amount(ttc.value),
+        "currency": ttc.currency,
+        "confidence": confidence,
+    }
+    if stamp:
+        solution["timbreFiscal"] = format_amount(Decimal(stamp).scaleb(-3))
+    return solution
+
+
+def _confidence(index, ht, tva, ttc, rate, largest):
+    """Score de 0 à 1: montants retrouvés, taux écrit, libellés concordants, TTC le plus grand"""
+    score = 0.5
+    if tva is not None:
+        score += 0.2
+    if rate in index.rates:
+        score += 0.1
+    labels = [amount.label == label for amount, label in ((ht, "HT"), (tva, "TVA"), (ttc, "TTC")) if amount]
+    score += 0.15 * sum(labels) / 3
+    if ttc.millis == largest:
+        score += 0.05
+    return round(min(score, 1.0), 3)
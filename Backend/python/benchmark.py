@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark des parsers de factures sur un corpus synthétique (voir invoice_corpus).
+
+Chaque parser est mesuré dans un processus séparé, pour que le démarrage à froid
+(imports, chargement du modèle, premier document) et le pic de mémoire (RSS) ne
+dépendent pas de l'autre parser. Le rapport JSON contient pour chaque parser:
+cold_start_ms, docs_per_second, latence p50/p95/p99, peak_rss_mb et la précision
+d'extraction par champ, afin de comparer les versions entre elles.
+
+Usage:
+    python benchmark.py --count 500 --noise 0.02 --output benchmark.json
+    python benchmark.py --parsers simple --count 2000
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+from datetime import datetime
+
+from invoice_corpus import generate_corpus
+
+# "cascade": parser adaptatif, NER seulement pour les champs que les règles n'ont pas sûrs
+PARSERS = ("simple", "adaptive", "cascade")
+
+FIELDS = ("date", "montantHT", "tva", "montantTTC", "vendor", "reference")
+
+# Étiquettes NER du parser adaptatif -> clés du corpus
+ADAPTIVE_FIELDS = {
+    "DATE": "date",
+    "MONTANT_HT": "montantHT",
+    "TVA": "tva",
+    "MONTANT_TTC": "montantTTC",
+    "RECIPIENT": "vendor",
+    "REFERENCE": "reference",
+}
+
+AMOUNT_FIELDS = {"montantHT", "tva", "montantTTC"}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y%m%d")
+
+
+def peak_rss_mb():
+    """Pic de mémoire résidente du processus en Mo (None si indisponible, ex. Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: kilo-octets ; macOS: octets
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def percentile(sorted_values, fraction):
+    """Percentile par rang le plus proche sur une liste triée"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def normalize_value(field, value):
+    """Forme canonique d'une valeur pour comparer valeur extraite et valeur attendue"""
+    if value is None:
+        return None
+    value = str(value).strip()
+
+    if field in AMOUNT_FIELDS:
+        digits = "".join(char for char in value if char.isdigit() or char in ",.")
+        # Le dernier séparateur est le séparateur décimal, les autres sont des milliers
+        last = max(digits.rfind(","), digits.rfind("."))
+        if last >= 0:
+            digits = digits[:last].replace(",", "").replace(".", "") + "." + digits[last + 1:]
+        try:
+            return round(float(digits), 2)
+        except ValueError:
+            return None
+
+    if field == "date":
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.strptime(value, date_format).date().isoformat()
+            except ValueError:
+                continue
+        return value
+
+    return "".join(value.split()).casefold()
+
+
+def extracted_fields(kind, result):
+    """Valeurs extraites par champ du corpus, quel que soit le format du parser"""
+    entities = result.get("entities", {})
+    if kind == "simple":
+        return {field: entities.get(field) for field in FIELDS}
+
+    fields = {}
+    for label, field in ADAPTIVE_FIELDS.items():
+        values = entities.get(label) or entities.get(label.lower())
+        if values:
+            fields[field] = values[0]["value"] if isinstance(values[0], dict) else values[0]
+    return fields
+
+
+def load_parser(kind, model_path=None):
+    """Importe et construit le parser; retourne une fonction texte -> résultat"""
+    if kind == "simple":
+        from simple_invoice_parser import extract_entities
+        return extract_entities, None
+
+    from adaptive_invoice_parser import AdaptiveInvoiceParser
+    from model_registry import active_model_path
+    parser = AdaptiveInvoiceParser(model_path or active_model_path())
+    if kind == "cascade":
+        return lambda text: parser.extract_entities(text, cascade=True), parser
+    return parser.extract_entities, parser
+
+
+def run_worker(kind, corpus_path, model_path=None, batch_size=64):
+    """Mesure un parser dans le processus courant et retourne son rapport"""
+    started = time.perf_counter()
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f if line.strip()]
+
+    cold_started = time.perf_counter()
+    extract, parser = load_parser(kind, model_path)
+    load_seconds = time.perf_counter() - cold_started
+    first_result = _safe_extract(extract, documents[0]["text"]) if documents else None
+    cold_start_seconds = time.perf_counter() - cold_started
+
+    latencies = []
+    correct = dict.fromkeys(FIELDS, 0)
+    errors = 0
+    ner_documents = 0
+    loop_started = time.perf_counter()
+    for index, document in enumerate(documents):
+        doc_started = time.perf_counter()
+        result = first_result if index == 0 else _safe_extract(extract, document["text"])
+        if index:
+            latencies.append(time.perf_counter() - doc_started)
+        if "error" in result:
+            errors += 1
+            continue
+
+        if result.get("cascade", {}).get("ner_labels"):
+            ner_documents += 1
+        found = extracted_fields(kind, result)
+        for field in FIELDS:
+            expected = normalize_value(field, document["entities"].get(field))
+            if expected is not None and normalize_value(field, found.get(field)) == expected:
+                correct[field] += 1
+    loop_seconds = time.perf_counter() - loop_started
+
+    latencies.sort()
+    count = len(documents)
+    report = {
+        "documents": count,
+        "model_load_ms": round(load_seconds * 1000, 3),
+        "cold_start_ms": round(cold_start_seconds * 1000, 3),
+        "docs_per_second": round(count / loop_seconds, 1) if loop_seconds else None,
+        "errors": errors,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1] if latencies else None),
+        },
+        "accuracy": {
+            "per_field": {field: round(correct[field] / count, 4) if count else None for field in FIELDS},
+            "overall": round(sum(correct.values()) / (count * len(FIELDS)), 4) if count else None,
+        },
+    }
+
+    # Part des documents pour lesquels la cascade a dû lancer le NER
+    if kind == "cascade":
+        report["ner_rate"] = round(ner_documents / count, 4) if count else None
+
+    # Débit du mode batch (nlp.pipe) pour le parser adaptatif
+    if parser is not None and count:
+        batch_started = time.perf_counter()
+        for _ in parser.extract_entities_batch((document["text"] for document in documents), batch_size=batch_size,
+                                               cascade=kind == "cascade"):
+            pass
+        report["batch_docs_per_second"] = round(count / (time.perf_counter() - batch_started), 1)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    report["wall_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _safe_extract(extract, text):
+    """Une exception du parser compte comme une erreur du document, pas du benchmark"""
+    try:
+        return extract(text)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 4) if seconds is not None else None
+
+
+def run_benchmark(parsers, count, seed=0, noise=0.0, model_path=None, batch_size=64):
+    """Génère le corpus puis mesure chaque parser dans un sous-processus"""
+    with tempfile.TemporaryDirectory(prefix="invoice_bench_") as tmp:
+        corpus_path = os.path.join(tmp, "corpus.jsonl")
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            for document in generate_corpus(count, seed, noise):
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+
+        results = {}
+        for kind in parsers:
+            args = [sys.executable, os.path.abspath(__file__), "--worker", kind,
+                    "--corpus", corpus_path, "--batch-size", str(batch_size)]
+            if model_path:
+                args += ["--model", model_path]
+            completed = subprocess.run(args, capture_output=True, text=True, encoding="utf-8",
+                                       cwd=os.path.dirname(os.path.abspath(__file__)))
+            if completed.returncode != 0:
+                results[kind] = {"error": completed.stderr.strip().splitlines()[-1:] or ["échec"]}
+                continue
+            results[kind] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"count": count, "seed": seed, "noise": noise},
+        "parsers": results,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark des parsers de factures")
+    arg_parser.add_argument("--parsers", nargs="+", choices=PARSERS, default=list(PARSERS))
+    arg_parser.add_argument("--count", type=int, default=500, help="Nombre de documents synthétiques")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--noise", type=float, default=0.0, help="Probabilité d'erreur OCR par caractère")
+    arg_parser.add_argument("--model", help="Modèle du parser adaptatif (par défaut: modèle actif)")
+    arg_parser.add_argument("--batch-size", type=int, default=64)
+    arg_parser.add_argument("--output", default="-", help="Fichier JSON du rapport, ou '-' pour stdout")
+    # Mode interne: mesure d'un seul parser sur un corpus existant
+    arg_parser.add_argument("--worker", choices=PARSERS, help=argparse.SUPPRESS)
+    arg_parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        # stdout est réservé au rapport JSON
+        report_stream, sys.stdout = sys.stdout, sys.stderr
+        report = run_worker(args.worker, args.corpus, args.model, args.batch_size)
+        report_stream.write(json.dumps(report, ensure_ascii=False) + "\n")
+        return
+
+    report = run_benchmark(args.parsers, args.count, args.seed, args.noise, args.model, args.batch_size)
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Extraction en masse de fichiers texte OCR (import de l'historique d'un client).
+
+Les fichiers d'un dossier (*.txt, récursivement) ou d'un manifeste (un chemin par ligne,
+ou des lignes JSON {"id": ..., "path": ...}) sont répartis par paquets sur un pool de
+processus. Chaque processus charge le parser une seule fois, puis traite ses paquets
+avec nlp.pipe (et le cache des résultats, voir result_cache).
+
+Les résultats sont écrits dans l'ordre des entrées, une ligne JSON par document
+({"id", "path", ...résultat} ou {"id", "path", "error"}). Après chaque paquet écrit,
+un point de reprise (<sortie>.checkpoint.json) enregistre le nombre de documents
+terminés et la taille de la sortie: une exécution interrompue reprend là où elle
+s'était arrêtée avec --resume. La progression et le débit sont affichés sur stderr,
+le bilan final en JSON sur stdout.
+
+Usage:
+    python bulk_extract.py --input ./ocr_textes --output resultats.jsonl --workers 4
+    python bulk_extract.py --manifest fichiers.txt --output resultats.jsonl --resume
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import get_logger
+from model_registry import active_model_path, write_json_atomic
+
+logger = get_logger("bulk")
+
+PARSERS = ("adaptive", "simple")
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+# Parser du processus worker (fonction d'extraction et version pour le cache),
+# chargé une fois par _init_worker
+_worker = {}
+
+
+def list_documents(input_dir=None, manifest=None, pattern_suffix=".txt"):
+    """Liste ordonnée des documents [(id, chemin)] d'un dossier ou d'un manifeste"""
+    if manifest:
+        documents = []
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    path = record["path"]
+                    doc_id = record.get("id", path)
+                else:
+                    path = doc_id = line
+                documents.append((doc_id, os.path.join(base_dir, path)))
+        return documents
+
+    documents = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(pattern_suffix):
+                path = os.path.join(root, name)
+                documents.append((os.path.relpath(path, input_dir), path))
+    return documents
+
+
+def documents_fingerprint(documents):
+    """Empreinte de la liste des entrées: une reprise n'est valable que sur la même liste"""
+    digest = hashlib.sha256()
+    for doc_id, path in documents:
+        digest.update(f"{doc_id}\0{path}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_text(path):
+    """Contenu d'un fichier OCR (UTF-8, puis latin-1 comme le parser simple)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(path, "r", encoding="latin-1") as f:
+            return f.read()
+
+
+def _init_worker(parser_kind, model_path):
+    """Initialisation d'un processus du pool: le parser est chargé une seule fois"""
+    # Ctrl+C est géré par le processus principal, qui enregistre le point de reprise
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if parser_kind == "simple":
+        import simple_invoice_parser
+        _worker["version"] = simple_invoice_parser.rules_version
+        _worker["extract_batch"] = lambda texts, batch_size: map(simple_invoice_parser.extract_entities, texts)
+    else:
+        from adaptive_invoice_parser import AdaptiveInvoiceParser
+        parser = AdaptiveInvoiceParser(model_path)
+        parser.warm_up()
+        _worker["version"] = lambda: parser.cache_version
+        _worker["extract_batch"] = parser.extract_entities_batch
+    _worker["kind"] = parser_kind
+
+
+def _process_chunk(chunk, batch_size=64):
+    """Traite un paquet [(id, chemin)] dans un worker; retourne (lignes de sortie dans l'ordre, nombre d'erreurs)"""
+    from result_cache import get_result_cache
+    cache = get_result_cache()
+    version = _worker["version"]()
+    records = []
+    texts = []
+    for doc_id, path in chunk:
+        record = {"id": doc_id, "path": path}
+        try:
+            text = read_text(path)
+        except OSError as e:
+            record["error"] = f"Lecture impossible: {e}"
+            records.append((record, None))
+            continue
+        if not text.strip():
+            record["error"] = "Texte OCR vide"
+            records.append((record, None))
+            continue
+
+        cached, tier = cache.get(text, _worker["kind"], version) if cache else (None, None)
+        if cached is not None:
+            cached["cache"] = tier
+            record.update(cached)
+            records.append((record, None))
+        else:
+            records.append((record, len(texts)))
+            texts.append(text)
+
+    results = []
+    if texts:
+        try:
+            results = list(_worker["extract_batch"](texts, batch_size))
+        except Exception:
+            # Un document fautif ne doit pas faire échouer tout le paquet
+            results = [_safe_extract_one(text) for text in texts]
+
+    lines = []
+    errors = 0
+    for record, position in records:
+        if position is not None:
+            result = results[position]
+            if cache is not None:
+                cache.put(texts[position], _worker["kind"], version, result)
+            record.update(result)
+        errors += "error" in record
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return lines, errors
+
+
+def _safe_extract_one(text):
+    try:
+        return next(iter(_worker["extract_batch"]([text], 1)))
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def load_checkpoint(path, fingerprint):
+    """Point de reprise valable pour cette liste d'entrées, ou None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("fingerprint") != fingerprint:
+        raise ValueError("Le point de reprise correspond à une autre liste de documents")
+    return checkpoint
+
+
+class Progress:
+    """Affiche l'avancement et le débit sur stderr, au plus une fois par intervalle"""
+
+    def __init__(self, total, done=0, interval=2.0, stream=sys.stderr):
+        self.total = total
+        self.start_done = done
+        self.done = done
+        self.errors = 0
+        self.interval = interval
+        self.stream = stream
+        self.started = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, count, errors=0, force=False):
+        self.done += count
+        self.errors += errors
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rate = self.rate()
+        remaining = (self.total - self.done) / rate if rate else None
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        eta = f"{remaining:.0f}s" if remaining is not None else "?"
+        self.stream.write(f"\r{self.done}/{self.total} ({percent:.1f}%) {rate:.1f} docs/s "
+                          f"erreurs: {self.errors} reste: {eta}   ")
+        self.stream.flush()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.done - self.start_done) / elapsed if elapsed > 0 else 0.0
+
+
+def run_bulk(documents, output_path, parser_kind="adaptive", model_path=None, workers=None,
+             chunk_size=32, batch_size=64, resume=False, progress_interval=2.0):
+    """Extrait tous les documents et retourne le bilan de l'exécution"""
+    workers = workers or os.cpu_count() or 1
+    model_path = model_path or (active_model_path() if parser_kind == "adaptive" else None)
+    checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    fingerprint = documents_fingerprint(documents)
+
+    checkpoint = load_checkpoint(checkpoint_path, fingerprint) if resume else None
+    done = checkpoint["completed"] if checkpoint else 0
+    if checkpoint:
+        if not os.path.exists(output_path):
+            raise ValueError(f"Point de reprise trouvé mais sortie absente: {output_path}")
+        # Retirer une éventuelle ligne incomplète écrite après le dernier point de reprise
+        with open(output_path, "r+b") as f:
+            f.truncate(checkpoint["output_bytes"])
+        logger.info("Reprise après %d documents", done)
+
+    remaining = documents[done:]
+    chunks = [remaining[i:i + chunk_size] for i in range(0, len(remaining), chunk_size)]
+    progress = Progress(len(documents), done, progress_interval)
+    started = time.perf_counter()
+    interrupted = False
+
+    with open(output_path, "ab" if checkpoint else "wb") as output, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(parser_kind, model_path)) as pool:
+        # Fenêtre bornée de paquets en cours: la sortie reste ordonnée sans tout soumettre d'avance
+        pending = deque()
+        next_chunk = 0
+        try:
+            while pending or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(pending) < workers * 2:
+                    pending.append(pool.submit(_process_chunk, chunks[next_chunk], batch_size))
+                    next_chunk += 1
+
+                lines, errors = pending.popleft().result()
+                output.write("".join(line + "\n" for line in lines).encode("utf-8"))
+                output.flush()
+                done += len(lines)
+                write_json_atomic(checkpoint_path, {
+                    "fingerprint": fingerprint,
+                    "completed": done,
+                    "total": len(documents),
+                    "output_bytes": output.tell(),
+                    "parser": parser_kind,
+                    "model_path": model_path,
+                })
+                progress.update(len(lines), errors)
+        except KeyboardInterrupt:
+            interrupted = True
+            for future in pending:
+                future.cancel()
+            logger.warning("Interrompu après %d documents, reprise possible avec --resume", done)
+
+    progress.update(0, force=True)
+    progress.stream.write("\n")
+
+    # Une exécution complète n'a plus besoin de point de reprise
+    if not interrupted and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(documents),
+        "completed": done,
+        "resumed_from": checkpoint["completed"] if checkpoint else 0,
+        "errors": progress.errors,
+        "interrupted": interrupted,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(progress.rate(), 1),
+        "workers": workers,
+        "parser": parser_kind,
+        "model_path": model_path,
+        "output": output_path,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Extraction en masse de fichiers texte OCR")
+    source = arg_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Dossier des fichiers texte (*.txt, récursivement)")
+    source.add_argument("--manifest", help="Fichier listant les documents (un chemin ou un objet JSON par ligne)")
+    arg_parser.add_argument("--output", required=True, help="Fichier JSON Lines des résultats")
+    arg_parser.add_argument("--parser", choices=PARSERS, default="adaptive")
+    arg_parser.add_argument("--model", help="Modèle du parser adaptatif (par défaut: modèle actif)")
+    arg_parser.add_argument("--workers", type=int, help="Nombre de processus (par défaut: nombre de cœurs)")
+    arg_parser.add_argument("--chunk-size", type=int, default=32, help="Documents par paquet envoyé à un worker")
+    arg_parser.add_argument("--batch-size", type=int, default=64)
+    arg_parser.add_argument("--resume", action="store_true", help="Reprendre depuis le point de reprise")
+    arg_parser.add_argument("--progress-interval", type=float, default=2.0, help="Secondes entre deux affichages")
+    args = arg_parser.parse_args()
+
+    documents = list_documents(args.input, args.manifest)
+    if not documents:
+        print(json.dumps({"error": "Aucun document à traiter"}))
+        sys.exit(1)
+
+    summary = run_bulk(documents, args.output, args.parser, args.model, args.workers,
+                       max(1, args.chunk_size), args.batch_size, args.resume, args.progress_interval)
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["interrupted"]:
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
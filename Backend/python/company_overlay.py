@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Surcouches par entreprise au-dessus du modèle partagé.
+
+Un modèle spaCy complet par entreprise ne tiendrait pas en mémoire: toutes les
+entreprises partagent le modèle actif (model_registry), et ce qui leur est propre
+tient dans une surcouche légère, dans models/companies/<entreprise>/:
+
+- overlay.json: patterns ajoutés par champ ({"patterns": {"reference": ["BL-(\\d+)"]}}),
+  essayés avant les règles communes, et seuils de confiance par champ
+  ({"thresholds": {"montantHT": 0.8}}) sous lesquels une valeur du parser adaptatif
+  est écartée;
+- vendor_gazetteer.jsonl: noms confirmés par les feedbacks de cette entreprise (même
+  format que le répertoire commun, voir vendor_gazetteer). Les corrections d'une
+  entreprise ne changent plus les noms reconnus pour les autres.
+
+Les surcouches sont chargées à la demande dans un cache LRU borné en octets
+(OVERLAY_CACHE_MB): la taille de chaque surcouche (patterns compilés, automate des
+noms) est estimée au chargement, et les moins récemment utilisées sont évincées
+quand le budget est dépassé. Un fichier modifié est rechargé (vérification au plus
+toutes les RELOAD_CHECK_SECONDS).
+
+Usage:
+    python company_overlay.py add-pattern <entreprise> reference "BL-(\\d+)"
+    python company_overlay.py set-threshold <entreprise> montantHT 0.8
+    python company_overlay.py add-name <entreprise> "Électro Sahel"
+    python company_overlay.py show <entreprise>
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+
+from model_registry import MODELS_DIR, write_json_atomic
+from pattern_registry import PatternRegistry, patterns_fingerprint
+from regex_fuzz import check_pattern
+from label_index import FIELD_LABELS
+from vendor_gazetteer import GAZETTEER_FILE, Gazetteer, append_names, feedback_names
+
+COMPANIES_DIR = "companies"
+OVERLAY_FILE = "overlay.json"
+
+# Identifiant d'entreprise (ObjectId MongoDB ou code): sert de nom de dossier
+COMPANY_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Champs qu'une surcouche peut compléter (ceux du résultat du parser simple)
+OVERLAY_FIELDS = tuple(FIELD_LABELS) + ("phone", "address")
+
+# Budget mémoire du cache des surcouches
+OVERLAY_CACHE_BYTES = int(float(os.environ.get("OVERLAY_CACHE_MB", "64")) * 1024 * 1024)
+RELOAD_CHECK_SECONDS = 2.0
+
+
+def company_dir(company_id, models_dir=None):
+    """Dossier de la surcouche d'une entreprise (identifiant validé)"""
+    if not isinstance(company_id, str) or not COMPANY_ID_PATTERN.match(company_id):
+        raise ValueError(f"Identifiant d'entreprise invalide: {company_id!r}")
+    return os.path.join(os.path.abspath(models_dir or MODELS_DIR), COMPANIES_DIR, company_id)
+
+
+def _deep_size(obj, seen=None):
+    """Taille approximative en octets d'une structure (conteneurs parcourus récursivement)"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif isinstance(obj, re.Pattern):
+        # Le programme compilé n'est pas visible: estimé d'après la source
+        size += 8 * len(obj.pattern)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+class CompanyOverlay:
+    """Patterns, seuils et noms propres à une entreprise"""
+
+    def __init__(self, company_id, patterns=None, thresholds=None, gazetteer=None):
+        self.company_id = company_id
+        self.patterns = {field: list(sources) for field, sources in (patterns or {}).items() if sources}
+        self.thresholds = dict(thresholds or {})
+        self.gazetteer = gazetteer or Gazetteer()
+        self.registry = PatternRegistry(self.patterns) if self.patterns else None
+        self.version = hashlib.sha1(json.dumps(
+            [self.registry.fingerprint if self.registry else patterns_fingerprint({}), sorted(self.thresholds.items()), self.gazetteer.version]
+        ).encode("utf-8")).hexdigest()[:12]
+        self.size = _deep_size(self)
+
+    @classmethod
+    def load(cls, company_id, models_dir=None):
+        root = company_dir(company_id, models_dir)
+        config = {}
+        path = os.path.join(root, OVERLAY_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        return cls(company_id, config.get("patterns"), config.get("thresholds"),
+                   Gazetteer.load(os.path.join(root, GAZETTEER_FILE)))
+
+    def __bool__(self):
+        return bool(self.patterns or self.thresholds or len(self.gazetteer))
+
+    def match_patterns(self, text, budget=None):
+        """
+        Première correspondance des patterns de l'entreprise, par champ: {champ: PatternMatch},
+        dans la limite du budget du document (pattern_registry.TimeBudget) s'il est donné
+        """
+        if self.registry is None:
+            return {}
+        scan = self.registry.scan(text, budget)
+        found = {}
+        for field in self.patterns:
+            match = scan.first(field)
+            if match and match.value.strip():
+                found[field] = match
+        return found
+
+    def match_name(self, text):
+        """Nom confirmé par les feedbacks de l'entreprise (voir vendor_gazetteer.Gazetteer.match)"""
+        return self.gazetteer.match(text)
+
+    def threshold(self, field, default=0.0):
+        return self.thresholds.get(field, default)
+
+    def as_dict(self):
+        return {
+            "company": self.company_id,
+            "version": self.version,
+            "patterns": self.patterns,
+            "thresholds": self.thresholds,
+            "known_names": len(self.gazetteer),
+            "size_bytes": self.size,
+        }
+
+
+def _overlay_mtime(company_id, models_dir=None):
+    """Signature des fichiers d'une surcouche (date et taille), None s'il n'y en a aucun"""
+    root = company_dir(company_id, models_dir)
+    signature = []
+    for name in (OVERLAY_FILE, GAZETTEER_FILE):
+        try:
+            stat = os.stat(os.path.join(root, name))
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature) if any(signature) else None
+
+
+class OverlayCache:
+    """
+    Cache LRU des surcouches chargées, borné par leur taille estimée en octets.
+    La surcouche qui vient d'être chargée est toujours gardée, même seule au-delà du budget.
+    """
+
+    def __init__(self, max_bytes=OVERLAY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # (racine des modèles, entreprise) -> [surcouche, signature des fichiers, dernière vérification]
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, company_id, models_dir=None, check=False):
+        key = (os.path.abspath(models_dir or MODELS_DIR), company_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                if not check and now - entry[2] < RELOAD_CHECK_SECONDS:
+                    self.hits += 1
+                    return entry[0]
+
+        mtime = _overlay_mtime(company_id, models_dir)
+        if entry is not None and entry[1] == mtime:
+            with self._lock:
+                entry[2] = now
+                self.hits += 1
+            return entry[0]
+
+        overlay = CompanyOverlay.load(company_id, models_dir)
+        with self._lock:
+            self.misses += 1
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[0].size
+            self._items[key] = [overlay, mtime, now]
+            self.bytes += overlay.size
+            while self.bytes > self.max_bytes and len(self._items) > 1:
+                _, (evicted, _, _) = self._items.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+        return overlay
+
+    def discard(self, company_id, models_dir=None):
+        with self._lock:
+            entry = self._items.pop((os.path.abspath(models_dir or MODELS_DIR), company_id), None)
+            if entry is not None:
+                self.bytes -= entry[0].size
+
+    def stats(self):
+        return {"size": len(self._items), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_overlay_cache = OverlayCache()
+
+
+def get_overlay(company_id, models_dir=None, check=False):
+    """Surcouche d'une entreprise (vide si elle n'en a pas encore), depuis le cache LRU"""
+    return _overlay_cache.get(company_id, models_dir, check)
+
+
+def overlay_cache_stats():
+    return _overlay_cache.stats()
+
+
+def _update_config(company_id, models_dir, update):
+    """Modifie overlay.json d'une entreprise (réécriture atomique)"""
+    root = company_dir(company_id, models_dir)
+    path = os.path.join(root, OVERLAY_FILE)
+    config = {"patterns": {}, "thresholds": {}}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    update(config)
+    os.makedirs(root, exist_ok=True)
+    write_json_atomic(path, config)
+    _overlay_cache.discard(company_id, models_dir)
+    return get_overlay(company_id, models_dir)
+
+
+def _check_field(field):
+    if field not in OVERLAY_FIELDS:
+        raise ValueError(f"Champ inconnu: {field} (attendu: {', '.join(OVERLAY_FIELDS)})")
+
+
+def add_pattern(company_id, field, pattern, models_dir=None):
+    """
+    Ajoute un pattern à un champ de la surcouche. Il est compilé et passé au banc
+    d'entrées adverses (regex_fuzz): un pattern à retour arrière catastrophique est refusé.
+    """
+    _check_field(field)
+    check_pattern(pattern)
+
+    def update(config):
+        sources = config["patterns"].setdefault(field, [])
+        if pattern not in sources:
+            sources.append(pattern)
+    return _update_config(company_id, models_dir, update)
+
+
+def set_threshold(company_id, field, value, models_dir=None):
+    """Fixe le seuil de confiance d'un champ (None le retire)"""
+    _check_field(field)
+    if value is not None and not 0.0 <= value <= 1.0:
+        raise ValueError("Le seuil doit être compris entre 0 et 1")
+
+    def update(config):
+        if value is None:
+            config["thresholds"].pop(field, None)
+        else:
+            config["thresholds"][field] = value
+    return _update_config(company_id, models_dir, update)
+
+
+def add_names(company_id, names, models_dir=None):
+    """Ajoute des noms confirmés au répertoire de l'entreprise; retourne le nombre de noms ajoutés"""
+    path = os.path.join(company_dir(company_id, models_dir), GAZETTEER_FILE)
+    added = append_names(path, names, get_overlay(company_id, models_dir, check=True).gazetteer)
+    if added:
+        _overlay_cache.discard(company_id, models_dir)
+    return added
+
+
+def learn_from_feedback(company_id, text, corrected_entities, models_dir=None):
+    """Ajoute au répertoire de l'entreprise les noms confirmés par un feedback"""
+    return add_names(company_id, feedback_names(text, corrected_entities), models_dir)
+
+
+def cache_kind(parser_kind, overlay=None):
+    """
+    Type de parser pour le cache des résultats: le cache ne garde qu'une version par type,
+    chaque entreprise a donc le sien (sinon la surcouche d'une entreprise effacerait les
+    résultats des autres)
+    """
+    return f"{parser_kind}@{overlay.company_id}" if overlay else parser_kind
+
+
+def pop_company_argument(argv):
+    """Retire "--company <entreprise>" des arguments d'un script; retourne (entreprise ou None, arguments)"""
+    if "--company" not in argv:
+        return None, argv
+    position = argv.index("--company")
+    if position + 1 >= len(argv):
+        raise ValueError("--company attend un identifiant d'entreprise")
+    return argv[position + 1], argv[:position] + argv[position + 2:]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Surcouches par entreprise")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    pattern_command = commands.add_parser("add-pattern", help="Ajouter un pattern à un champ")
+    pattern_command.add_argument("company")
+    pattern_command.add_argument("field", choices=OVERLAY_FIELDS)
+    pattern_command.add_argument("pattern")
+    threshold_command = commands.add_parser("set-threshold", help="Fixer le seuil de confiance d'un champ")
+    threshold_command.add_argument("company")
+    threshold_command.add_argument("field", choices=OVERLAY_FIELDS)
+    threshold_command.add_argument("value", help="Seuil entre 0 et 1, ou 'none' pour le retirer")
+    name_command = commands.add_parser("add-name", help="Ajouter des noms confirmés")
+    name_command.add_argument("company")
+    name_command.add_argument("names", nargs="+")
+    show_command = commands.add_parser("show", help="Afficher la surcouche d'une entreprise")
+    show_command.add_argument("company")
+    args = arg_parser.parse_args()
+
+    if args.command == "add-pattern":
+        overlay = add_pattern(args.company, args.field, args.pattern)
+    elif args.command == "set-threshold":
+        overlay = set_threshold(args.company, args.field, None if args.value == "none" else float(args.value))
+    elif args.command == "add-name":
+        add_names(args.company, args.names)
+        overlay = get_overlay(args.company, check=True)
+    else:
+        overlay = get_overlay(args.company)
+    print(json.dumps(overlay.as_dict(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+"""
+Configuration commune des tests: modèles, file d'entraînement, surcouches et cache
+des résultats sont écrits dans un répertoire temporaire, jamais dans `models/`.
+Les variables d'environnement sont fixées avant l'import des modules testés.
+"""
+
+import os
+import shutil
+import tempfile
+
+TEST_MODELS_DIR = tempfile.mkdtemp(prefix="invoice_models_")
+os.environ["MODELS_DIR"] = TEST_MODELS_DIR
+os.environ["RESULT_CACHE"] = "false"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_MODELS_DIR, ignore_errors=True)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Classifieur rapide du type de document: facture, bon de livraison, ticket de caisse
+ou bon de commande.
+
+- Caractéristiques: n-grammes de caractères (3 à 5) du texte en minuscules, sans
+  espaces et avec les chiffres ramenés à 0 ("BONDELIVRAISON" et "Bon de livraison"
+  donnent les mêmes n-grammes), hachés dans un vecteur de HASH_DIM cases. Le hachage
+  polynomial est calculé pour toutes les positions à la fois avec NumPy.
+- Modèle: régression logistique multinomiale (une ligne de poids par type), entraînée
+  en NumPy. Le score d'un document ne lit que les colonnes de ses n-grammes: moins
+  d'une milliseconde par document.
+- Apprentissage: corpus synthétique de départ (invoice_corpus) plus les exemples
+  étiquetés issus des feedbacks ("documentType" dans les entités corrigées), conservés
+  dans models/document_classifier_examples.jsonl. Le modèle de départ est appris hors
+  ligne (commande train) ou au démarrage du serveur, jamais pendant une requête; le
+  worker d'entraînement le réapprend quand de nouveaux exemples arrivent.
+- Le type ne choisit les patterns que si le modèle a appris au moins MIN_FEEDBACK_EXAMPLES
+  vrais documents (feedbacks) de ce type et que sa confiance atteint MIN_CONFIDENCE: sinon
+  "type" vaut None et les parsers appliquent tous les jeux de patterns. Le type le plus
+  probable reste dans "predicted".
+
+Usage:
+    python document_classifier.py train [--seed-count 800]
+    python document_classifier.py classify <fichier texte>
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+from model_registry import MODELS_DIR
+
+DOCUMENT_TYPES = ("invoice", "delivery_note", "receipt", "purchase_order")
+
+# Types utilisés côté Node.js (entityExtractor.detectDocumentType) -> types du classifieur
+NODE_TYPES = {
+    "facture": "invoice",
+    "bon_livraison": "delivery_note",
+    "reçu": "receipt",
+    "recu": "receipt",
+    "bon_commande": "purchase_order",
+}
+
+CLASSIFIER_FILE = "document_classifier.npz"
+EXAMPLES_FILE = "document_classifier_examples.jsonl"
+
+HASH_BITS = 14
+HASH_DIM = 1 << HASH_BITS
+NGRAM_SIZES = (3, 4, 5)
+# Le type se lit en tête de document: inutile de hacher toute une longue facture
+MAX_CHARS = 3000
+# En dessous de cette probabilité, le document est traité comme de type inconnu
+MIN_CONFIDENCE = 0.6
+# Feedbacks d'un type nécessaires avant que ses prédictions choisissent les patterns:
+# quelques exemples ne corrigent pas un modèle appris sur le corpus synthétique
+MIN_FEEDBACK_EXAMPLES = 10
+# Délai minimal entre deux vérifications du fichier du modèle sur le disque
+RELOAD_CHECK_SECONDS = 2.0
+
+_HASH_PRIME = np.uint64(1099511628211)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+_DIGITS = str.maketrans("0123456789", "0000000000")
+
+
+def features(text):
+    """
+    Vecteur creux (indices, valeurs) des n-grammes hachés d'un texte, normalisé (L2).
+    Les indices sont triés et uniques.
+    """
+    normalized = "".join(text[:MAX_CHARS].lower().split()).translate(_DIGITS)
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    with np.errstate(over="ignore"):
+        for size in NGRAM_SIZES:
+            count = len(codes) - size + 1
+            if count <= 0:
+                continue
+            value = np.full(count, size, dtype=np.uint64)
+            for offset in range(size):
+                value = value * _HASH_PRIME + codes[offset:offset + count]
+            value = (value ^ (value >> np.uint64(29))) * _HASH_MIX
+            hashes.append(value >> np.uint64(64 - HASH_BITS))
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    indices, counts = np.unique(np.concatenate(hashes).astype(np.int64), return_counts=True)
+    values = np.log1p(counts).astype(np.float32)
+    values /= np.sqrt(np.dot(values, values))
+    return indices, values
+
+
+class DocumentClassifier:
+    """Régression logistique multinomiale sur n-grammes hachés"""
+
+    def __init__(self, weights=None, bias=None, classes=DOCUMENT_TYPES, trained_at=None, example_count=0,
+                 feedback_counts=None):
+        self.classes = tuple(classes)
+        self.weights = weights if weights is not None else np.zeros((len(self.classes), HASH_DIM), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.classes), dtype=np.float32)
+        self.trained_at = trained_at
+        self.example_count = example_count
+        # Exemples issus des feedbacks par type, dans l'ordre de self.classes (0: corpus synthétique seul)
+        self.feedback_counts = tuple(int(count) for count in feedback_counts) if feedback_counts is not None \
+            else (0,) * len(self.classes)
+        # Empreinte des poids: change à chaque réapprentissage (clé du cache des résultats)
+        digest = hashlib.sha1(self.weights.tobytes())
+        digest.update(self.bias.tobytes())
+        self.version = digest.hexdigest()[:12]
+
+    def probabilities(self, text):
+        """Probabilité de chaque type, dans l'ordre de self.classes"""
+        indices, values = features(text)
+        scores = self.weights[:, indices] @ values + self.bias
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    @property
+    def trained_on(self):
+        """
+        "feedback" (au moins un type appris sur MIN_FEEDBACK_EXAMPLES feedbacks), "synthetic"
+        (corpus de départ, feedbacks trop peu nombreux) ou None (non appris)
+        """
+        if max(self.feedback_counts) >= MIN_FEEDBACK_EXAMPLES:
+            return "feedback"
+        return "synthetic" if self.trained_at else None
+
+    def classify(self, text):
+        """
+        {"type", "predicted", "confidence", "scores", "trained_on"}. "type", qui choisit les
+        patterns, vaut None si la confiance est trop faible ou si le modèle n'a pas appris
+        assez de feedbacks du type prédit; "predicted" est le type le plus probable.
+        """
+        probabilities = self.probabilities(text)
+        best = int(probabilities.argmax())
+        confidence = float(probabilities[best])
+        trusted = confidence >= MIN_CONFIDENCE and self.feedback_counts[best] >= MIN_FEEDBACK_EXAMPLES
+        return {
+            "type": self.classes[best] if trusted else None,
+            "predicted": self.classes[best] if self.trained_on else None,
+            "confidence": round(confidence, 4),
+            "scores": {label: round(float(p), 4) for label, p in zip(self.classes, probabilities)},
+            "trained_on": self.trained_on,
+        }
+
+    @classmethod
+    def train(cls, texts, labels, epochs=12, learning_rate=2.0, l2=1e-4, batch_size=64, seed=0, feedback_labels=()):
+        """
+        Apprend les poids par descente de gradient par mini-lots (entropie croisée, classes
+        équilibrées); `feedback_labels` sont les types des exemples issus des feedbacks
+        """
+        classes = DOCUMENT_TYPES
+        targets = np.array([classes.index(label) for label in labels], dtype=np.int64)
+        vectors = [features(text) for text in texts]
+        # Chaque type pèse autant, quel que soit son nombre d'exemples
+        class_counts = np.bincount(targets, minlength=len(classes)).astype(np.float32)
+        class_weights = np.where(class_counts > 0, len(targets) / (len(classes) * np.maximum(class_counts, 1)), 0.0)
+
+        weights = np.zeros((len(classes), HASH_DIM), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(vectors))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                dense = np.zeros((len(batch), HASH_DIM), dtype=np.float32)
+                for row, position in enumerate(batch):
+                    indices, values = vectors[position]
+                    dense[row, indices] = values
+
+                scores = dense @ weights.T + bias
+                scores -= scores.max(axis=1, keepdims=True)
+                probabilities = np.exp(scores)
+                probabilities /= probabilities.sum(axis=1, keepdims=True)
+                probabilities[np.arange(len(batch)), targets[batch]] -= 1.0
+                probabilities *= class_weights[targets[batch]][:, None] / len(batch)
+
+                weights -= learning_rate * (probabilities.T @ dense + l2 * weights)
+                bias -= learning_rate * probabilities.sum(axis=0)
+
+        feedback_counts = [list(feedback_labels).count(label) for label in classes]
+        return cls(weights, bias, classes, time.strftime("%Y-%m-%dT%H:%M:%S"), len(texts), feedback_counts)
+
+    def save(self, path):
+        """Écrit le modèle (.npz) via un fichier temporaire et os.replace"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, weights=self.weights, bias=self.bias, classes=np.array(self.classes),
+                     trained_at=np.array(self.trained_at or ""), example_count=np.array(self.example_count),
+                     feedback_counts=np.array(self.feedback_counts))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if data["weights"].shape[1] != HASH_DIM:
+                raise ValueError("Dimension de hachage différente: le classifieur doit être réappris")
+            # Les modèles sans comptes par type ne choisissent plus les patterns avant réapprentissage
+            return cls(data["weights"], data["bias"], [str(label) for label in data["classes"]],
+                       str(data["trained_at"]) or None, int(data["example_count"]),
+                       data["feedback_counts"] if "feedback_counts" in data else None)
+
+
+def seed_examples(count=800, seed=0):
+    """Exemples de départ: documents synthétiques des quatre types, avec un peu de bruit OCR"""
+    from invoice_corpus import generate_corpus
+    texts, labels = [], []
+    for document in generate_corpus(count, seed, noise=0.02, kinds=DOCUMENT_TYPES):
+        texts.append(document["text"])
+        labels.append(document["kind"])
+    return texts, labels
+
+
+def document_type_label(value):
+    """Type du classifieur pour une étiquette de feedback (type Node.js ou type du classifieur)"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    return value if value in DOCUMENT_TYPES else NODE_TYPES.get(value)
+
+
+def add_examples(samples, models_dir=None):
+    """
+    Conserve les échantillons de feedback qui portent un type de document
+    (annotations["cats"]); retourne le nombre d'exemples ajoutés
+    """
+    lines = []
+    for text, annotations in samples:
+        cats = annotations.get("cats") or {}
+        label = max(cats, key=cats.get) if cats else None
+        if label in DOCUMENT_TYPES:
+            lines.append(json.dumps({"text": text, "type": label}, ensure_ascii=False))
+    if lines:
+        path = os.path.join(models_dir or MODELS_DIR, EXAMPLES_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def feedback_examples(models_dir=None):
+    """Exemples étiquetés accumulés à partir des feedbacks"""
+    path = os.path.join(models_dir or MODELS_DIR, EXAMPLES_FILE)
+    texts, labels = [], []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    texts.append(record["text"])
+                    labels.append(record["type"])
+    return texts, labels
+
+
+def train_classifier(models_dir=None, seed_count=800, feedback_weight=3):
+    """Apprend le classifieur (corpus de départ + feedbacks, répétés `feedback_weight` fois) et l'enregistre"""
+    texts, labels = seed_examples(seed_count)
+    feedback_texts, feedback_labels = feedback_examples(models_dir)
+    texts += feedback_texts * feedback_weight
+    labels += feedback_labels * feedback_weight
+
+    started = time.perf_counter()
+    classifier = DocumentClassifier.train(texts, labels, feedback_labels=feedback_labels)
+    classifier.save(os.path.join(models_dir or MODELS_DIR, CLASSIFIER_FILE))
+    _classifier_cache.pop(os.path.abspath(models_dir or MODELS_DIR), None)
+    return {
+        "examples": len(texts),
+        "feedback_examples": len(feedback_texts),
+        "seconds": round(time.perf_counter() - started, 3),
+        "version": classifier.version,
+    }
+
+
+# Classifieur sans poids (probabilités uniformes), utilisé tant qu'aucun modèle n'existe
+UNTRAINED_CLASSIFIER = DocumentClassifier()
+
+# Classifieur chargé par dossier de modèles: (classifieur, mtime du fichier, dernière vérification)
+_classifier_cache = {}
+_classifier_lock = threading.Lock()
+
+
+def get_classifier(models_dir=None):
+    """
+    Classifieur courant, rechargé quand le worker d'entraînement en publie un nouveau.
+    Tant qu'aucun modèle n'a été appris (voir ensure_classifier), un classifieur non
+    appris est retourné: aucun type n'est choisi et tous les patterns s'appliquent.
+    """
+    root = os.path.abspath(models_dir or MODELS_DIR)
+    path = os.path.join(root, CLASSIFIER_FILE)
+    now = time.monotonic()
+    cached = _classifier_cache.get(root)
+    if cached is not None and now - cached[2] < RELOAD_CHECK_SECONDS:
+        return cached[0]
+
+    with _classifier_lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        if cached is not None and cached[1] == mtime:
+            classifier = cached[0]
+        elif mtime is None:
+            classifier = UNTRAINED_CLASSIFIER
+        else:
+            classifier = DocumentClassifier.load(path)
+        _classifier_cache[root] = (classifier, mtime, now)
+        return classifier
+
+
+def ensure_classifier(models_dir=None):
+    """
+    Apprend le classifieur de départ s'il n'existe pas encore. Appelé au démarrage du
+    serveur, hors du chemin des requêtes (moins d'une seconde).
+    """
+    if not os.path.exists(os.path.join(models_dir or MODELS_DIR, CLASSIFIER_FILE)):
+        train_classifier(models_dir)
+    return get_classifier(models_dir)
+
+
+def classify(text, models_dir=None):
+    """Type du document (voir DocumentClassifier.classify)"""
+    return get_classifier(models_dir).classify(text)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Classifieur du type de document")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    train_command = commands.add_parser("train", help="Apprend le classifieur (corpus de départ + feedbacks)")
+    train_command.add_argument("--seed-count", type=int, default=800)
+    classify_command = commands.add_parser("classify", help="Classe un fichier texte")
+    classify_command.add_argument("path")
+    args = arg_parser.parse_args()
+
+    if args.command == "train":
+        print(json.dumps(train_classifier(seed_count=args.seed_count), ensure_ascii=False))
+        return
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        text = f.read()
+    classifier = ensure_classifier()
+    started = time.perf_counter()
+    result = classifier.classify(text)
+    result["ms"] = round((time.perf_counter() - started) * 1000, 4)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
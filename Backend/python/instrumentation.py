@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation du chemin d'extraction Python.
+
+- `get_logger`: journalisation de débogage envoyée uniquement sur stderr, filtrée par
+  niveau (variable d'environnement PARSER_LOG_LEVEL, WARNING par défaut). stdout reste
+  réservé au JSON lu par le pont Node.js.
+- `StageTimer`: temps réel (perf_counter) et temps CPU (process_time) par étape
+  (normalize, regex, ner, merge, serialize), retournés dans le résultat.
+- `profile_request`: sur demande, écrit un profil cProfile et un instantané tracemalloc
+  d'une requête dans un dossier (variable PARSER_PROFILE_DIR ou option --profile-dir).
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+LOG_LEVEL_ENV = "PARSER_LOG_LEVEL"
+PROFILE_DIR_ENV = "PARSER_PROFILE_DIR"
+
+_handler = None
+
+
+def get_logger(name):
+    """Logger du parser, écrit sur stderr au niveau défini par PARSER_LOG_LEVEL"""
+    global _handler
+    logger = logging.getLogger(f"parser.{name}")
+
+    if _handler is None:
+        _handler = logging.StreamHandler(sys.stderr)
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+        root = logging.getLogger("parser")
+        root.addHandler(_handler)
+        root.setLevel(os.environ.get(LOG_LEVEL_ENV, "WARNING").upper())
+        root.propagate = False
+
+    return logger
+
+
+class StageTimer:
+    """Mesure le temps réel et le temps CPU de chaque étape d'une extraction"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name, wall_seconds, cpu_seconds=0.0):
+        """Ajoute une durée (cumulée si l'étape a déjà été mesurée)"""
+        stage = self.stages.setdefault(name, {"wall_ms": 0.0, "cpu_ms": 0.0})
+        stage["wall_ms"] = round(stage["wall_ms"] + wall_seconds * 1000, 3)
+        stage["cpu_ms"] = round(stage["cpu_ms"] + cpu_seconds * 1000, 3)
+
+    def elapsed(self):
+        """Temps réel écoulé depuis la création, en secondes"""
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            "stages": dict(self.stages),
+            "total_wall_ms": round(self.elapsed() * 1000, 3),
+            "total_cpu_ms": round((time.process_time() - self.started_cpu) * 1000, 3),
+        }
+
+
+def dumps_result(result, timer):
+    """
+    Sérialise le résultat en JSON en mesurant l'étape "serialize", puis y place le bloc
+    "timings" à jour sans resérialiser le reste du résultat.
+    """
+    if not isinstance(result, dict):
+        return json.dumps(result, ensure_ascii=False)
+
+    body = {key: value for key, value in result.items() if key != "timings"}
+    with timer.stage("serialize"):
+        payload = json.dumps(body, ensure_ascii=False)
+
+    timings = json.dumps(timer.as_dict(), ensure_ascii=False)
+    separator = ", " if body else ""
+    return payload[:-1] + separator + '"timings": ' + timings + "}"
+
+
+@contextmanager
+def profile_request(profile_dir=None, label="request"):
+    """
+    Profile le bloc (cProfile + tracemalloc) si un dossier est fourni ou défini par
+    PARSER_PROFILE_DIR. Les fichiers `<label>_<horodatage>.prof` et `.tracemalloc`
+    peuvent être relus avec pstats et tracemalloc.Snapshot.load.
+    """
+    profile_dir = profile_dir or os.environ.get(PROFILE_DIR_ENV)
+    if not profile_dir:
+        yield None
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+    base = os.path.join(profile_dir, f"{label}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}")
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield base
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{base}.prof")
+        tracemalloc.take_snapshot().dump(f"{base}.tracemalloc")
+        if started_tracing:
+            tracemalloc.stop()
+        get_logger("profile").info("Profil écrit dans %s.prof / %s.tracemalloc", base, base)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Générateur déterministe de factures, bons de livraison, tickets de caisse et bons de
+commande synthétiques (français et tunisiens) avec leurs valeurs attendues, pour les
+benchmarks, l'évaluation et l'apprentissage initial du classifieur de type de document.
+
+Chaque document est un dictionnaire {"id", "kind", "text", "entities"} où "entities"
+utilise les clés du parser simple (date AAAA-MM-JJ, montantHT, tva, montantTTC en
+notation décimale avec un point, vendor, reference). Le bruit OCR (confusions de
+caractères, espaces supprimés ou dupliqués) est réglable et reproductible par graine.
+
+Usage:
+    python invoice_corpus.py --count 1000 --seed 0 --noise 0.02 --output corpus.jsonl
+"""
+
+import sys
+import json
+import random
+import argparse
+from datetime import date, timedelta
+
+# Devises: (suffixe affiché, nombre de décimales)
+CURRENCIES = {
+    "DT": ("DT", 3),
+    "TND": ("TND", 3),
+    "EUR": ("€", 2),
+}
+
+VAT_RATES = {"DT": [7, 13, 19], "TND": [7, 13, 19], "EUR": [5.5, 10, 20]}
+
+CITIES = ["SOUSSE", "MONASTIR", "TUNIS", "SFAX", "NABEUL", "BIZERTE", "PARIS", "LYON", "MARSEILLE"]
+FIRST_NAMES = ["Moez", "Amine", "Sami", "Leila", "Nadia", "Karim", "Sophie", "Julien", "Claire"]
+LAST_NAMES = ["Zrig", "Trabelsi", "Ben Salah", "Gharbi", "Jaziri", "Martin", "Bernard", "Dubois"]
+COMPANIES = ["Electro Sahel", "Packelectro", "Mega Froid", "Bati Confort", "Optima Services", "Dupont SARL"]
+PRODUCTS = ["four électrique", "hotte aspirante", "plaque de cuisson", "réfrigérateur",
+            "climatiseur", "lave-linge", "chauffe-eau", "micro-ondes"]
+
+# Confusions OCR courantes (chiffre <-> lettre, accents perdus)
+OCR_CONFUSIONS = {
+    "0": "O", "O": "0", "1": "l", "l": "1", "5": "S", "S": "5",
+    "8": "B", "é": "e", "è": "e", "à": "a", "i": "î", "o": "0",
+}
+
+
+def format_amount(value, decimals, style):
+    """Formate un montant: 'tn' -> 1103,361 ; 'fr' -> 1 103,36 ; 'dot' -> 1103.36"""
+    text = f"{value:.{decimals}f}"
+    if style == "dot":
+        return text
+    integer, fraction = text.split(".")
+    if style == "fr" and len(integer) > 3:
+        groups = []
+        while len(integer) > 3:
+            groups.insert(0, integer[-3:])
+            integer = integer[:-3]
+        integer = " ".join([integer] + groups)
+    return f"{integer},{fraction}"
+
+
+def add_ocr_noise(text, rng, noise):
+    """Applique des erreurs OCR (confusions, espaces perdus ou dupliqués) avec la probabilité `noise`"""
+    if noise <= 0:
+        return text
+    output = []
+    for char in text:
+        roll = rng.random()
+        if roll < noise and char in OCR_CONFUSIONS:
+            output.append(OCR_CONFUSIONS[char])
+        elif roll < noise and char == " ":
+            continue
+        elif roll < noise / 4 and char != "\n":
+            output.append(char + char)
+        else:
+            output.append(char)
+    return "".join(output)
+
+
+def _delivery_note(rng, values):
+    """Bon de livraison compact (style tunisien, libellés collés)"""
+    currency = values["currency_label"]
+    lines = [
+        "BONDELIVRAISONN",
+        values["reference"],
+        f"Déstination:{rng.choice(CITIES)}",
+        f"NOMDEDESTINATAIRE:{values['vendor'].replace(' ', '')}",
+        f"Date:{values['date'].isoformat()} ADRESSE:Cité{rng.choice(CITIES).capitalize()}",
+        f"TELEPHONE:{rng.randint(20000000, 99999999)}",
+        "Désignation QuantitéPrixUnitaire N l0ntîln% Total",
+    ]
+    lines += values["item_lines"]
+    lines += [
+        f"MontantHT {values['ht_text']}{currency}",
+        f"TVA{values['rate_text']}% {values['tva_text']}{currency}",
+        f"TotalenTTC {values['ttc_text']}{currency}",
+    ]
+    return "\n".join(lines)
+
+
+def _invoice(rng, values):
+    """Facture française classique (libellés séparés, date JJ/MM/AAAA)"""
+    currency = values["currency_label"]
+    lines = [
+        rng.choice(["FACTURE", "Facture", "FACTURE N°"]) + f" {values['reference']}",
+        f"Fournisseur: {values['vendor']}",
+        f"Date: {values['date'].strftime('%d/%m/%Y')}",
+        f"Ville: {rng.choice(CITIES)}",
+        "Désignation    Qté    PU    Total",
+    ]
+    lines += values["item_lines"]
+    lines += [
+        f"Total HT: {values['ht_text']} {currency}",
+        f"TVA {values['rate_text']}%: {values['tva_text']} {currency}",
+        f"Total TTC: {values['ttc_text']} {currency}",
+    ]
+    return "\n".join(lines)
+
+
+def _receipt(rng, values):
+    """Ticket de caisse (TTC seul, TVA incluse)"""
+    currency = values["currency_label"]
+    lines = [
+        values["vendor"].upper(),
+        rng.choice(CITIES),
+        f"TICKET DE CAISSE N° {values['reference']}",
+        f"Date: {values['date'].strftime('%d/%m/%Y')} {rng.randint(8, 20):02d}:{rng.randint(0, 59):02d}",
+    ]
+    lines += values["item_lines"]
+    lines += [
+        f"TOTAL TTC: {values['ttc_text']} {currency}",
+        f"dont TVA {values['rate_text']}%: {values['tva_text']} {currency}",
+        f"Total HT: {values['ht_text']} {currency}",
+        rng.choice(["Espèces", "Carte bancaire", "CB"]),
+        "Merci de votre visite",
+    ]
+    return "\n".join(lines)
+
+
+def _purchase_order(rng, values):
+    """Bon de commande adressé à un fournisseur"""
+    currency = values["currency_label"]
+    lines = [
+        rng.choice(["BON DE COMMANDE", "Bon de commande", "BONDECOMMANDE"]) + f" N° {values['reference']}",
+        f"Fournisseur: {values['vendor']}",
+        f"Date de commande: {values['date'].strftime('%d/%m/%Y')}",
+        f"Livraison souhaitée: {(values['date'] + timedelta(days=rng.randint(3, 30))).strftime('%d/%m/%Y')}",
+        "Désignation    Qté commandée    PU    Total",
+    ]
+    lines += values["item_lines"]
+    lines += [
+        f"Total HT: {values['ht_text']} {currency}",
+        f"TVA {values['rate_text']}%: {values['tva_text']} {currency}",
+        f"Total TTC: {values['ttc_text']} {currency}",
+        "Signature et cachet de l'acheteur",
+    ]
+    return "\n".join(lines)
+
+
+TEMPLATES = {
+    "delivery_note": _delivery_note,
+    "invoice": _invoice,
+    "receipt": _receipt,
+    "purchase_order": _purchase_order,
+}
+
+# Types générés par défaut (corpus des benchmarks, inchangé pour une même graine)
+DEFAULT_KINDS = ("delivery_note", "invoice")
+
+
+def generate_document(rng, index, noise=0.0, kinds=DEFAULT_KINDS):
+    """Génère un document et ses valeurs attendues"""
+    kind = rng.choice(sorted(kinds))
+    currency = rng.choice(sorted(CURRENCIES))
+    label, decimals = CURRENCIES[currency]
+    style = "tn" if currency != "EUR" else rng.choice(["fr", "tn", "dot"])
+
+    # Lignes d'articles, puis totaux cohérents (HT + TVA = TTC)
+    item_lines = []
+    ht = 0.0
+    for _ in range(rng.randint(1, 6)):
+        quantity = rng.randint(1, 10)
+        unit_price = round(rng.uniform(5, 900), decimals)
+        total = round(quantity * unit_price, decimals)
+        ht += total
+        item_lines.append(f"{rng.choice(PRODUCTS)} {quantity} {format_amount(unit_price, decimals, style)} "
+                          f"{format_amount(total, decimals, style)}")
+    ht = round(ht, decimals)
+    rate = rng.choice(VAT_RATES[currency])
+    tva = round(ht * rate / 100, decimals)
+    ttc = round(ht + tva, decimals)
+
+    if kind == "delivery_note":
+        reference = str(rng.randint(10 ** 11, 10 ** 12 - 1))
+        vendor = f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES).replace(' ', '').lower()}"
+    elif kind == "receipt":
+        reference = str(rng.randint(1, 99999))
+        vendor = rng.choice(COMPANIES)
+    elif kind == "purchase_order":
+        reference = f"BC{rng.randint(2019, 2025)}-{rng.randint(1, 9999):04d}"
+        vendor = rng.choice(COMPANIES)
+    else:
+        reference = f"FA{rng.randint(2019, 2025)}-{rng.randint(1, 9999):04d}"
+        vendor = rng.choice(COMPANIES)
+
+    document_date = date(2019, 1, 1) + timedelta(days=rng.randint(0, 6 * 365))
+    values = {
+        "reference": reference,
+        "vendor": vendor,
+        "date": document_date,
+        "currency_label": label,
+        "item_lines": item_lines,
+        "rate_text": f"{rate:g}",
+        "ht_text": format_amount(ht, decimals, style),
+        "tva_text": format_amount(tva, decimals, style),
+        "ttc_text": format_amount(ttc, decimals, style),
+    }
+
+    text = add_ocr_noise(TEMPLATES[kind](rng, values), rng, noise)
+    return {
+        "id": index,
+        "kind": kind,
+        "text": text,
+        "entities": {
+            "date": document_date.isoformat(),
+            "montantHT": f"{ht:.{decimals}f}",
+            "tva": f"{tva:.{decimals}f}",
+            "montantTTC": f"{ttc:.{decimals}f}",
+            "vendor": vendor,
+            "reference": reference,
+        },
+    }
+
+
+def generate_corpus(count, seed=0, noise=0.0, kinds=DEFAULT_KINDS):
+    """Génère `count` documents de manière reproductible (même graine -> même corpus)"""
+    rng = random.Random(seed)
+    for index in range(count):
+        yield generate_document(rng, index, noise, kinds)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Génère un corpus de factures synthétiques (JSON Lines)")
+    arg_parser.add_argument("--count", type=int, default=1000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--noise", type=float, default=0.0, help="Probabilité d'erreur OCR par caractère")
+    arg_parser.add_argument("--kinds", nargs="+", choices=sorted(TEMPLATES), default=list(DEFAULT_KINDS),
+                            help="Types de documents générés")
+    arg_parser.add_argument("--output", default="-", help="Fichier de sortie, ou '-' pour stdout")
+    args = arg_parser.parse_args()
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for document in generate_corpus(args.count, args.seed, args.noise, args.kinds):
+            output.write(json.dumps(document, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
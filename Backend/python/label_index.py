@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Index approximatif des libellés de champs, tolérant aux erreurs OCR.
+
+Les scans réels produisent des libellés collés ou abîmés ("TotalenTTC",
+"NOMDEDESTINATAIRE", "Fourniseur", "Mont4nt HT") que les patterns exacts manquent.
+Comparer chaque mot à chaque libellé par distance d'édition serait trop lent: les
+libellés connus (français et arabes) sont indexés une fois à la manière de SymSpell.
+
+- Chaque libellé est replié (minuscules, sans accents ni espaces, chiffres confondus
+  avec des lettres ramenés à ces lettres, formes de l'alif unifiées) puis les variantes
+  obtenues en supprimant jusqu'à deux caractères de son préfixe sont rangées dans un
+  dictionnaire.
+- Dans le document, chaque suite de 1 à MAX_LABEL_WORDS mots d'une même ligne est
+  repliée de la même façon; ses variantes par suppression (préfixe de PREFIX_LENGTH
+  caractères) donnent directement les libellés candidats, vérifiés par une distance
+  d'édition bornée. Le coût est linéaire en longueur du document.
+- La distance tolérée dépend de la longueur du libellé (0 jusqu'à 4 caractères, 1
+  jusqu'à 8, 2 au-delà): "tva" doit être exact, "nomdedestinataire" accepte deux erreurs.
+
+`find_anchors` retourne les libellés trouvés (positions dans le texte), et
+`extract_values` la valeur valide qui suit chacun sur la même ligne, pour les
+extracteurs des parsers et de la mise en page.
+"""
+
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+from amount_index import parse_amount, format_amount, detect_currency
+
+# Libellés connus par champ. Les clés sont les champs du parser simple.
+FIELD_LABELS = {
+    "montantHT": [
+        "montant ht", "total ht", "montant en ht", "total en ht", "hors taxe", "hors taxes",
+        "total hors taxes", "ht",
+        "المبلغ خارج الأداءات", "المجموع دون اعتبار الأداءات",
+    ],
+    "montantTTC": [
+        "montant ttc", "total ttc", "total en ttc", "montant en ttc", "net ttc", "net a payer",
+        "toutes taxes comprises", "ttc",
+        "المبلغ باعتبار كل الأداءات", "المجموع باعتبار الأداءات", "الصافي للدفع",
+    ],
+    "tva": [
+        "tva", "montant tva", "total tva", "taxe",
+        "الأداء على القيمة المضافة",
+    ],
+    "date": [
+        "date", "date facture", "date de facture", "date de facturation", "date de livraison",
+        "التاريخ",
+    ],
+    "reference": [
+        "facture n", "facture no", "bon de livraison", "bon de livraison n", "reference", "ref",
+        "numero", "رقم الفاتورة", "عدد الفاتورة", "وصل تسليم",
+    ],
+    "vendor": [
+        "nom de destinataire", "nom destinataire", "destinataire", "fournisseur", "nom fournisseur",
+        "nom du client", "client",
+        "المرسل إليه", "اسم الحريف", "الحريف", "المزود",
+    ],
+    "phone": ["telephone", "tel", "الهاتف"],
+    "address": ["adresse", "العنوان"],
+}
+
+MAX_DISTANCE = 2
+# Longueur du préfixe indexé (SymSpell): borne le nombre de variantes par mot
+PREFIX_LENGTH = 7
+# Nombre maximal de mots d'un libellé ("المبلغ باعتبار كل الأداءات")
+MAX_LABEL_WORDS = 4
+# Nombre maximal de mots regroupés en une valeur ("1 103,36 €", "Électro Sahel SARL")
+MAX_VALUE_WORDS = 4
+
+AMOUNT_FIELDS = ("montantHT", "montantTTC", "tva")
+DATE_VALUE = re.compile(r"^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})$|^(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})$")
+REFERENCE_VALUE = re.compile(r"^(?=[A-Z0-9/-]*\d)[A-Z0-9][A-Z0-9/-]{3,}$", re.IGNORECASE)
+AMOUNT_VALUE = re.compile(r"^\d[\d\s.,]*(?:€|EUR|DT|TND|DIN)?$")
+NAME_VALUE = re.compile(r"^[A-Za-zÀ-ÿء-ي][A-Za-zÀ-ÿء-ي .'-]*$")
+PHONE_VALUE = re.compile(r"^\+?[\d .-]{8,}$")
+# Taux écrit entre le libellé TVA et son montant ("TVA19% 209,639DT")
+RATE_PREFIX = re.compile(r"^\d{1,2}(?:[.,]\d{1,2})?\s*%\s*")
+
+# Mots: suites de lettres, chiffres confondus avec des lettres compris ("l0ntîln")
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:[01458][^\W\d_]+)*")
+
+# Chiffres lus à la place de lettres, et variantes arabes ramenées à une forme
+_FOLD_TABLE = str.maketrans({
+    "0": "o", "1": "l", "4": "a", "5": "s", "8": "b",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ـ": None,
+})
+
+Anchor = namedtuple("Anchor", ["field", "label", "text", "start", "end", "distance"])
+
+
+def fold(text):
+    """Forme repliée d'un libellé ou d'un mot: minuscules, sans accents, espaces ni tatweel"""
+    if text.isascii():
+        return "".join(text.lower().split()).translate(_FOLD_TABLE)
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char) and not char.isspace())
+    return text.translate(_FOLD_TABLE)
+
+
+# Les mêmes mots reviennent d'un document à l'autre
+_fold_word = lru_cache(maxsize=65536)(fold)
+
+
+def allowed_distance(key):
+    """Distance d'édition tolérée pour un libellé replié, selon sa longueur"""
+    if len(key) <= 4:
+        return 0
+    return 1 if len(key) <= 8 else MAX_DISTANCE
+
+
+def _deletes(word, distance):
+    """Variantes de `word` obtenues en supprimant jusqu'à `distance` caractères"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+def bounded_distance(a, b, limit):
+    """Distance de Levenshtein entre a et b si elle est au plus `limit`, sinon None"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    beyond = limit + 1
+    previous = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        # Seule la bande |i - j| <= limit peut rester sous la borne
+        low, high = max(1, i - limit), min(len(b), i + limit)
+        current = [beyond] * (len(b) + 1)
+        current[0] = i if i <= limit else beyond
+        for j in range(low, high + 1):
+            current[j] = min(previous[j - 1] + (a[i - 1] != b[j - 1]), previous[j] + 1, current[j - 1] + 1)
+        if min(current[low - 1:high + 1]) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class FuzzyLabelIndex:
+    """Dictionnaire de variantes par suppression (SymSpell) des libellés connus"""
+
+    def __init__(self, labels=None, prefix_length=PREFIX_LENGTH):
+        self.prefix_length = prefix_length
+        self.keys = {}
+        self._deletes = {}
+        for field, variants in (labels or FIELD_LABELS).items():
+            for label in variants:
+                key = fold(label)
+                self.keys.setdefault(key, (field, label))
+                for variant in _deletes(key[:prefix_length], allowed_distance(key)):
+                    self._deletes.setdefault(variant, set()).add(key)
+        lengths = [len(key) for key in self.keys]
+        self.min_length = max(1, min(lengths) - MAX_DISTANCE)
+        self.max_length = max(lengths) + MAX_DISTANCE
+        self.lookup = lru_cache(maxsize=65536)(self._lookup)
+
+    def _lookup(self, folded):
+        """(distance, clé) du libellé le plus proche de `folded`, ou None (ambigu ou trop loin)"""
+        best, tie = None, False
+        seen = set()
+        for variant in _deletes(folded[:self.prefix_length], MAX_DISTANCE):
+            for key in self._deletes.get(variant, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = bounded_distance(folded, key, allowed_distance(key))
+                if distance is None:
+                    continue
+                if best is None or distance < best[0]:
+                    best, tie = (distance, key), False
+                elif distance == best[0] and self.keys[key][0] != self.keys[best[1]][0]:
+                    tie = True
+        return None if best is None or tie else best
+
+    def find_anchors(self, text):
+        """
+        Libellés du texte, sans chevauchement, dans l'ordre du document. Le libellé qui
+        couvre le plus de caractères du libellé connu, moins ses erreurs, l'emporte
+        ("Total TTC" plutôt que "TTC", "Date factur" plutôt que "Date").
+        """
+        found = []
+        offset = 0
+        for line_number, line in enumerate(text.split("\n")):
+            words = [(m.start() + offset, m.end() + offset, _fold_word(m.group(0))) for m in WORD_PATTERN.finditer(line)]
+            offset += len(line) + 1
+            for first in range(len(words)):
+                folded = ""
+                for last in range(first, min(first + MAX_LABEL_WORDS, len(words))):
+                    folded += words[last][2]
+                    if len(folded) > self.max_length:
+                        break
+                    if len(folded) < self.min_length:
+                        continue
+                    match = self.lookup(folded)
+                    if match is not None:
+                        distance, key = match
+                        start, end = words[first][0], words[last][1]
+                        field, label = self.keys[key]
+                        anchor = Anchor(field, label, text[start:end], start, end, distance)
+                        found.append((distance - len(key), line_number, first, last, anchor))
+
+        # Sélection gloutonne des meilleurs libellés; un mot n'appartient qu'à un libellé
+        found.sort(key=lambda entry: entry[:3])
+        anchors, taken = [], set()
+        for _, line_number, first, last, anchor in found:
+            words = [(line_number, index) for index in range(first, last + 1)]
+            if not taken.intersection(words):
+                anchors.append(anchor)
+                taken.update(words)
+        anchors.sort(key=lambda anchor: anchor.start)
+        return anchors
+
+
+_default_index = None
+
+
+def get_label_index():
+    """Index des libellés connus, construit au premier appel"""
+    global _default_index
+    if _default_index is None:
+        _default_index = FuzzyLabelIndex()
+    return _default_index
+
+
+def find_anchors(text):
+    return get_label_index().find_anchors(text)
+
+
+def normalize_date(value):
+    """Date au format AAAA-MM-JJ si elle est reconnue, sinon la valeur telle quelle"""
+    match = DATE_VALUE.match(value)
+    if not match:
+        return value
+    if match.group(1):
+        year, month, day = match.group(1), match.group(2), match.group(3)
+    else:
+        day, month, year = match.group(4), match.group(5), match.group(6)
+        if len(year) == 2:
+            year = ("20" if int(year) < 50 else "19") + year
+    return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+
+
+def validate_value(field, raw, currency=None):
+    """Valeur normalisée si `raw` convient au champ, sinon None"""
+    raw = raw.strip()
+    if field in AMOUNT_FIELDS:
+        if not AMOUNT_VALUE.match(raw):
+            return None
+        amount = parse_amount(raw, currency)
+        return format_amount(amount) if amount is not None else None
+    if field == "date":
+        return normalize_date(raw) if DATE_VALUE.match(raw) else None
+    if field == "reference":
+        return raw if REFERENCE_VALUE.match(raw) else None
+    if field == "phone":
+        return raw if PHONE_VALUE.match(raw) and sum(char.isdigit() for char in raw) >= 8 else None
+    if field == "address":
+        return raw if any(char.isalpha() for char in raw) else None
+    return raw if NAME_VALUE.match(raw) else None
+
+
+def extract_values(text, currency=None, anchors=None):
+    """
+    Valeur qui suit chaque libellé sur la même ligne (après ":" éventuel), jusqu'au
+    libellé suivant: {champ: {"value", "raw", "label", "distance", "start"}}.
+    Pour chaque champ, le premier libellé suivi d'une valeur valide l'emporte.
+    """
+    anchors = find_anchors(text) if anchors is None else anchors
+    currency = currency or detect_currency(text)
+    found = {}
+    for position, anchor in enumerate(anchors):
+        if anchor.field in found:
+            continue
+        line_end = text.find("\n", anchor.end)
+        limit = len(text) if line_end < 0 else line_end
+        if position + 1 < len(anchors):
+            limit = min(limit, anchors[position + 1].start)
+        rest = text[anchor.end:limit].lstrip(" \t:.-")
+        if anchor.field == "tva":
+            rest = RATE_PREFIX.sub("", rest).lstrip(" \t:.-")
+
+        # Plus longue suite de mots (au plus MAX_VALUE_WORDS) qui forme une valeur valide
+        best = None
+        words = rest.split()
+        for count in range(1, min(len(words), MAX_VALUE_WORDS) + 1):
+            raw = " ".join(words[:count])
+            value = validate_value(anchor.field, raw, currency)
+            if value is not None:
+                best = (value, raw)
+        if best is not None:
+            found[anchor.field] = {
+                "value": best[0],
+                "raw": best[1],
+                "label": anchor.text,
+                "distance": anchor.distance,
+                "start": anchor.start,
+            }
+    return found
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Extraction tenant compte de la mise en page, à partir des mots positionnés de Tesseract.
+
+Le texte aplati perd l'alignement des colonnes: sur un scan réel, "Montant HT" et sa
+valeur peuvent être séparés par d'autres colonnes. Ici chaque mot garde sa boîte
+englobante (TSV ou hOCR de Tesseract):
+
+- `read_tsv` / `read_hocr`: lisent les mots (texte, boîte, page, ligne, confiance).
+- `SpatialIndex`: grille uniforme par page (cellules d'environ trois hauteurs de mot).
+  La recherche du plus proche voisin à droite ou en dessous ne parcourt que les
+  cellules de la bande concernée, par distance croissante, et s'arrête dès qu'aucune
+  cellule plus lointaine ne peut contenir un mot plus proche.
+- `LayoutDocument.extract_fields`: repère les libellés (registre de patterns partagé,
+  appliqué une fois au texte reconstruit ligne par ligne, complété par l'index
+  approximatif de label_index pour les libellés abîmés), puis associe à chacun la
+  valeur valide la plus proche: dans le même mot ("Date:2020-11-25"), à droite sur la
+  même ligne visuelle, ou en dessous.
+"""
+
+import re
+import csv
+import io
+from bisect import bisect_right
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from pattern_registry import get_registry, PatternMatch
+from amount_index import detect_currency
+from label_index import MAX_VALUE_WORDS, find_anchors, validate_value
+
+Word = namedtuple("Word", ["text", "left", "top", "right", "bottom", "page", "line", "conf"])
+
+# Libellés par champ (groupe 1 = libellé). Les mots d'une ligne sont séparés par une
+# espace et les lignes par un saut de ligne: les patterns ne traversent pas les lignes.
+LAYOUT_LABELS = {
+    "montantHT": [
+        r"((?:montant|total)(?: ?en)? ?h\.?t\.?)(?![a-z])",
+        r"(hors ?taxes?)",
+    ],
+    "montantTTC": [
+        r"((?:montant|total|net)(?: ?en)? ?t\.?t\.?c\.?)(?![a-z])",
+        r"(net ?[àa] ?payer)",
+        r"(toutes ?taxes ?comprises)",
+    ],
+    "tva": [
+        r"((?:montant ?)?t\.?v\.?a\.?(?: ?\d{1,2}(?:[.,]\d{1,2})? ?%)?)(?![a-z])",
+    ],
+    "date": [
+        r"(date(?: ?(?:de ?)?(?:facture|facturation|livraison))?) ?:?",
+    ],
+    "reference": [
+        r"((?:facture|bon ?de ?livraison|bondelivraison) ?n?[°o]?) ?:?",
+        r"(r[ée]f(?:[ée]rence)?\.?) ?:?",
+    ],
+    "vendor": [
+        r"(nom ?(?:de ?)?(?:destinataire|fournisseur|client)) ?:?",
+        r"(destinataire|fournisseur|client) ?:",
+    ],
+}
+
+LABEL_REGISTRY = get_registry(LAYOUT_LABELS)
+
+def read_tsv(content):
+    """Mots d'un export TSV de Tesseract (niveau 5), dans l'ordre de lecture"""
+    words = []
+    reader = csv.DictReader(io.StringIO(content), delimiter="\t", quoting=csv.QUOTE_NONE)
+    for row in reader:
+        text = (row.get("text") or "").strip()
+        if row.get("level") != "5" or not text:
+            continue
+        left, top = int(row["left"]), int(row["top"])
+        line = (int(row["page_num"]), int(row["block_num"]), int(row["par_num"]), int(row["line_num"]))
+        words.append(Word(text, left, top, left + int(row["width"]), top + int(row["height"]),
+                          int(row["page_num"]), line, float(row.get("conf") or -1)))
+    return words
+
+
+class _HocrReader(HTMLParser):
+    """Lit les éléments ocrx_word (boîte et confiance dans l'attribut title)"""
+
+    LINE_CLASSES = {"ocr_line", "ocrx_line", "ocr_header", "ocr_caption", "ocr_textfloat"}
+
+    def __init__(self):
+        super().__init__()
+        self.words = []
+        self.page = 0
+        self.line = 0
+        self._stack = []
+        self._word = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        self._stack.append(tag)
+        if "ocr_page" in classes:
+            self.page += 1
+        if classes & self.LINE_CLASSES:
+            self.line += 1
+        if "ocrx_word" in classes:
+            title = attrs.get("title") or ""
+            bbox = re.search(r"bbox (\d+) (\d+) (\d+) (\d+)", title)
+            conf = re.search(r"x_wconf (\d+)", title)
+            if bbox:
+                self._word = {"box": [int(value) for value in bbox.groups()],
+                              "conf": float(conf.group(1)) if conf else -1.0,
+                              "depth": len(self._stack), "text": []}
+
+    def handle_endtag(self, tag):
+        if self._word is not None and len(self._stack) == self._word["depth"]:
+            text = "".join(self._word["text"]).strip()
+            if text:
+                left, top, right, bottom = self._word["box"]
+                self.words.append(Word(text, left, top, right, bottom, self.page,
+                                       (self.page, self.line), self._word["conf"]))
+            self._word = None
+        if self._stack:
+            self._stack.pop()
+
+    def handle_data(self, data):
+        if self._word is not None:
+            self._word["text"].append(data)
+
+
+def read_hocr(content):
+    """Mots d'un document hOCR de Tesseract, dans l'ordre de lecture"""
+    reader = _HocrReader()
+    reader.feed(content)
+    reader.close()
+    return reader.words
+
+
+def read_words(path):
+    """Lit un fichier .tsv ou .hocr/.html de Tesseract"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    return read_tsv(content) if path.lower().endswith(".tsv") else read_hocr(content)
+
+
+class SpatialIndex:
+    """Grille uniforme des mots, par page, pour les recherches de voisins"""
+
+    def __init__(self, words, cell_size=None):
+        self.words = words
+        heights = sorted(word.bottom - word.top for word in words) or [10]
+        self.line_height = max(1, heights[len(heights) // 2])
+        self.cell_size = cell_size or max(8, 3 * self.line_height)
+        self.cells = {}
+        self.extent = {}
+
+        size = self.cell_size
+        cells = self.cells
+        extent = self.extent
+        for index, word in enumerate(words):
+            page = word.page
+            last_cx, last_cy = word.right // size, word.bottom // size
+            for cx in range(word.left // size, last_cx + 1):
+                for cy in range(word.top // size, last_cy + 1):
+                    key = (page, cx, cy)
+                    if key in cells:
+                        cells[key].append(index)
+                    else:
+                        cells[key] = [index]
+            max_cx, max_cy = extent.get(page, (0, 0))
+            if last_cx > max_cx or last_cy > max_cy:
+                extent[page] = (max(max_cx, last_cx), max(max_cy, last_cy))
+
+    def right_of(self, box, page, accept=None, max_distance=None):
+        """Mot le plus proche à droite de `box` (left, top, right, bottom) sur la même ligne visuelle"""
+        left, top, right, bottom = box
+        size = self.cell_size
+        max_cx = self.extent.get(page, (0, 0))[0]
+        if max_distance is not None:
+            max_cx = min(max_cx, (right + max_distance) // size)
+        rows = range(top // size, bottom // size + 1)
+
+        best, best_distance = None, None
+        for cx in range(right // size, max_cx + 1):
+            # Aucune cellule plus à droite ne peut contenir un mot plus proche
+            if best is not None and cx * size - right > best_distance:
+                break
+            for cy in rows:
+                for index in self.cells.get((page, cx, cy), ()):
+                    word = self.words[index]
+                    distance = word.left - right
+                    if word.left <= left or distance < -self.line_height / 2:
+                        continue
+                    if best is not None and distance >= best_distance:
+                        continue
+                    if _overlap(word.top, word.bottom, top, bottom) < 0.5 * min(word.bottom - word.top, bottom - top):
+                        continue
+                    if accept is None or accept(index):
+                        best, best_distance = index, distance
+        return best
+
+    def below(self, box, page, accept=None, max_distance=None):
+        """Mot le plus proche sous `box`, dans la même bande de colonnes"""
+        left, top, right, bottom = box
+        size = self.cell_size
+        max_cy = self.extent.get(page, (0, 0))[1]
+        if max_distance is not None:
+            max_cy = min(max_cy, (bottom + max_distance) // size)
+        columns = range(left // size, right // size + 1)
+
+        best, best_distance = None, None
+        for cy in range(bottom // size, max_cy + 1):
+            if best is not None and cy * size - bottom > best_distance:
+                break
+            for cx in columns:
+                for index in self.cells.get((page, cx, cy), ()):
+                    word = self.words[index]
+                    distance = word.top - bottom
+                    if distance < 0:
+                        continue
+                    if best is not None and distance >= best_distance:
+                        continue
+                    if _overlap(word.left, word.right, left, right) <= 0:
+                        continue
+                    if accept is None or accept(index):
+                        best, best_distance = index, distance
+        return best
+
+
+def _overlap(start1, end1, start2, end2):
+    return min(end1, end2) - max(start1, start2)
+
+
+def _union(words):
+    return (min(w.left for w in words), min(w.top for w in words),
+            max(w.right for w in words), max(w.bottom for w in words))
+
+
+class LayoutDocument:
+    """Mots positionnés d'un document, leur texte reconstruit et leur index spatial"""
+
+    def __init__(self, words):
+        self.words = words
+        self.index = SpatialIndex(words)
+
+        # Texte ligne par ligne et position de départ de chaque mot dans ce texte
+        parts, self.offsets = [], []
+        position, previous_line = 0, None
+        for word in words:
+            if previous_line is not None:
+                separator = " " if word.line == previous_line else "\n"
+                parts.append(separator)
+                position += 1
+            self.offsets.append(position)
+            parts.append(word.text)
+            position += len(word.text)
+            previous_line = word.line
+        self.text = "".join(parts)
+        self.currency = detect_currency(self.text)
+        self._label_words = set()
+
+    def _candidate(self, index):
+        """Un mot de libellé ou de ponctuation seule ne peut pas commencer une valeur"""
+        return index not in self._label_words and any(char.isalnum() for char in self.words[index].text)
+
+    def word_at(self, offset):
+        """Indice du mot qui contient la position `offset` du texte reconstruit"""
+        return bisect_right(self.offsets, offset) - 1
+
+    def extract_fields(self, fields=None):
+        """
+        Valeur de chaque champ trouvée à partir de son libellé:
+        {champ: {"value", "raw", "label", "relation", "box", "page"}}.
+        """
+        scan = LABEL_REGISTRY.scan(self.text)
+        families = fields or list(LAYOUT_LABELS)
+
+        # Libellés exacts d'abord, puis libellés abîmés par l'OCR (index approximatif)
+        labels = {field: list(scan.all(field)) for field in families}
+        for anchor in find_anchors(self.text):
+            if anchor.field in labels:
+                labels[anchor.field].append(PatternMatch(anchor.text, anchor.start, anchor.end, None))
+
+        # Les mots de libellé ne peuvent pas servir de valeur à un autre champ
+        self._label_words = {index for matches in labels.values() for match in matches
+                             for index in range(self.word_at(match.start), self.word_at(match.end - 1) + 1)}
+
+        found = {}
+        for field in families:
+            for match in labels[field]:
+                value = self._value_for(field, match)
+                if value:
+                    found[field] = value
+                    break
+        return found
+
+    def _value_for(self, field, match):
+        first, last = self.word_at(match.start), self.word_at(match.end - 1)
+        label_words = self.words[first:last + 1]
+        box, page = _union(label_words), label_words[0].page
+
+        # Valeur collée au libellé dans le même mot ("Date:2020-11-25", "TVA19%" exclu)
+        last_word = self.words[last]
+        rest = last_word.text[match.end - self.offsets[last]:].lstrip(" :")
+        if rest:
+            value = self._validate(field, rest)
+            if value is not None:
+                return self._result(value, rest, match, "same_word", (last_word,))
+
+        # Le premier mot accepté doit commencer une valeur valide: les colonnes
+        # intermédiaires ("Remise", "Qté") sont sautées
+        phrases = {}
+
+        def starts_value(index):
+            if not self._candidate(index):
+                return False
+            if index not in phrases:
+                phrases[index] = self._phrase(field, index)
+            return phrases[index] is not None
+
+        for relation in ("right", "below"):
+            search = self.index.right_of if relation == "right" else self.index.below
+            start = search(box, page, accept=starts_value,
+                           max_distance=None if relation == "right" else 3 * self.index.line_height)
+            if start is not None:
+                value = phrases[start]
+                return self._result(value[0], value[1], match, relation, value[2])
+        return None
+
+    def _phrase(self, field, start):
+        """Plus longue suite de mots (même ligne, espacement normal) qui forme une valeur valide"""
+        words = [self.words[start]]
+        best = None
+        while True:
+            raw = " ".join(word.text for word in words)
+            value = self._validate(field, raw)
+            if value is not None:
+                best = (value, raw, tuple(words))
+            if len(words) >= MAX_VALUE_WORDS:
+                break
+            last = words[-1]
+            following = self.index.right_of((last.left, last.top, last.right, last.bottom), last.page,
+                                            accept=lambda index: index not in self._label_words,
+                                            max_distance=self.index.line_height)
+            if following is None:
+                break
+            words.append(self.words[following])
+        return best
+
+    def _validate(self, field, raw):
+        """Valeur normalisée si `raw` convient au champ, sinon None"""
+        return validate_value(field, raw, self.currency)
+
+    def _result(self, value, raw, match, relation, words):
+        return {
+            "value": value,
+            "raw": raw,
+            "label": match.value,
+            "relation": relation,
+            "box": list(_union(words)),
+            "page": words[0].page,
+        }
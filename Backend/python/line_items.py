@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Extraction des lignes d'articles (Désignation / Quantité / Prix unitaire / Total).
+
+Les jetons d'un document sont les mots positionnés de Tesseract (layout_index.Word,
+positions en pixels) ou, à défaut, les mots de chaque ligne du texte avec leur position
+en caractères.
+
+- Lignes candidates: entre l'en-tête du tableau ("Désignation", "Qté", "PU"...) et la
+  première ligne de totaux, les lignes qui se terminent par au moins deux nombres.
+- Colonnes: les intervalles [gauche, droite) des jetons numériques de toutes les lignes
+  candidates sont cumulés dans un histogramme de couverture (NumPy, une passe). Les
+  zones vides d'au moins `min_gap` séparent les colonnes; chaque jeton est rangé dans
+  sa colonne par np.searchsorted. Les mots d'une même cellule sont réunis, ce qui
+  reconstitue les montants à espace de milliers ("3 959,19"). Le rôle des colonnes vient
+  des mots de l'en-tête placés au-dessus, sinon de leur ordre (total à droite, puis prix
+  unitaire, puis quantité).
+- Sans colonnes alignées (texte OCR aux espaces irréguliers), chaque ligne est lue de
+  droite à gauche: toutes les façons de regrouper les derniers nombres en quantité,
+  prix unitaire et total sont essayées, et celle qui vérifie quantité × prix = total
+  est retenue.
+
+Chaque ligne porte le résultat de ce contrôle ("coherent"), et la somme des totaux est
+comparée au montant HT du document.
+"""
+
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+from amount_index import parse_amount, format_amount
+from text_normalizer import normalize_text
+
+Token = namedtuple("Token", ["text", "left", "right", "line"])
+# Ligne d'articles candidate: jetons de la ligne (sans les devises isolées de la fin) et
+# nombres de fin de ligne (devise retirée)
+Row = namedtuple("Row", ["tokens", "numbers"])
+
+HEADER_PATTERN = re.compile(
+    r"d[ée]signation|article|produit|libell[ée]|qt[ée]|quantit[ée]|prix|p\.?u\.?\b|montant|total",
+    re.IGNORECASE,
+)
+HEADER_ROLES = (
+    ("quantity", re.compile(r"qt[ée]|quantit[ée]", re.IGNORECASE)),
+    ("unit_price", re.compile(r"prix|p\.?u\b|unitaire", re.IGNORECASE)),
+    ("total", re.compile(r"total|montant", re.IGNORECASE)),
+)
+# Lignes de totaux: fin du tableau
+TOTALS_PATTERN = re.compile(r"\b(?:total|montant|sous[- ]?total|net)\b|\bht\b|\bttc\b|\btva\b", re.IGNORECASE)
+TOTALS_GLUED_PATTERN = re.compile(r"^(?:total|montant|tva|net)", re.IGNORECASE)
+NUMBER_TOKEN = re.compile(r"^\d[\d.,]*$")
+# Devise collée à un montant ("552,685TND")
+CURRENCY_SUFFIX = re.compile(r"(?<=\d)(?:€|EUR|DT|TND|DIN)$")
+# Devise séparée de son montant ("1000,00 €")
+CURRENCY_TOKEN = re.compile(r"^(?:€|EUR|DT|TND|DIN)$")
+TOKEN_PATTERN = re.compile(r"\S+")
+
+# Écart toléré entre quantité × prix unitaire et le total d'une ligne (arrondis)
+TOLERANCE = Decimal("0.011")
+# Nombre maximal de jetons réunis en un montant à espaces de milliers ("1 103 361,000")
+MAX_GROUPS = 3
+# Rôles des colonnes numériques, de droite à gauche, sans en-tête
+POSITIONAL_ROLES = ("total", "unit_price", "quantity")
+
+
+def text_tokens(text):
+    """Jetons du texte, position en caractères dans leur ligne"""
+    tokens = []
+    for number, line in enumerate(text.split("\n")):
+        for match in TOKEN_PATTERN.finditer(line):
+            tokens.append(Token(match.group(0), match.start(), match.end(), number))
+    return tokens
+
+
+def normalized_tokens(normalized):
+    """
+    Jetons du texte normalisé (text_normalizer.NormalizedText), position en caractères
+    dans leur ligne du texte d'origine: la réduction des espaces ne décale pas les colonnes
+    """
+    if normalized.offsets is None:
+        return text_tokens(normalized.text)
+    # La normalisation ne retire jamais de saut de ligne: les lignes se correspondent
+    line_starts = [0]
+    for line in normalized.original.split("\n")[:-1]:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+    tokens = []
+    position = 0
+    for number, line in enumerate(normalized.text.split("\n")):
+        for match in TOKEN_PATTERN.finditer(line):
+            start, end = normalized.original_span(position + match.start(), position + match.end())
+            tokens.append(Token(match.group(0), start - line_starts[number], end - line_starts[number], number))
+        position += len(line) + 1
+    return tokens
+
+
+def word_tokens(words):
+    """
+    Jetons des mots positionnés de Tesseract (positions en pixels), texte normalisé.
+    Tesseract découpe souvent un tableau en blocs par colonne: les lignes sont refaites
+    en regroupant les mots dont le centre vertical est à moins d'une demi-hauteur de ligne.
+    """
+    if not words:
+        return []
+    pages = np.array([word.page for word in words], dtype=np.int64)
+    centers = np.array([(word.top + word.bottom) / 2 for word in words], dtype=np.float64)
+    lefts = np.array([word.left for word in words], dtype=np.int64)
+    half_height = max(1.0, float(np.median([word.bottom - word.top for word in words])) / 2)
+
+    order = np.lexsort((centers, pages))
+    breaks = np.ones(len(words), dtype=bool)
+    breaks[1:] = (np.diff(centers[order]) > half_height) | (np.diff(pages[order]) != 0)
+    lines = np.empty(len(words), dtype=np.int64)
+    lines[order] = np.cumsum(breaks)
+
+    return [Token(normalize_text(words[index].text).text, words[index].left, words[index].right, int(lines[index]))
+            for index in np.lexsort((lefts, lines))]
+
+
+def word_gap(words):
+    """Espace minimal entre colonnes pour des mots positionnés: une fois et demie la largeur médiane d'un caractère"""
+    widths = np.array([(word.right - word.left) / len(word.text) for word in words if word.text], dtype=np.float64)
+    return max(1, int(1.5 * np.median(widths))) if len(widths) else 2
+
+
+def _number(text):
+    text = CURRENCY_SUFFIX.sub("", text)
+    return text if NUMBER_TOKEN.match(text) and text[-1].isdigit() else None
+
+
+def _group_lines(tokens):
+    """Jetons regroupés par ligne, dans l'ordre du document"""
+    lines, index = [], {}
+    for token in tokens:
+        if token.line not in index:
+            index[token.line] = len(lines)
+            lines.append([])
+        lines[index[token.line]].append(token)
+    return lines
+
+
+def _is_header(line):
+    return len({match.group(0).lower()[:3] for match in HEADER_PATTERN.finditer(" ".join(t.text for t in line))}) >= 2
+
+
+def _is_totals(line):
+    text = " ".join(token.text for token in line)
+    return bool(TOTALS_PATTERN.search(text) or TOTALS_GLUED_PATTERN.match(text))
+
+
+def _numeric_tail(line):
+    """
+    Nombres en fin de ligne, dans l'ordre de la ligne, et jetons de la ligne sans les
+    devises isolées de cette fin ("10 100,00 € 1000,00 €"): les nombres restent les
+    derniers jetons
+    """
+    numbers = []
+    tail = []
+    start = len(line)
+    while start > 0:
+        token = line[start - 1]
+        if not CURRENCY_TOKEN.match(token.text):
+            number = _number(token.text)
+            if number is None:
+                break
+            numbers.append(number)
+            tail.append(token)
+        start -= 1
+    numbers.reverse()
+    tail.reverse()
+    return line[:start] + tail, numbers
+
+
+def find_rows(tokens):
+    """(en-tête ou None, lignes d'articles candidates [Row])"""
+    lines = _group_lines(tokens)
+    header = None
+    start = 0
+    for position, line in enumerate(lines):
+        if _is_header(line):
+            header, start = line, position + 1
+            break
+
+    rows = []
+    for line in lines[start:]:
+        if _is_totals(line):
+            if header is not None and rows:
+                break
+            continue
+        tokens, numbers = _numeric_tail(line)
+        if len(numbers) >= 2:
+            rows.append(Row(tokens, numbers))
+    return header, rows
+
+
+def detect_columns(rows, min_gap):
+    """
+    Limites des colonnes numériques (tableau trié des positions qui les séparent), ou
+    None si les nombres ne sont pas alignés en colonnes
+    """
+    spans = np.array([(token.left, token.right) for row in rows for token in row.tokens[-len(row.numbers):]],
+                     dtype=np.int64)
+    if len(spans) == 0:
+        return None
+    origin = spans[:, 0].min()
+    width = int(spans[:, 1].max() - origin) + 1
+    coverage = np.zeros(width + 1, dtype=np.int32)
+    np.add.at(coverage, spans[:, 0] - origin, 1)
+    np.add.at(coverage, spans[:, 1] - origin, -1)
+    occupied = np.cumsum(coverage[:-1]) > 0
+
+    # Zones vides: début et fin de chaque suite de positions non couvertes
+    edges = np.flatnonzero(np.diff(occupied.astype(np.int8)))
+    gap_starts = edges[occupied[edges]] + 1
+    gap_ends = edges[~occupied[edges]] + 1
+    gaps = [(start, end) for start, end in zip(gap_starts, gap_ends) if end - start >= min_gap]
+    if not 1 <= len(gaps) <= 4:
+        return None
+    return np.array([origin + (start + end) // 2 for start, end in gaps], dtype=np.int64)
+
+
+def _column_roles(boundaries, header):
+    """Rôle de chaque colonne: mots de l'en-tête au-dessus, sinon ordre de droite à gauche"""
+    count = len(boundaries) + 1
+    roles = {}
+    if header is not None:
+        for token in header:
+            for role, pattern in HEADER_ROLES:
+                if pattern.search(token.text) and role not in roles.values():
+                    column = int(np.searchsorted(boundaries, (token.left + token.right) // 2))
+                    roles.setdefault(column, role)
+                    break
+    if set(roles.values()) >= {"unit_price", "total"}:
+        return roles
+    return {count - 1 - position: role for position, role in enumerate(POSITIONAL_ROLES[:count])}
+
+
+def _amounts(values, currency):
+    return [parse_amount(value, currency) if value else None for value in values]
+
+
+def _item(description, quantity_value, unit_value, total_value, line):
+    coherent = None
+    if quantity_value is not None and unit_value is not None and total_value is not None:
+        coherent = abs(quantity_value * unit_value - total_value) <= TOLERANCE
+    return {
+        "designation": description,
+        "quantite": format_amount(quantity_value) if quantity_value is not None else None,
+        "prixUnitaireHT": format_amount(unit_value) if unit_value is not None else None,
+        "montantHT": format_amount(total_value) if total_value is not None else None,
+        "coherent": coherent,
+        "line": line,
+    }
+
+
+def _rows_by_columns(rows, boundaries, roles, currency):
+    # Colonne de chaque jeton numérique, pour toutes les lignes en un appel
+    tails = [token for row in rows for token in row.tokens[-len(row.numbers):]]
+    columns = np.searchsorted(boundaries, [(token.left + token.right) // 2 for token in tails]).tolist()
+    items = []
+    position = 0
+    for row in rows:
+        cells = {}
+        for number in row.numbers:
+            cells.setdefault(columns[position], []).append(number)
+            position += 1
+        values = {role: "".join(cells[column]) for column, role in roles.items() if column in cells}
+        description = " ".join(token.text for token in row.tokens[:-len(row.numbers)])
+        amounts = _amounts((values.get("quantity"), values.get("unit_price"), values.get("total")), currency)
+        items.append(_item(description, *amounts, row.tokens[0].line))
+    return items
+
+
+def _split_row(numbers, currency):
+    """
+    Quantité, prix unitaire et total des nombres de fin de ligne (de droite à gauche),
+    en essayant les regroupements à espaces de milliers; le découpage cohérent l'emporte,
+    et entre deux découpages cohérents celui qui explique le plus de nombres
+    ("1 1 103,361 1 103,361": 1 × 1 103,361 plutôt que 103,361 × 1)
+    """
+    def amounts(end):
+        # Montant se terminant à `end`: le jeton seul, ou précédé de groupes de 1 à 3 chiffres
+        for size in range(1, MAX_GROUPS + 1):
+            start = end - size
+            if start < 0:
+                return
+            if size > 1 and (not numbers[start].isdigit() or len(numbers[start]) > 3
+                             or any(len(re.split(r"[.,]", part)[0]) != 3 for part in numbers[start + 1:end])):
+                return
+            yield start, "".join(numbers[start:end])
+
+    fallback = best = None
+    for total_start, total in amounts(len(numbers)):
+        for price_start, price in amounts(total_start):
+            quantity = numbers[price_start - 1] if price_start > 0 else None
+            values = _amounts((quantity, price, total), currency)
+            if fallback is None:
+                fallback = (*values, price_start - 1 if quantity else price_start)
+            quantity_value, price_value, total_value = values
+            if None not in values and abs(quantity_value * price_value - total_value) <= TOLERANCE \
+                    and (best is None or price_start - 1 < best[3]):
+                best = (*values, price_start - 1)
+    return best or fallback
+
+
+def _rows_by_tokens(rows, currency):
+    items = []
+    for row in rows:
+        split = _split_row(row.numbers, currency)
+        if split is None:
+            continue
+        quantity, price, total, used = split
+        # Les nombres non utilisés (référence, remise) restent dans la désignation
+        description = " ".join(token.text for token in row.tokens[:len(row.tokens) - len(row.numbers) + used])
+        items.append(_item(description, quantity, price, total, row.tokens[0].line))
+    return items
+
+
+def extract_line_items(tokens, montant_ht=None, currency=None, min_gap=2):
+    """
+    Lignes d'articles des jetons d'un document:
+    {"items": [...], "total": somme des totaux, "matches_ht": somme = montant HT, "method"}.
+    `min_gap`: largeur minimale d'un espace entre colonnes (caractères ou pixels).
+    """
+    header, rows = find_rows(tokens)
+    if not rows:
+        return None
+
+    boundaries = detect_columns(rows, min_gap) if len(rows) >= 2 else None
+    items = None
+    method = "columns"
+    if boundaries is not None:
+        items = _rows_by_columns(rows, boundaries, _column_roles(boundaries, header), currency)
+        # Colonnes rejetées si elles expliquent moins de lignes que la lecture ligne à ligne
+        if sum(item["coherent"] is True for item in items) < len(items) / 2:
+            token_items = _rows_by_tokens(rows, currency)
+            if sum(item["coherent"] is True for item in token_items) > sum(item["coherent"] is True for item in items):
+                items, method = token_items, "tokens"
+    else:
+        items, method = _rows_by_tokens(rows, currency), "tokens"
+    if not items:
+        return None
+
+    totals = [Decimal(item["montantHT"]) for item in items if item["montantHT"] is not None]
+    total = sum(totals, Decimal(0))
+    ht = parse_amount(montant_ht, currency) if montant_ht else None
+    return {
+        "items": items,
+        "total": format_amount(total),
+        "matches_ht": (abs(total - ht) <= TOLERANCE * max(1, len(totals))) if ht is not None else None,
+        "method": method,
+    }
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Registre des versions du modèle de factures.
+
+- Manifeste `models/manifest.json`: une entrée par version avec ses métriques et son
+  statut (active, candidate, retired). Les champs reprennent ceux du schéma `Model`
+  du backend (version, type, performance, trainedOn, filePath, isActive, metadata).
+  Le manifeste est réécrit de façon atomique (fichier temporaire puis os.replace), et
+  c'est lui qui désigne la version active: les scripts n'ont plus à lister et trier
+  les dossiers `invoice_model_v*`.
+- Cache LRU borné des objets `Language` chargés: changer de version ou revenir en
+  arrière ne relit pas le modèle sur le disque.
+- Politique de rétention: seules la version active et les MODEL_KEEP_VERSIONS
+  versions les plus récentes sont conservées sur le disque.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py activate 4
+    python model_registry.py rollback
+    python model_registry.py prune
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+# Répertoire des modèles, surchargeable par l'environnement (tests, déploiements)
+MODELS_DIR = os.environ.get("MODELS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+MANIFEST_FILE = "manifest.json"
+STAGING_DIR = ".staging"
+MODEL_PREFIX = "invoice_model_v"
+
+# Nombre de versions gardées sur le disque en plus de la version active
+KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", "5"))
+# Nombre de modèles spaCy gardés chargés en mémoire
+LANGUAGE_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", "3"))
+# Au-delà de cet âge (secondes), un verrou ou un dossier de staging est abandonné
+STALE_SECONDS = 3600
+
+STATUS_ACTIVE = "active"
+STATUS_CANDIDATE = "candidate"
+STATUS_RETIRED = "retired"
+
+
+def write_json_atomic(path, data):
+    """Écrit un fichier JSON via un fichier temporaire et os.replace"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def version_of(name):
+    suffix = name[len(MODEL_PREFIX):]
+    return int(suffix) if name.startswith(MODEL_PREFIX) and suffix.isdigit() else None
+
+
+class file_lock:
+    """Verrou inter-processus par création exclusive d'un fichier (portable)"""
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > STALE_SECONDS:
+                        os.unlink(self.path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Verrou occupé: {self.path}")
+                time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        os.unlink(self.path)
+
+
+class ModelRegistry:
+    """Manifeste des versions, cache des modèles chargés et rétention"""
+
+    def __init__(self, models_dir=None, keep_versions=KEEP_VERSIONS):
+        self.models_dir = models_dir or MODELS_DIR
+        self.manifest_path = os.path.join(self.models_dir, MANIFEST_FILE)
+        self.keep_versions = keep_versions
+        self._manifest = None
+        self._manifest_signature = None
+
+    # --- Manifeste ------------------------------------------------------------
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.manifest_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def manifest(self):
+        """Manifeste courant (relu seulement si le fichier a changé)"""
+        signature = self._signature()
+        if self._manifest is not None and signature == self._manifest_signature:
+            return self._manifest
+
+        if signature is None:
+            manifest = self._bootstrap_manifest()
+        else:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+
+        self._manifest, self._manifest_signature = manifest, signature
+        return manifest
+
+    def _bootstrap_manifest(self):
+        """Manifeste reconstruit à partir des dossiers complets (avec métadonnées) existants"""
+        versions = []
+        if os.path.isdir(self.models_dir):
+            for name in os.listdir(self.models_dir):
+                path = os.path.join(self.models_dir, name)
+                metadata_path = f"{path}_metadata.json"
+                if version_of(name) is None or not os.path.isdir(path) or not os.path.exists(metadata_path):
+                    continue
+                try:
+                    with open(metadata_path, "r", encoding="utf-8") as f:
+                        metadata = json.load(f)
+                except (OSError, ValueError):
+                    metadata = {}
+                versions.append(self._entry(
+                    version_of(name), name, created_at=metadata.get("last_trained"),
+                    metadata={key: value for key, value in metadata.items() if key != "patterns"}
+                ))
+
+        versions.sort(key=lambda entry: entry["version"])
+        if versions:
+            versions[-1]["status"] = STATUS_ACTIVE
+            versions[-1]["isActive"] = True
+        return {"active": versions[-1]["version"] if versions else None, "versions": versions}
+
+    def _entry(self, version, name, metrics=None, sample_count=None, entity_types=None,
+               metadata=None, created_at=None, status=STATUS_CANDIDATE):
+        metrics = metrics or {}
+        return {
+            "version": version,
+            "type": "NLP",
+            "status": status,
+            "isActive": status == STATUS_ACTIVE,
+            "filePath": name,
+            "createdAt": created_at or datetime.now().isoformat(),
+            "performance": {
+                "precision": metrics.get("precision"),
+                "recall": metrics.get("recall"),
+                "f1Score": metrics.get("f1Score", metrics.get("f1_score")),
+            },
+            "trainedOn": {
+                "sampleCount": sample_count,
+                "entityTypes": sorted(entity_types or []),
+            },
+            "metadata": metadata or {},
+        }
+
+    def _update(self, change):
+        """Applique `change(manifest)` sous verrou puis réécrit le manifeste atomiquement"""
+        os.makedirs(self.models_dir, exist_ok=True)
+        with file_lock(os.path.join(self.models_dir, "manifest.lock")):
+            self._manifest = None
+            manifest = self.manifest()
+            result = change(manifest)
+            write_json_atomic(self.manifest_path, manifest)
+            self._manifest, self._manifest_signature = manifest, self._signature()
+            return result
+
+    def versions(self):
+        return list(self.manifest()["versions"])
+
+    def entry(self, version):
+        for entry in self.manifest()["versions"]:
+            if entry["version"] == version:
+                return entry
+        return None
+
+    def active_version(self):
+        return self.manifest().get("active")
+
+    def path_of(self, version):
+        entry = self.entry(version)
+        return os.path.join(self.models_dir, entry["filePath"]) if entry else None
+
+    def active_path(self):
+        """Chemin du modèle actif, ou None si aucun modèle n'a été publié"""
+        version = self.active_version()
+        path = self.path_of(version) if version is not None else None
+        return path if path and os.path.isdir(path) else None
+
+    # --- Publication et activation -----------------------------------------------
+
+    def next_version(self):
+        on_disk = [version_of(name) for name in os.listdir(self.models_dir)] if os.path.isdir(self.models_dir) else []
+        known = [entry["version"] for entry in self.manifest()["versions"]]
+        return max([v for v in on_disk + known if v is not None] or [1]) + 1
+
+    def publish(self, nlp, metadata, metrics=None, sample_count=None, entity_types=None, activate=True):
+        """
+        Écrit le modèle dans .staging/, le renomme en invoice_model_vN, écrit ses
+        métadonnées puis l'enregistre dans le manifeste (active ou candidate).
+        Retourne (version, chemin).
+        """
+        staging_root = os.path.join(self.models_dir, STAGING_DIR)
+        os.makedirs(staging_root, exist_ok=True)
+        staging_path = os.path.join(staging_root, uuid.uuid4().hex)
+        nlp.to_disk(staging_path)
+
+        # Une autre publication peut prendre le même numéro: réessayer avec le suivant
+        while True:
+            version = self.next_version()
+            name = f"{MODEL_PREFIX}{version}"
+            try:
+                os.rename(staging_path, os.path.join(self.models_dir, name))
+                break
+            except OSError:
+                if not os.path.exists(os.path.join(self.models_dir, name)):
+                    raise
+
+        model_path = os.path.join(self.models_dir, name)
+        write_json_atomic(f"{model_path}_metadata.json", {**metadata, "model_version": version})
+
+        def register(manifest):
+            # Un manifeste reconstruit depuis le disque peut déjà contenir cette version
+            manifest["versions"] = [entry for entry in manifest["versions"] if entry["version"] != version]
+            manifest["versions"].append(self._entry(
+                version, name, metrics, sample_count, entity_types,
+                metadata={key: value for key, value in metadata.items() if key != "patterns"}
+            ))
+            if activate:
+                self._set_active(manifest, version)
+
+        self._update(register)
+        self.prune()
+        return version, model_path
+
+    @staticmethod
+    def _set_active(manifest, version):
+        for entry in manifest["versions"]:
+            if entry["version"] == version:
+                entry["status"], entry["isActive"] = STATUS_ACTIVE, True
+            elif entry["status"] == STATUS_ACTIVE:
+                entry["status"], entry["isActive"] = STATUS_RETIRED, False
+        manifest["active"] = version
+
+    def activate(self, version):
+        """Active une version existante (candidate ou ancienne)"""
+        if self.path_of(version) is None or not os.path.isdir(self.path_of(version)):
+            raise ValueError(f"Version inconnue ou supprimée: {version}")
+        self._update(lambda manifest: self._set_active(manifest, version))
+        return version
+
+    def rollback(self):
+        """Réactive la version la plus récente antérieure à la version active"""
+        active = self.active_version()
+        previous = [entry["version"] for entry in self.manifest()["versions"]
+                    if active is not None and entry["version"] < active
+                    and os.path.isdir(os.path.join(self.models_dir, entry["filePath"]))]
+        if not previous:
+            raise ValueError("Aucune version antérieure disponible")
+        return self.activate(max(previous))
+
+    # --- Rétention --------------------------------------------------------------
+
+    def prune(self):
+        """
+        Supprime les dossiers des versions au-delà de la rétention (la version active et
+        les `keep_versions` plus récentes sont gardées) et les dossiers de staging abandonnés.
+        Retourne la liste des versions supprimées.
+        """
+        removed = []
+
+        def apply(manifest):
+            by_recency = sorted(manifest["versions"], key=lambda entry: entry["version"], reverse=True)
+            keep = {entry["version"] for entry in by_recency[:self.keep_versions]}
+            keep.add(manifest.get("active"))
+            kept_entries = []
+            for entry in manifest["versions"]:
+                if entry["version"] in keep:
+                    kept_entries.append(entry)
+                    continue
+                path = os.path.join(self.models_dir, entry["filePath"])
+                shutil.rmtree(path, ignore_errors=True)
+                try:
+                    os.unlink(f"{path}_metadata.json")
+                except OSError:
+                    pass
+                _language_cache.discard(path)
+                removed.append(entry["version"])
+            manifest["versions"] = kept_entries
+
+        self._update(apply)
+
+        staging_root = os.path.join(self.models_dir, STAGING_DIR)
+        if os.path.isdir(staging_root):
+            for name in os.listdir(staging_root):
+                path = os.path.join(staging_root, name)
+                if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+        return removed
+
+
+class LanguageCache:
+    """Cache LRU borné des pipelines spaCy chargés, indexé par chemin de modèle"""
+
+    def __init__(self, max_size=LANGUAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, loader):
+        key = os.path.abspath(path)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+
+        nlp = loader(path)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = nlp
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return nlp
+
+    def discard(self, path):
+        with self._lock:
+            self._items.pop(os.path.abspath(path), None)
+
+    def stats(self):
+        return {"size": len(self._items), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+_language_cache = LanguageCache()
+
+
+def load_language(path, shared=True):
+    """
+    Charge un pipeline spaCy. Avec shared=True, l'objet vient du cache LRU et peut être
+    partagé: il ne doit pas être modifié (l'entraînement travaille sur une copie privée).
+    """
+    import spacy
+
+    if not shared:
+        return spacy.load(path)
+    return _language_cache.get(path, spacy.load)
+
+
+def language_cache_stats():
+    return _language_cache.stats()
+
+
+class ActiveModelWatcher:
+    """Détecte (par un simple stat du manifeste) un changement de version active"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or ModelRegistry()
+        self._last_path = self.registry.active_path()
+
+    def poll(self):
+        """Retourne le chemin du modèle actif s'il a changé depuis le dernier appel, sinon None"""
+        path = self.registry.active_path()
+        if path == self._last_path:
+            return None
+        self._last_path = path
+        return path
+
+
+def active_model_path(models_dir=None):
+    """Chemin du modèle actif d'après le manifeste, ou None"""
+    return ModelRegistry(models_dir).active_path()
+
+
+def main():
+    registry = ModelRegistry()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+
+    if command == "list":
+        result = registry.manifest()
+    elif command == "activate" and len(sys.argv) > 2:
+        result = {"active": registry.activate(int(sys.argv[2]))}
+    elif command == "rollback":
+        result = {"active": registry.rollback()}
+    elif command == "prune":
+        result = {"removed": registry.prune()}
+    else:
+        result = {"error": f"Commande inconnue: {' '.join(sys.argv[1:])}"}
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
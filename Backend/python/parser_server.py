@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Serveur résident pour les parsers de factures.
+
+Les parsers (simple et adaptatif) sont chargés une seule fois au démarrage,
+puis le serveur traite des requêtes JSON encadrées (une requête par ligne,
+JSON Lines) reçues sur stdin ou sur un socket Unix. Chaque réponse reprend
+l'identifiant de la requête, ce qui permet d'avoir plusieurs appels en cours
+en même temps côté Node.js.
+
+Format d'une requête:
+    {"id": "42", "op": "extract", "parser": "simple", "text": "..."}
+    {"id": "42", "op": "extract", "parser": "simple", "tsv": "<TSV de Tesseract>"}
+    {"id": "43", "op": "feedback", "text": "...", "original": {...}, "corrected": {...}}
+    {"id": "44", "op": "extract_batch", "texts": ["...", "..."]}
+    {"id": "45", "op": "stats"}
+    {"id": "46", "op": "extract", "parser": "cascade", "text": "..."}
+
+Le parser "cascade" est le parser adaptatif en cascade: règles d'abord, NER seulement
+pour les champs requis absents ou peu sûrs.
+
+Un champ "company" (identifiant de l'entreprise) applique sa surcouche (patterns,
+seuils, noms connus: voir company_overlay) à "extract" et "extract_batch", et range
+les noms confirmés par un "feedback" dans cette surcouche.
+
+Les extractions de texte passent par le cache des résultats (voir result_cache).
+
+Ajouter "profile": true à une requête écrit ses profils cProfile et tracemalloc
+dans le dossier --profile-dir.
+
+Format d'une réponse:
+    {"id": "42", "ok": true, "result": {...}}
+    {"id": "43", "ok": false, "error": "..."}
+
+Les feedbacks sont mis en file: quand le seuil d'entraînement est atteint, le serveur
+lance un processus d'entraînement détaché (training_queue.py --once), sans charger le
+CPU ni la mémoire du processus qui sert les requêtes. --train-worker entraîne plutôt
+dans un thread du serveur.
+
+Usage:
+    python parser_server.py                      # stdin/stdout
+    python parser_server.py --socket /tmp/p.sock # socket Unix
+"""
+
+import sys
+import json
+import os
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import simple_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from instrumentation import StageTimer, profile_request, get_logger
+from layout_index import read_tsv, read_hocr
+from training_queue import TRAINING_THRESHOLD, FeedbackQueue, TrainingWorker, spawn_background_training
+from model_registry import ActiveModelWatcher, active_model_path, language_cache_stats
+from result_cache import cached_extract, result_cache_stats
+from document_classifier import ensure_classifier
+from company_overlay import cache_kind, get_overlay, overlay_cache_stats
+
+logger = get_logger("server")
+
+
+class ParserServer:
+    """Garde les parsers en mémoire et répartit les requêtes par opération"""
+
+    def __init__(self, model_path=None, profile_dir=None, train_worker=False):
+        self.started_at = datetime.now().isoformat()
+        self.profile_dir = profile_dir
+        self.model_path = model_path or active_model_path()
+        # Les feedbacks sont mis en file; l'entraînement se fait hors du chemin des requêtes
+        self.training_queue = FeedbackQueue()
+        load_timer = StageTimer()
+        with load_timer.stage("model_load"):
+            self.adaptive = AdaptiveInvoiceParser(self.model_path, self.training_queue)
+            # Serveur résident: charger le pipeline au démarrage plutôt qu'à la première requête
+            self.adaptive.warm_up()
+        with load_timer.stage("classifier_load"):
+            # Appris ici s'il n'existe pas encore, jamais pendant une requête
+            ensure_classifier()
+        self.startup_timings = load_timer.as_dict()
+        # Un modèle fixé par --model n'est pas remplacé par les nouvelles publications
+        self.watcher = None if model_path else ActiveModelWatcher()
+        self.reload_lock = threading.Lock()
+        self.reload_count = 0
+
+        # Entraînement dans un thread du serveur sur demande seulement (--train-worker);
+        # sinon dans un processus séparé
+        self.training_worker = None
+        if train_worker:
+            self.training_worker = TrainingWorker(logger=logger)
+            self.training_worker.start()
+        # Le parser adaptatif garde un état (données d'entraînement en attente):
+        # ses appels sont sérialisés
+        self.adaptive_lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self._count_lock = threading.Lock()
+
+        self.handlers = {
+            "extract": self.handle_extract,
+            "extract_batch": self.handle_extract_batch,
+            "feedback": self.handle_feedback,
+            "stats": self.handle_stats,
+            "ping": lambda request: {"pong": True},
+        }
+
+    def handle(self, request):
+        """Traite une requête décodée et retourne la réponse à renvoyer"""
+        request_id = request.get("id") if isinstance(request, dict) else None
+        with self._count_lock:
+            self.request_count += 1
+
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("La requête doit être un objet JSON")
+
+            # Prendre en compte une nouvelle version publiée, entre deux requêtes
+            self.refresh_model()
+
+            op = request.get("op")
+            handler = self.handlers.get(op)
+            if handler is None:
+                raise ValueError(f"Opération inconnue: {op}")
+
+            # Profil cProfile/tracemalloc d'une requête isolée, sur demande
+            if request.get("profile") and self.profile_dir:
+                with profile_request(self.profile_dir, label=op):
+                    return {"id": request_id, "ok": True, "result": handler(request)}
+
+            return {"id": request_id, "ok": True, "result": handler(request)}
+        except Exception as e:
+            with self._count_lock:
+                self.error_count += 1
+            return {"id": request_id, "ok": False, "error": str(e)}
+
+    def refresh_model(self):
+        """Charge le modèle nouvellement publié puis remplace le parser en place"""
+        if self.watcher is None or not self.reload_lock.acquire(blocking=False):
+            return
+
+        try:
+            new_path = self.watcher.poll()
+            if not new_path or new_path == self.model_path:
+                return
+
+            # Chargement hors du verrou du parser: les requêtes en cours continuent
+            parser = AdaptiveInvoiceParser(new_path, self.training_queue)
+            parser.warm_up()
+            with self.adaptive_lock:
+                self.adaptive = parser
+                self.model_path = new_path
+                self.reload_count += 1
+            logger.info("Nouveau modèle chargé: %s (version %s)", new_path, parser.model_version)
+        except Exception as e:
+            logger.error("Échec du chargement du nouveau modèle: %s", e)
+        finally:
+            self.reload_lock.release()
+
+    def handle_extract(self, request):
+        parser_kind = request.get("parser", "simple")
+        overlay = self.request_overlay(request)
+
+        # Mots positionnés de Tesseract (contenu TSV ou hOCR): extraction selon la mise en page
+        for layout_format, reader in (("tsv", read_tsv), ("hocr", read_hocr)):
+            if request.get(layout_format):
+                if parser_kind != "simple":
+                    raise ValueError(f"L'entrée {layout_format} n'est prise en charge que par le parser simple")
+                return simple_invoice_parser.extract_entities_from_words(reader(request[layout_format]), overlay=overlay)
+
+        text = request.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError("Texte OCR vide ou invalide")
+
+        # Résultats adressés par le contenu: un texte déjà traité par la même version
+        # des règles ou du modèle n'est pas réanalysé
+        if parser_kind == "simple":
+            return cached_extract(text, cache_kind("simple", overlay), simple_invoice_parser.rules_version(overlay),
+                                  lambda text: simple_invoice_parser.extract_entities(text, overlay=overlay))
+
+        if parser_kind in ("adaptive", "cascade"):
+            cascade = parser_kind == "cascade"
+            with self.adaptive_lock:
+                version = f"{self.adaptive.cache_version}-{overlay.version}" if overlay else self.adaptive.cache_version
+                result = cached_extract(text, cache_kind(parser_kind, overlay), version,
+                                        lambda text: self.adaptive.extract_entities(text, overlay=overlay,
+                                                                                    cascade=cascade))
+                result["model_stats"] = self.model_stats()
+            return result
+
+        raise ValueError(f"Parser inconnu: {parser_kind}")
+
+    def handle_extract_batch(self, request):
+        texts = request.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError("'texts' doit être une liste de chaînes")
+
+        overlay = self.request_overlay(request)
+        with self.adaptive_lock:
+            results = list(self.adaptive.extract_entities_batch(texts, batch_size=request.get("batch_size", 64),
+                                                                overlay=overlay, cascade=bool(request.get("cascade"))))
+        return {"results": results, "model_stats": self.model_stats()}
+
+    def handle_feedback(self, request):
+        missing = [key for key in ("text", "original", "corrected") if key not in request]
+        if missing:
+            raise ValueError(f"Format de données incorrect, clés manquantes: {missing}")
+
+        with self.adaptive_lock:
+            result = self.adaptive.record_feedback(request["text"], request["original"], request["corrected"],
+                                                   company=request.get("company"))
+
+        # Seuil atteint: réveiller le worker, ou lancer un entraînement dans un processus
+        # séparé (worker_lock: un seul entraînement à la fois)
+        threshold = self.training_worker.threshold if self.training_worker else TRAINING_THRESHOLD
+        result["training_started"] = False
+        if result.get("queued") and result.get("pending_samples", 0) >= threshold:
+            if self.training_worker:
+                self.training_worker.wake.set()
+            else:
+                spawn_background_training()
+                result["training_started"] = True
+        return result
+
+    def request_overlay(self, request):
+        """Surcouche de l'entreprise de la requête (champ "company"), ou None"""
+        company = request.get("company")
+        return get_overlay(company) if company else None
+
+    def handle_stats(self, request):
+        stats = self.model_stats()
+        stats.update({
+            "server_started_at": self.started_at,
+            "startup_timings": self.startup_timings,
+            "last_training": self.training_worker.last_result if self.training_worker else None,
+            "requests": self.request_count,
+            "errors": self.error_count,
+        })
+        return stats
+
+    def model_stats(self):
+        return {
+            "model_version": self.adaptive.model_version,
+            "last_trained": self.adaptive.last_trained,
+            "model_path": self.model_path,
+            "pending_samples": self.training_queue.pending_count(),
+            "model_reloads": self.reload_count,
+            "language_cache": language_cache_stats(),
+            "result_cache": result_cache_stats(),
+            "overlay_cache": overlay_cache_stats(),
+        }
+
+
+def decode_request(line):
+    """Décode une ligne JSON; retourne (requête, réponse d'erreur)"""
+    try:
+        return json.loads(line), None
+    except ValueError as e:
+        return None, {"id": None, "ok": False, "error": f"JSON invalide: {e}"}
+
+
+def serve_stdio(server, workers, output):
+    """Lit les requêtes sur stdin et écrit les réponses sur `output`"""
+    write_lock = threading.Lock()
+
+    def respond(response):
+        payload = json.dumps(response, ensure_ascii=False)
+        with write_lock:
+            output.write(payload + "\n")
+            output.flush()
+
+    def process(request):
+        respond(server.handle(request))
+
+    shutdown_request = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+
+            request, error = decode_request(line)
+            if error:
+                respond(error)
+                continue
+            if isinstance(request, dict) and request.get("op") == "shutdown":
+                shutdown_request = request
+                break
+
+            pool.submit(process, request)
+
+    # Les requêtes en cours sont terminées avant de confirmer l'arrêt
+    if shutdown_request is not None:
+        respond({"id": shutdown_request.get("id"), "ok": True, "result": {"shutdown": True}})
+
+
+def serve_socket(server, socket_path):
+    """Écoute sur un socket Unix; chaque connexion envoie des requêtes JSON Lines"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode("utf-8").strip()
+                if not line:
+                    continue
+
+                request, response = decode_request(line)
+                if response is None:
+                    response = server.handle(request)
+                self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+    class UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    with UnixServer(socket_path, RequestHandler) as unix_server:
+        print(f"Serveur de parsing en écoute sur {socket_path}", file=sys.stderr)
+        try:
+            unix_server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Serveur résident des parsers de factures")
+    arg_parser.add_argument("--socket", help="Chemin du socket Unix (par défaut: stdin/stdout)")
+    arg_parser.add_argument("--workers", type=int, default=2, help="Nombre de requêtes traitées en parallèle")
+    arg_parser.add_argument("--model", help="Chemin du modèle à charger (par défaut: le plus récent)")
+    arg_parser.add_argument("--train-worker", action="store_true",
+                            help="Entraîner dans un thread de ce processus (par défaut: processus séparé)")
+    arg_parser.add_argument("--profile-dir", help="Dossier des profils des requêtes marquées \"profile\": true")
+    args = arg_parser.parse_args()
+
+    # stdout est réservé au protocole: tout affichage des parsers part sur stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    server = ParserServer(args.model, args.profile_dir, train_worker=args.train_worker)
+
+    if args.socket:
+        serve_socket(server, args.socket)
+    else:
+        # Signaler au client que les modèles sont chargés
+        protocol_out.write(json.dumps({"id": None, "ok": True, "result": {"ready": True}}) + "\n")
+        protocol_out.flush()
+        serve_stdio(server, max(1, args.workers), protocol_out)
+
+
+if __name__ == "__main__":
+    main()
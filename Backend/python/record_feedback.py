@@ -4,11 +4,17 @@
 import sys
 import json
 import os
-from adaptive_invoice_parser import AdaptiveInvoiceParser
+from training_queue import (
+    FeedbackQueue, TRAINING_THRESHOLD, feedback_to_training_sample, spawn_background_training
+)
+from model_registry import active_model_path
+from company_overlay import learn_from_feedback as learn_company_names
+from vendor_gazetteer import stage_feedback_names
 
 def main():
     """
-    Script pour enregistrer les feedbacks utilisateurs et potentiellement réentraîner le modèle
+    Script pour enregistrer les feedbacks utilisateurs; le réentraînement est lancé en
+    arrière-plan quand assez d'échantillons sont en attente
     Argument:
         1: Chemin vers le fichier JSON contenant les données de feedback
     """
@@ -36,28 +42,53 @@ def main():
         }))
         sys.exit(1)
     
-    # Créer une instance du parser adaptatif avec le dernier modèle entraîné
-    models_dir = os.path.join(os.path.dirname(__file__), "models")
-    model_path = None
+    # Convertir le feedback en échantillon et le déposer dans la file d'entraînement:
+    # l'entraînement se fait en arrière-plan, hors du chemin de la requête
+    alignment = {}
+    sample = feedback_to_training_sample(feedback_data['text'], feedback_data['corrected'], alignment)
+    queue = FeedbackQueue()
+    if sample:
+        queue.put(sample)
     
-    if os.path.exists(models_dir):
-        # Chercher le modèle avec la version la plus récente
-        model_versions = [d for d in os.listdir(models_dir) if d.startswith("invoice_model_v")]
-        if model_versions:
-            model_versions.sort(key=lambda x: int(x.split("_v")[1]) if x.split("_v")[1].isdigit() else 0, reverse=True)
-            model_path = os.path.join(models_dir, model_versions[0])
+    # Les noms de fournisseur confirmés servent dès la prochaine extraction, dans la
+    # surcouche de l'entreprise que le feedback désigne ("company"). Sans entreprise, ils
+    # attendent d'être assez confirmés pour le répertoire commun (vendor_gazetteer.py promote)
+    names_added = names_staged = 0
+    if feedback_data.get('company'):
+        names_added = learn_company_names(feedback_data['company'], feedback_data['text'], feedback_data['corrected'])
+    else:
+        names_staged = stage_feedback_names(feedback_data['text'], feedback_data['corrected'])
     
-    parser = AdaptiveInvoiceParser(model_path)
+    pending = queue.pending_count()
+    training_started = False
+    if pending >= TRAINING_THRESHOLD:
+        spawn_background_training()
+        training_started = True
     
-    # Enregistrer le feedback
-    result = parser.record_feedback(
-        feedback_data['text'],
-        feedback_data['original'],
-        feedback_data['corrected']
-    )
+    model_path = active_model_path()
+    result = {
+        "recorded": sample is not None,
+        "queued": sample is not None,
+        "pending_samples": pending,
+        "training_started": training_started,
+        "model_version": read_model_version(model_path),
+        "alignment": alignment,
+        "known_names_added": names_added,
+        "known_names_staged": names_staged
+    }
     
     # Retourner le résultat au format JSON
     print(json.dumps(result, ensure_ascii=False))
 
+def read_model_version(model_path):
+    """Version du modèle actif d'après ses métadonnées (1 si aucun modèle publié)"""
+    if not model_path:
+        return 1
+    try:
+        with open(f"{model_path}_metadata.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("model_version", 1)
+    except (OSError, ValueError):
+        return 1
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Banc d'essai des patterns contre le retour arrière catastrophique.
+
+Chaque pattern enregistré (registres des deux parsers, libellés de mise en page,
+patterns du modèle actif, surcouches des entreprises et expressions compilées des
+modules) est évalué comme le fait `PatternRegistry` (`finditer` complet) sur des
+entrées adverses: longues suites d'un même motif ("1 ", ", ", espaces, lettres...),
+seules ou après un mot-clé du pattern, terminées par un caractère qu'aucun pattern
+n'accepte pour forcer l'échec et donc l'exploration de toutes les alternatives.
+Un pattern linéaire lit ces entrées en une fraction de milliseconde; un pattern
+quadratique (quantificateurs imbriqués, `.*?` répété, lookahead qui relit une suite
+d'espaces) dépasse largement la borne. La suite de tests (test_regex_fuzz) fait la même
+vérification sur des entrées plus courtes.
+
+Usage:
+    python regex_fuzz.py                      # borne par défaut, code de sortie 1 si dépassée
+    python regex_fuzz.py --size 20000 --max-ms 100 --output fuzz.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import importlib
+
+# Taille des entrées adverses (caractères) et latence maximale tolérée par entrée (ms)
+FUZZ_SIZE = 10000
+FUZZ_MAX_MS = 50.0
+
+# Motifs répétés pour construire les entrées: chiffres, séparateurs, espaces et lettres
+# que les patterns des factures enchaînent avec des quantificateurs
+FILLERS = ("1", " ", "1 ", "1,", "1.", ", ", "1/", "-", ":", " :", "\n", "\t ", "%",
+           "a", "A", "a ", "é ", "1a", "A1", "a1 ")
+
+# Caractère final qu'aucun pattern n'accepte, pour que la recherche échoue
+FAIL_SUFFIX = "§"
+
+# Taille de départ des entrées. Jusqu'à DOUBLING_SIZE, elles grandissent d'un quart (au
+# moins d'un caractère): un pattern exponentiel ("(a+)+$"), dont le coût double à chaque
+# caractère, dépasse la borne avant les tailles où il bloquerait. Au-delà, elles doublent
+# jusqu'à la taille demandée.
+START_SIZE = 8
+DOUBLING_SIZE = 256
+
+# Mots-clés gardés par pattern, pour borner le nombre d'entrées
+MAX_KEYWORDS = 8
+
+CASE_CLASS = re.compile(r"\[([A-Za-z])([A-Za-z])\]")
+CHAR_CLASS = re.compile(r"\[(?:\\.|[^\]\\])*\]|\\.")
+KEYWORD = re.compile(r"[A-Za-zÀ-ÿ°]{2,}")
+
+# Modules dont les expressions compilées au niveau du module sont vérifiées
+PATTERN_MODULES = (
+    "amount_index", "label_index", "line_items", "text_normalizer", "span_alignment",
+    "layout_index", "simple_invoice_parser", "adaptive_invoice_parser", "document_classifier",
+    "vendor_gazetteer", "text_similarity", "company_overlay",
+)
+
+
+def pattern_keywords(source):
+    """Mots littéraux d'un pattern ("[Mm]ontant\\s*HT" -> Montant, HT)"""
+    literal = CHAR_CLASS.sub(" ", CASE_CLASS.sub(lambda match: match.group(1), source))
+    keywords = []
+    for word in KEYWORD.findall(literal):
+        if word not in keywords:
+            keywords.append(word)
+    return keywords[:MAX_KEYWORDS]
+
+
+def adversarial_inputs(source):
+    """Entrées adverses (description, fonction taille -> texte) pour un pattern"""
+    def repeated(prefix, unit):
+        return lambda size: prefix + unit * max(1, (size - len(prefix)) // len(unit)) + FAIL_SUFFIX
+
+    for filler in FILLERS:
+        yield f"{filler!r}*", repeated("", filler)
+        for keyword in pattern_keywords(source):
+            yield f"{keyword!r} + {filler!r}*", repeated(keyword + " ", filler)
+            yield f"{keyword + ' ' + filler!r}*", repeated("", keyword + " " + filler)
+
+
+def worst_latency(compiled, size=FUZZ_SIZE, max_ms=FUZZ_MAX_MS):
+    """
+    Pire latence (ms) de `finditer` sur les entrées adverses du pattern, avec l'entrée
+    en cause. Chaque entrée est mesurée à des tailles croissantes jusqu'à `size` (voir
+    START_SIZE): un pattern superlinéaire est arrêté dès qu'il dépasse `max_ms`, avant
+    les tailles où il bloquerait.
+    """
+    worst = (0.0, None)
+    for description, build in adversarial_inputs(compiled.pattern):
+        length = min(size, START_SIZE)
+        while True:
+            text = build(length)
+            started = time.perf_counter()
+            for _ in compiled.finditer(text):
+                pass
+            elapsed = (time.perf_counter() - started) * 1000
+            if elapsed > worst[0]:
+                worst = (elapsed, f"{description} ({len(text)} caractères)")
+            if elapsed > max_ms:
+                return worst
+            if length >= size:
+                break
+            length = min(size, length * 2 if length >= DOUBLING_SIZE else max(length + 1, length * 5 // 4))
+    return worst
+
+
+def check_pattern(source, flags=re.IGNORECASE, size=FUZZ_SIZE, max_ms=FUZZ_MAX_MS):
+    """Lève ValueError si le pattern dépasse la borne de latence sur une entrée adverse"""
+    elapsed, description = worst_latency(re.compile(source, flags), size, max_ms)
+    if elapsed > max_ms:
+        raise ValueError(
+            f"Pattern trop lent (retour arrière): {elapsed:.0f} ms sur {description}, "
+            f"maximum {max_ms:.0f} ms"
+        )
+
+
+def _registry_patterns(origin, registry):
+    for family, compiled_patterns in registry.compiled.items():
+        for priority, compiled in enumerate(compiled_patterns):
+            yield f"{origin}:{family}[{priority}]", compiled
+
+
+def registered_patterns(models_dir=None):
+    """(origine, pattern compilé) de chaque pattern enregistré, sans doublon"""
+    from pattern_registry import get_registry
+    from simple_invoice_parser import TYPE_REGISTRIES
+    from adaptive_invoice_parser import AdaptiveInvoiceParser, DEFAULT_PATTERNS
+    from layout_index import LABEL_REGISTRY
+    from model_registry import active_model_path
+    from company_overlay import COMPANIES_DIR, CompanyOverlay, company_dir
+
+    sources = [(f"simple/{document_type or 'generic'}", registry) for document_type, registry in TYPE_REGISTRIES.items()]
+    sources.append(("adaptive", get_registry(DEFAULT_PATTERNS)))
+    sources.append(("layout", LABEL_REGISTRY))
+    # Patterns enregistrés avec le modèle actif (_metadata.json)
+    model_path = active_model_path(models_dir)
+    if model_path:
+        sources.append(("model", AdaptiveInvoiceParser(model_path).registry))
+    # Surcouches des entreprises
+    companies = os.path.dirname(company_dir("_", models_dir))
+    if os.path.isdir(companies):
+        for company_id in sorted(os.listdir(companies)):
+            try:
+                overlay = CompanyOverlay.load(company_id, models_dir)
+            except ValueError:
+                continue
+            if overlay.registry is not None:
+                sources.append((f"{COMPANIES_DIR}/{company_id}", overlay.registry))
+
+    seen = set()
+
+    def unseen(compiled):
+        key = (compiled.pattern, compiled.flags)
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    for origin, registry in sources:
+        for name, compiled in _registry_patterns(origin, registry):
+            if unseen(compiled):
+                yield name, compiled
+    for module_name in PATTERN_MODULES:
+        module = importlib.import_module(module_name)
+        for attribute, value in vars(module).items():
+            if isinstance(value, re.Pattern) and unseen(value):
+                yield f"{module_name}.{attribute}", value
+
+
+def run_fuzz(size=FUZZ_SIZE, max_ms=FUZZ_MAX_MS, models_dir=None):
+    """Rapport de latence de tous les patterns enregistrés"""
+    results = []
+    for name, compiled in registered_patterns(models_dir):
+        elapsed, description = worst_latency(compiled, size, max_ms)
+        results.append({
+            "pattern": name,
+            "source": compiled.pattern,
+            "worst_ms": round(elapsed, 3),
+            "input": description,
+        })
+    results.sort(key=lambda result: result["worst_ms"], reverse=True)
+    return {
+        "size": size,
+        "max_ms": max_ms,
+        "patterns": len(results),
+        "failures": [result for result in results if result["worst_ms"] > max_ms],
+        "slowest": results[:10],
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Latence des patterns sur des entrées adverses")
+    arg_parser.add_argument("--size", type=int, default=FUZZ_SIZE, help="Taille des entrées (caractères)")
+    arg_parser.add_argument("--max-ms", type=float, default=FUZZ_MAX_MS, help="Latence maximale par entrée")
+    arg_parser.add_argument("--models-dir", help="Répertoire des modèles (surcouches, modèle actif)")
+    arg_parser.add_argument("--output", default="-", help="Fichier JSON du rapport, ou '-' pour stdout")
+    args = arg_parser.parse_args()
+
+    report = run_fuzz(args.size, args.max_ms, args.models_dir)
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(payload)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    if report["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
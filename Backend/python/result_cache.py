@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cache des résultats d'extraction, adressé par le contenu du document.
+
+Un même scan OCR est souvent soumis plusieurs fois (nouvel essai côté client, document
+réimporté): la clé combine l'empreinte SHA-256 du texte normalisé, le type de parser et
+la version qui a produit le résultat (version du modèle actif et empreinte des règles pour
+le parser adaptatif, empreinte des patterns pour le parser simple). Deux niveaux:
+
+- un LRU en mémoire, borné en nombre d'entrées, pour le serveur résident;
+- une base SQLite (models/result_cache.sqlite3) partagée entre processus, bornée en
+  taille: au-delà de RESULT_CACHE_MAX_MB, les entrées les moins récemment lues sont
+  supprimées.
+
+Les positions des entités ("start", "end") se rapportent au texte exact qui a produit
+le résultat: chaque entrée garde l'empreinte de ce texte brut, et un succès obtenu avec
+un texte brut différent (même texte normalisé: fins de ligne, espaces de fin) retourne
+le résultat sans ces positions.
+
+Une seule version est gardée par type de parser: dès qu'un processus voit une nouvelle
+version (modèle publié, activé ou restauré), les résultats des autres versions sont
+supprimés des deux niveaux. Les compteurs de succès et d'échecs sont retournés par
+`stats()`.
+
+Variables d'environnement: RESULT_CACHE (false pour désactiver), RESULT_CACHE_SIZE,
+RESULT_CACHE_MAX_MB, RESULT_CACHE_PATH.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from model_registry import MODELS_DIR
+
+CACHE_FILE = "result_cache.sqlite3"
+CACHE_ENABLED = os.environ.get("RESULT_CACHE", "true").lower() not in ("0", "false", "no")
+# Nombre de résultats gardés en mémoire
+MEMORY_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+# Taille maximale des résultats stockés dans SQLite
+MAX_BYTES = int(float(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+# Après une éviction, la base redescend à cette fraction de MAX_BYTES
+EVICTION_TARGET = 0.9
+
+# Clés propres à une exécution, jamais mises en cache
+VOLATILE_KEYS = ("timings", "processing_time", "model_stats", "cache")
+# Empreinte du texte brut ajoutée à chaque entrée, retirée à la lecture
+SOURCE_KEY = "_source"
+# Positions dans le texte brut, retirées d'un résultat lu pour un autre texte brut
+OFFSET_KEYS = ("start", "end")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    parser TEXT NOT NULL,
+    version TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+CREATE TABLE IF NOT EXISTS versions (
+    parser TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+
+def normalize_text(text):
+    """
+    Forme canonique du texte OCR pour la clé: Unicode NFC, fins de ligne Unix, sans
+    espaces en fin de ligne ni lignes vides au début et à la fin
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip("\n")
+
+
+def cache_key(text, parser_kind, version):
+    """Clé d'un résultat: empreinte du texte normalisé, du parser et de sa version"""
+    digest = hashlib.sha256()
+    for part in (parser_kind, str(version), normalize_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def source_digest(text):
+    """Empreinte du texte brut (les positions du résultat se rapportent à ce texte)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _drop_offsets(value):
+    """Retire récursivement les positions (OFFSET_KEYS) d'un résultat"""
+    if isinstance(value, dict):
+        for key in OFFSET_KEYS:
+            value.pop(key, None)
+        for item in value.values():
+            _drop_offsets(item)
+    elif isinstance(value, list):
+        for item in value:
+            _drop_offsets(item)
+    return value
+
+
+def _load(payload, text):
+    """Résultat d'une entrée, sans ses positions s'il a été produit par un autre texte brut"""
+    result = json.loads(payload)
+    if result.pop(SOURCE_KEY, None) != source_digest(text):
+        _drop_offsets(result)
+    return result
+
+
+class ResultCache:
+    """Cache à deux niveaux (LRU mémoire puis SQLite) des résultats d'extraction"""
+
+    def __init__(self, path=None, memory_size=MEMORY_SIZE, max_bytes=MAX_BYTES):
+        self.path = path or os.environ.get("RESULT_CACHE_PATH") or os.path.join(MODELS_DIR, CACHE_FILE)
+        self.memory_size = memory_size
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _connect(self):
+        """Ouvre la base à la première utilisation; None si elle est inutilisable"""
+        if self._db is None and self.max_bytes > 0:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(_SCHEMA)
+                self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                self._db = db
+            except sqlite3.Error:
+                # Sans base (disque en lecture seule, verrou), seul le niveau mémoire sert
+                self.max_bytes = 0
+        return self._db
+
+    def get(self, text, parser_kind, version):
+        """Résultat en cache (copie) et niveau qui l'a fourni ("memory" ou "disk"), ou (None, None)"""
+        key = cache_key(text, parser_kind, version)
+        with self._lock:
+            self._sync_version(parser_kind, version)
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return _load(entry[2], text), "memory"
+
+            payload = None
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        payload = row[0]
+                        db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+                except sqlite3.Error:
+                    payload = None
+
+            if payload is None:
+                self.misses += 1
+                return None, None
+            self.disk_hits += 1
+            self._remember(key, parser_kind, version, payload)
+            return _load(payload, text), "disk"
+
+    def put(self, text, parser_kind, version, result):
+        """
+        Met en cache un résultat réussi et complet (les clés propres à l'exécution sont
+        retirées), avec l'empreinte du texte brut. Un résultat dont des règles ont été sautées faute de budget n'est pas gardé.
+        """
+        if not isinstance(result, dict) or "error" in result or "budget" in result:
+            return
+        kept = {key: value for key, value in result.items() if key not in VOLATILE_KEYS}
+        kept[SOURCE_KEY] = source_digest(text)
+        payload = json.dumps(kept, ensure_ascii=False)
+        key = cache_key(text, parser_kind, version)
+        with self._lock:
+            self._sync_version(parser_kind, version)
+            self._remember(key, parser_kind, version, payload)
+
+            db = self._connect()
+            if db is None:
+                return
+            size = len(payload.encode("utf-8"))
+            try:
+                previous = db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, parser_kind, str(version), payload, size, time.time()))
+                self._bytes += size - (previous[0] if previous else 0)
+                if self._bytes > self.max_bytes:
+                    self._evict(db)
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, key, parser_kind, version, payload):
+        self._memory[key] = (parser_kind, str(version), payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict(self, db):
+        """Supprime les entrées les moins récemment lues jusqu'à EVICTION_TARGET × max_bytes"""
+        # D'autres processus écrivent dans la même base: repartir de la taille réelle
+        self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        excess = self._bytes - int(self.max_bytes * EVICTION_TARGET)
+        if excess <= 0:
+            return
+        keys = []
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY accessed"):
+            keys.append((key,))
+            excess -= size
+            self._bytes -= size
+            if excess <= 0:
+                break
+        db.executemany("DELETE FROM results WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+    def _sync_version(self, parser_kind, version):
+        """
+        Supprime les résultats des autres versions de ce parser dès qu'une nouvelle version
+        apparaît (dans ce processus ou dans un autre, via la table `versions`)
+        """
+        version = str(version)
+        if self._versions.get(parser_kind) == version:
+            return
+        self._versions[parser_kind] = version
+
+        stale = [key for key, entry in self._memory.items() if entry[0] == parser_kind and entry[1] != version]
+        for key in stale:
+            del self._memory[key]
+
+        db = self._connect()
+        if db is None:
+            return
+        try:
+            row = db.execute("SELECT version FROM versions WHERE parser = ?", (parser_kind,)).fetchone()
+            if row is not None and row[0] == version:
+                return
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = db.execute("DELETE FROM results WHERE parser = ? AND version != ?",
+                                     (parser_kind, version)).rowcount
+                db.execute("INSERT OR REPLACE INTO versions VALUES (?, ?)", (parser_kind, version))
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                db.execute("ROLLBACK")
+                raise
+            if deleted:
+                self.invalidations += 1
+                self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        """Vide les deux niveaux"""
+        with self._lock:
+            self._memory.clear()
+            self._versions.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM results")
+                db.execute("DELETE FROM versions")
+                self._bytes = 0
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_max_size": self.memory_size,
+            "disk_bytes": self._bytes,
+            "disk_max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Cache partagé du processus, ou None si désactivé par RESULT_CACHE=false"""
+    global _result_cache
+    if not CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
+
+
+def cached_extract(text, parser_kind, version, extract):
+    """
+    Retourne le résultat en cache pour ce texte, sinon appelle `extract(text)` et met
+    le résultat en cache. Le niveau du cache est indiqué dans la clé "cache" du résultat.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return extract(text)
+
+    started = time.perf_counter()
+    result, tier = cache.get(text, parser_kind, version)
+    if result is not None:
+        result["cache"] = tier
+        result["processing_time"] = round(time.perf_counter() - started, 6)
+        return result
+
+    result = extract(text)
+    cache.put(text, parser_kind, version, result)
+    if isinstance(result, dict):
+        result["cache"] = "miss"
+    return result
+
+
+def result_cache_stats():
+    cache = get_result_cache()
+    return cache.stats() if cache is not None else None
@@ -4,7 +4,56 @@
 import sys
 import json
 import os
+import time
+from collections import deque
+
+# Début du chargement des modules (spaCy inclus), pour mesurer le coût des imports
+IMPORT_STARTED = time.perf_counter()
+
 from adaptive_invoice_parser import AdaptiveInvoiceParser
+from instrumentation import StageTimer, profile_request, dumps_result
+from model_registry import active_model_path
+from result_cache import get_result_cache, result_cache_stats
+from company_overlay import cache_kind, get_overlay, pop_company_argument
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+def read_jsonl_texts(stream, pending):
+    """
+    Lit des documents JSON Lines ({"id": ..., "text": ...}) et produit leurs textes.
+    L'identifiant (ou l'erreur) de chaque ligne est placé dans `pending`, dans le même ordre.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            text = record["text"] if isinstance(record, dict) else record
+            if not isinstance(text, str):
+                raise ValueError("le champ 'text' doit être une chaîne")
+            doc_id = record.get("id", line_number) if isinstance(record, dict) else line_number
+            pending.append((doc_id, None))
+            yield text
+        except (ValueError, KeyError) as e:
+            pending.append((line_number, f"Ligne {line_number} invalide: {e}"))
+            # Document vide pour conserver l'alignement avec les résultats
+            yield ""
+
+def run_jsonl(parser, source, batch_size=64, n_process=1, overlay=None, cascade=False):
+    """Mode batch: un résultat JSON par ligne d'entrée, écrit au fil de l'eau sur stdout"""
+    stream = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+    pending = deque()
+    try:
+        texts = read_jsonl_texts(stream, pending)
+        for result in parser.extract_entities_batch(texts, batch_size=batch_size, n_process=n_process, overlay=overlay,
+                                                    cascade=cascade):
+            doc_id, error = pending.popleft()
+            output = {"id": doc_id, "error": error} if error else {"id": doc_id, **result}
+            print(json.dumps(output, ensure_ascii=False), flush=True)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
 def main():
     """
@@ -12,14 +61,59 @@ def main():
     Arguments:
         1: Chemin vers le fichier texte à analyser
         2: (Optionnel) Chemin vers l'image source
+        --company <entreprise>: (Optionnel) applique la surcouche de l'entreprise
+        --cascade: (Optionnel) règles d'abord, NER seulement pour les champs requis absents ou peu sûrs
+    
+    Statistiques du modèle (sans serveur résident):
+        --stats
+    
+    Mode batch:
+        --jsonl <fichier|->  [--batch-size N] [--n-process N] [--company <entreprise>] [--cascade]
+        Lit des lignes {"id": ..., "text": ...} et écrit une ligne de résultat par document
     """
-    if len(sys.argv) < 2:
+    if len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        # Le pipeline spaCy n'est pas chargé: seules les métadonnées du modèle sont lues
+        model_path = active_model_path()
+        parser = AdaptiveInvoiceParser(model_path)
+        print(json.dumps({
+            "model_version": parser.model_version,
+            "last_trained": parser.last_trained,
+            "model_path": model_path,
+            "result_cache": result_cache_stats()
+        }, ensure_ascii=False))
+        return
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == "--jsonl":
+        import argparse
+        arg_parser = argparse.ArgumentParser(description="Extraction batch JSON Lines")
+        arg_parser.add_argument("--jsonl", required=True, help="Fichier JSON Lines, ou '-' pour stdin")
+        arg_parser.add_argument("--batch-size", type=int, default=64)
+        arg_parser.add_argument("--n-process", type=int, default=1)
+        arg_parser.add_argument("--company", help="Entreprise dont la surcouche s'applique")
+        arg_parser.add_argument("--cascade", action="store_true", help="NER seulement pour les champs peu sûrs")
+        args = arg_parser.parse_args()
+        
+        parser = AdaptiveInvoiceParser(active_model_path())
+        overlay = get_overlay(args.company) if args.company else None
+        run_jsonl(parser, args.jsonl, batch_size=args.batch_size, n_process=args.n_process, overlay=overlay,
+                  cascade=args.cascade)
+        return
+    
+    cascade = "--cascade" in sys.argv
+    try:
+        company, argv = pop_company_argument([arg for arg in sys.argv if arg != "--cascade"])
+        overlay = get_overlay(company) if company else None
+    except ValueError as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+    
+    if len(argv) < 2:
         print(json.dumps({"error": "Argument manquant: chemin vers le fichier texte"}))
         sys.exit(1)
     
     # Récupérer les arguments
-    text_path = sys.argv[1]
-    image_path = sys.argv[2] if len(sys.argv) > 2 else None
+    text_path = argv[1]
+    image_path = argv[2] if len(argv) > 2 else None
     
     # Vérifier que le fichier existe
     if not os.path.exists(text_path):
@@ -30,31 +124,48 @@ def main():
     with open(text_path, 'r', encoding='utf-8') as f:
         text = f.read()
     
-    # Créer une instance du parser adaptatif
-    # Chercher d'abord s'il existe un modèle déjà entraîné
-    models_dir = os.path.join(os.path.dirname(__file__), "models")
-    model_path = None
-    
-    if os.path.exists(models_dir):
-        # Chercher le modèle avec la version la plus récente
-        model_versions = [d for d in os.listdir(models_dir) if d.startswith("invoice_model_v")]
-        if model_versions:
-            model_versions.sort(key=lambda x: int(x.split("_v")[1]) if x.split("_v")[1].isdigit() else 0, reverse=True)
-            model_path = os.path.join(models_dir, model_versions[0])
-    
-    parser = AdaptiveInvoiceParser(model_path)
-    
-    # Extraire les entités
-    result = parser.extract_entities(text)
-    
-    # Ajouter les statistiques du modèle
-    result["model_stats"] = {
-        "model_version": parser.model_version,
-        "last_trained": parser.last_trained
-    }
+    timer = StageTimer()
+    timer.add("import", IMPORT_SECONDS)
     
-    # Retourner le résultat au format JSON
-    print(json.dumps(result, ensure_ascii=False))
+    with profile_request(label="adaptive_parser"):
+        # Créer une instance du parser adaptatif
+        # Chercher d'abord s'il existe un modèle déjà entraîné
+        # Le pipeline spaCy n'est chargé que si un modèle entraîné existe
+        with timer.stage("model_load"):
+            parser = AdaptiveInvoiceParser(active_model_path())
+        
+        # Un texte déjà traité par cette version du modèle est relu dans le cache:
+        # le pipeline spaCy n'est alors pas chargé du tout
+        cache = get_result_cache()
+        cache_version = f"{parser.cache_version}-{overlay.version}" if overlay else parser.cache_version
+        parser_kind = cache_kind("cascade" if cascade else "adaptive", overlay)
+        result, tier = (None, None)
+        if cache is not None:
+            with timer.stage("cache"):
+                result, tier = cache.get(text, parser_kind, cache_version)
+        
+        if result is None:
+            # En cascade, le pipeline n'est chargé que si un champ requis manque aux règles
+            if not cascade:
+                with timer.stage("model_load"):
+                    parser.warm_up()
+            
+            # Extraire les entités
+            result = parser.extract_entities(text, timer, overlay, cascade)
+            if cache is not None:
+                cache.put(text, parser_kind, cache_version, result)
+        if cache is not None:
+            result["cache"] = tier or "miss"
+        
+        # Ajouter les statistiques du modèle
+        result["model_stats"] = {
+            "model_version": parser.model_version,
+            "last_trained": parser.last_trained,
+            "result_cache": result_cache_stats()
+        }
+        
+        # Retourner le résultat au format JSON
+        print(dumps_result(result, timer))
 
 if __name__ == "__main__":
     main()
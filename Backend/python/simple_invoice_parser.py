@@ -6,263 +6,488 @@ import json
 import re
 import os
 
-def extract_entities(text):
-    """Extrait des entités d'un texte en utilisant des règles simples"""
-    entities = {}
-    
-    # Nettoyer le texte pour faciliter l'extraction
-    clean_text = re.sub(r'\s+', ' ', text)  # Remplacer les espaces multiples par un seul
-    clean_text = clean_text.replace('\n', ' ')  # Remplacer les sauts de ligne par des espaces
-    
-    print(f"Utilisation du texte OCR fourni ({len(text)} caractères)")
-    print(f"Texte OCR nettoyé (pour débogage): {text[:100]}...")
-    
-    # Texte complet pour le débogage
-    print(f"Texte OCR complet (pour l'analyse des patterns): {text}")
-    
-    # Analyser le texte caractère par caractère pour trouver des correspondances précises
-    # Cela est particulièrement utile pour les textes OCR où les espaces et sauts de ligne peuvent être mal reconnus
-    print("Recherche de dates dans le texte...")
-    date_patterns = [
-        r"[Dd]ate\s*:?\s*(\d{1,4}[-/\.]\d{1,2}[-/\.]\d{1,4})",
-        r"[Dd]ate\s*:?\s*(\d{4}-\d{2}-\d{2})",
+from pattern_registry import TimeBudget, get_registry, patterns_fingerprint
+from amount_index import AmountIndex, solve_amounts, parse_amount, format_amount
+from layout_index import LayoutDocument, read_words
+from instrumentation import get_logger, StageTimer, profile_request, dumps_result
+from result_cache import cached_extract
+from document_classifier import DOCUMENT_TYPES, classify, get_classifier
+from label_index import FIELD_LABELS, extract_values
+from vendor_gazetteer import get_gazetteer, same_name
+from text_normalizer import normalize_text, clean_amount
+from company_overlay import cache_kind, get_overlay, pop_company_argument
+from line_items import extract_line_items, normalized_tokens, word_tokens, word_gap
+
+logger = get_logger("simple")
+
+# Patterns par famille d'entité, dans leur ordre de priorité.
+# Ils sont compilés une seule fois dans un registre partagé (voir pattern_registry).
+# Écrits pour une exécution linéaire (vérifiée par regex_fuzz): pas deux quantificateurs
+# voisins sur les mêmes caractères ("\s*(?::\s*)?" plutôt que "\s*:?\s*"), et pas
+# de ".*?" sans borne.
+PATTERNS = {
+    "date": [
+        r"[Dd]ate\s*(?::\s*)?(\d{1,4}[-/\.]\d{1,2}[-/\.]\d{1,4})",
+        r"[Dd]ate\s*(?::\s*)?(\d{4}-\d{2}-\d{2})",
         r"\b(\d{2}[-/\.]\d{2}[-/\.]\d{2,4})\b",
         r"Date\s*:\s*([0-9]{1,2}-[0-9]{1,2}-[0-9]{2,4})",
-        r"[Dd]ate.*?([0-9]{1,2}[\./-][0-9]{1,2}[\./-][0-9]{2,4})",
+        r"[Dd]ate.{0,80}?([0-9]{1,2}[\./-][0-9]{1,2}[\./-][0-9]{2,4})",
         # Pattern spécial pour détecter les dates sans séparateurs
-        r"[Dd]ate\s*:?\s*(\d{4}\d{2}\d{2})",
+        r"[Dd]ate\s*(?::\s*)?(\d{4}\d{2}\d{2})",
         # Pattern pour détecter spécifiquement ce format "Date:2020-11-25"
         r"Date:(\d{4}-\d{2}-\d{2})"
-    ]
-    
-    # Rechercher avec chaque pattern
-    date_found = False
-    for pattern in date_patterns:
-        print(f"Essai du pattern: {pattern}")
-        date_matches = re.findall(pattern, text, re.IGNORECASE)
-        if date_matches:
-            for match in date_matches:
-                print(f"Match potentiel trouvé pour la date: {match}")
-                # Valider que c'est une date plausible
-                try:
-                    # Si la date est au format YYYYMMDD sans séparateurs, la reformater
-                    if re.match(r'^\d{8}$', match):
-                        year = match[0:4]
-                        month = match[4:6]
-                        day = match[6:8]
-                        formatted_date = f"{year}-{month}-{day}"
-                    else:
-                        # Standardiser le format de date
-                        parts = re.split(r'[-/\.]', match)
-                        if len(parts) == 3:
-                            # Déterminer si c'est JJ/MM/AAAA ou AAAA-MM-JJ
-                            if len(parts[0]) == 4:  # Format AAAA-MM-JJ
-                                year, month, day = parts
-                            else:  # Format JJ/MM/AAAA
-                                day, month, year = parts
-                                # Ajouter le siècle si nécessaire
-                                if len(year) == 2:
-                                    year = '20' + year if int(year) < 50 else '19' + year
-                            
-                            formatted_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-                        else:
-                            formatted_date = match
-                    
-                    entities["date"] = formatted_date
-                    print(f"Date validée et formatée: {formatted_date}")
-                    date_found = True
-                    break
-                except Exception as e:
-                    print(f"Erreur lors de la validation de la date {match}: {str(e)}")
-                    continue
-            
-            if date_found:
-                break
-    
-    if not date_found:
-        print("Aucune date valide trouvée avec les patterns réguliers")
-        # Recherche plus agressive pour la date
-        clean_text = text.replace('\n', ' ')
-        print("Recherche agressive de dates...")
-        # Chercher explicitement pour "Date:2020-11-25" ou similaire
-        raw_date_match = re.search(r'Date:(\S+)', clean_text)
-        if raw_date_match:
-            raw_date = raw_date_match.group(1)
-            print(f"Date brute trouvée: {raw_date}")
-            # Vérifier si c'est une date valide
-            date_match = re.search(r'(\d{4}-\d{2}-\d{2}|\d{2}[/.-]\d{2}[/.-]\d{2,4})', raw_date)
-            if date_match:
-                entities["date"] = date_match.group(1)
-                print(f"Date trouvée par recherche agressive: {entities['date']}")
-            else:
-                print(f"La date brute trouvée n'est pas dans un format reconnaissable: {raw_date}")
-    
-    # Rechercher tous les nombres dans le texte qui pourraient être des montants
-    # Cela permet de trouver des montants même s'ils ne sont pas explicitement marqués
-    amount_patterns = [
-        # Montants avec symbole monétaire ou indication
-        r'(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND|DIN)',
+    ],
+    # Recherche agressive (sensible à la casse) quand aucune date n'est reconnue
+    "date_brute": [
+        r"(?-i:Date:(\S+))"
+    ],
+    # Tous les nombres qui pourraient être des montants, même sans libellé
+    "montant": [
+        # Montants avec symbole monétaire ou indication (un nombre n'est essayé qu'à
+        # partir de son premier chiffre)
+        r'(?<!\d)(\d+(?:[\s\.,]+\d+)?[\.,]?)\s*(?:€|EUR|DT|TND|DIN)',
         # Nombres avec décimales (potentiels montants)
-        r'(\d+[\s\.,]\d{2,3})'
+        r'(?<!\d)(\d+[\s\.,]\d{2,3})'
+    ],
+    "montantHT": [
+        r"[Mm]ontant\s*HT\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Tt]otal\s*HT\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"HT\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Mm]ontant\s*HT\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Hh][Tt][\s\:\.]*(\d+[\s\.,]*\d*)",
+        r"[Hh]ors\s*[Tt]axe[\s\.:]*(\d+[\s\.,]*\d*)"
+    ],
+    "montantTTC": [
+        r"[Tt]otal\s*(?:en\s*)?TTC\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Mm]ontant\s*(?:en\s*)?TTC\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"TTC\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Tt]otal\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Tt]outes\s*[Tt]axes\s*[Cc]omprises[\s\:\.]*(\d+[\s\.,]*\d*)",
+        r"[Tt][Tt][Cc][\s\:\.]*(\d+[\s\.,]*\d*)"
+    ],
+    "tva": [
+        r"TVA\s*(?:\d+%\s*)?(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"[Tt]axe\s*(?::\s*)?(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
+        r"TVA\s*(\d+)%",
+        r"[Tt][Vv][Aa][\s\:\.]*(\d+[\s\.,]*\d*)"
+    ],
+    # Nom du fournisseur/destinataire: le nom commence par une lettre et les espaces
+    # n'y entrent que suivis d'une lettre, pour que le lookahead ne relise pas chaque
+    # suite d'espaces
+    "vendor": [
+        r"[Nn]om\s*(?:de\s*)?(?:destinataire|fournisseur)\s*(?::\s*)?([A-Za-zÀ-ÿ](?:\s*[A-Za-zÀ-ÿ])*?)(?=\s*(?:[A-Z]|\d|$))",
+        r"[Dd]estinataire\s*(?::\s*)?([A-Za-zÀ-ÿ](?:\s*[A-Za-zÀ-ÿ])*?)(?=\s*(?:[A-Z]|\d|$))",
+        r"[Ff]ournisseur\s*(?::\s*)?([A-Za-zÀ-ÿ](?:\s*[A-Za-zÀ-ÿ])*?)(?=\s*(?:[A-Z]|\d|$))",
+        r"NOMDEDESTINATAIRE\s*:?\s*([A-Za-zÀ-ÿ\s]+)"
+    ],
+    # Référence ou numéro de document
+    "reference": [
+        r"(?:ref|référence|facture|fac|bon|numéro)[\s\.:]*([A-Z0-9]{2,}[-\/][A-Z0-9]{2,})",
+        r"(?:ref|référence|facture|fac|bon|numéro)[\s\.:]*(\d{6,})",
+        r"\b([A-Z]{2,}\d{4,})\b",
+        r"BONDELIVRAISON\D{0,40}?(\d{9,12})"
     ]
+}
+
+# Patterns propres à certains types de document (voir document_classifier): ils ne sont
+# essayés que sur ces types, ou quand le type n'a pas été reconnu
+TYPE_SPECIFIC_PATTERNS = {
+    "vendor": {r"NOMDEDESTINATAIRE\s*:?\s*([A-Za-zÀ-ÿ\s]+)": ("delivery_note",)},
+    "reference": {r"BONDELIVRAISON\D{0,40}?(\d{9,12})": ("delivery_note",)},
+}
+
+# Patterns supplémentaires d'un type, essayés avant ceux de PATTERNS
+TYPE_PATTERNS = {
+    "receipt": {
+        "reference": [r"(?:ticket|reçu)(?:\s*de\s*caisse)?[\s\.:]*(?:(?:n°|no|num)[\s\.:]*)?(\d{3,})"],
+    },
+    "purchase_order": {
+        "reference": [r"commande[\s\.:]*(?:(?:n°|no)[\s\.:]*)?([A-Z0-9]{2,}[-\/]?[A-Z0-9]{2,})"],
+    },
+}
+
+
+def patterns_for_type(document_type):
+    """
+    Patterns à appliquer à un type de document. Type inconnu (classifieur peu sûr ou
+    non appris): union de tous les jeux, PATTERNS puis les patterns propres à chaque type.
+    """
+    patterns = {}
+    if document_type is None:
+        for family, family_patterns in PATTERNS.items():
+            patterns[family] = list(family_patterns)
+        for type_patterns in TYPE_PATTERNS.values():
+            for family, family_patterns in type_patterns.items():
+                patterns.setdefault(family, []).extend(
+                    pattern for pattern in family_patterns if pattern not in patterns[family])
+        return patterns
+    for family, family_patterns in PATTERNS.items():
+        restricted = TYPE_SPECIFIC_PATTERNS.get(family, {})
+        kept = [pattern for pattern in family_patterns if document_type in restricted.get(pattern, (document_type,))]
+        patterns[family] = TYPE_PATTERNS.get(document_type, {}).get(family, []) + kept
+    return patterns
+
+
+# Jeux de patterns et registres compilés par type de document (None: type inconnu)
+TYPE_PATTERN_SETS = {document_type: patterns_for_type(document_type) for document_type in (None,) + DOCUMENT_TYPES}
+TYPE_REGISTRIES = {document_type: get_registry(patterns) for document_type, patterns in TYPE_PATTERN_SETS.items()}
+REGISTRY = TYPE_REGISTRIES[None]
+
+# Confiance de solve_amounts au-dessus de laquelle sa combinaison remplace aussi des
+# montants libellés qu'elle contredit (en dessous, elle ne remplace que le rang)
+SOLVED_AMOUNTS_MIN_CONFIDENCE = 0.8
+
+# Version des règles, pour le cache des résultats (voir result_cache)
+# Les libellés de l'index approximatif et le seuil du solveur changent aussi les résultats
+RULES_VERSION = "rules-" + patterns_fingerprint({**TYPE_PATTERN_SETS, "labels": FIELD_LABELS,
+                                                 "solved": [str(SOLVED_AMOUNTS_MIN_CONFIDENCE)]})[:12]
+
+
+def same_amount(labeled, solved, currency=None):
+    """
+    Vrai si un montant libellé est le montant de la solution (solve_amounts), éventuellement
+    tronqué par l'OCR: écart de moins d'une unité ("1010" pour 1009,99) ou chiffres du
+    début seulement ("19" pour 1986,24, "7729" pour 7729,64)
+    """
+    labeled_value, solved_value = parse_amount(labeled, currency), parse_amount(solved, currency)
+    if labeled_value is None or solved_value is None:
+        return False
+    if abs(labeled_value - solved_value) < 1:
+        return True
+    labeled_digits, solved_digits = re.sub(r"\D", "", labeled), re.sub(r"\D", "", solved)
+    return bool(labeled_digits) and solved_digits.startswith(labeled_digits)
+
+
+def rules_version(overlay=None):
+    """
+    Version des règles, du classifieur de type, du répertoire des noms et de la surcouche
+    de l'entreprise: un résultat en cache en dépend
+    """
+    version = f"{RULES_VERSION}-{get_classifier().version}-{get_gazetteer().version}"
+    return f"{version}-{overlay.version}" if overlay else version
+
+# Dates reconnaissables dans une valeur brute "Date:..."
+RAW_DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}|\d{2}[/.-]\d{2}[/.-]\d{2,4})')
+COMPACT_DATE_PATTERN = re.compile(r'^\d{8}$')
+DATE_SEPARATORS = re.compile(r'[-/\.]')
+
+def extract_entities(text, timer=None, overlay=None, budget=None):
+    """
+    Extrait des entités d'un texte en utilisant des règles simples, complétées par la
+    surcouche de l'entreprise (company_overlay.CompanyOverlay) si elle est donnée.
+    Les patterns sont évalués dans la limite du budget du document (TimeBudget,
+    REGEX_BUDGET_MS par défaut); ceux qui n'ont pas pu l'être sont listés sous "budget".
+    """
+    timer = timer or StageTimer()
+    budget = budget or TimeBudget()
+    entities = {}
     
-    potential_amounts = []
-    for pattern in amount_patterns:
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            amount = match.group(1).replace(" ", "").replace(",", ".")
-            potential_amounts.append((amount, match.start()))
-            print(f"Montant potentiel trouvé: {amount} à la position {match.start()}")
+    logger.debug("Utilisation du texte OCR fourni (%d caractères)", len(text))
     
-    # Trier les montants potentiels par valeur décroissante
-    potential_amounts.sort(key=lambda x: float(x[0]), reverse=True)
+    # Normalisation unique (espaces, chiffres arabes-indiens, confusions OCR dans les
+    # nombres): tous les extracteurs lisent le même texte
+    with timer.stage("normalize"):
+        normalized = normalize_text(text)
+        clean = normalized.text
     
-    # Si des montants ont été trouvés, essayer de déterminer leur nature
-    if potential_amounts:
-        # Le plus grand montant est probablement le TTC
-        if len(potential_amounts) >= 1:
-            entities["montantTTC"] = potential_amounts[0][0]
-            print(f"Montant TTC détecté (plus grand montant): {potential_amounts[0][0]}")
+    # Type du document: seuls les patterns qui s'appliquent à ce type sont essayés
+    with timer.stage("classify"):
+        document_type = classify(clean)
+        patterns = TYPE_PATTERN_SETS[document_type["type"]]
+    logger.debug("Type de document: %s (confiance %.2f)", document_type["type"], document_type["confidence"])
+    
+    with timer.stage("regex"):
+        scan = TYPE_REGISTRIES[document_type["type"]].scan(clean, budget)
+        formatted_date = find_date(scan, patterns)
         
-        # Le deuxième plus grand est probablement le HT
-        if len(potential_amounts) >= 2:
-            entities["montantHT"] = potential_amounts[1][0]
-            print(f"Montant HT détecté (2ème plus grand montant): {potential_amounts[1][0]}")
+        # Index des montants du document (Decimal, devise et libellé), parsé une seule fois,
+        # et combinaison HT + TVA = TTC cohérente s'il y en a une
+        amount_index = AmountIndex(clean)
+        amounts = solve_amounts(amount_index)
         
-        # Le troisième pourrait être la TVA
-        if len(potential_amounts) >= 3:
-            entities["tva"] = potential_amounts[2][0]
-            print(f"TVA détectée (3ème plus grand montant): {potential_amounts[2][0]}")
-    
-    # Extraire le montant HT avec des patterns plus précis
-    ht_patterns = [
-        r"[Mm]ontant\s*HT\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Tt]otal\s*HT\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"HT\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Mm]ontant\s*HT\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Hh][Tt][\s\:\.]*(\d+[\s\.,]*\d*)",
-        r"[Hh]ors\s*[Tt]axe[\s\.:]*(\d+[\s\.,]*\d*)"
-    ]
+        # Rechercher tous les nombres dans le texte qui pourraient être des montants
+        # Cela permet de trouver des montants même s'ils ne sont pas explicitement marqués
+        potential_amounts = []
+        for match in scan.all("montant"):
+            amount = normalize_amount(match.value, amount_index.currency)
+            value = parse_amount(amount)
+            if value is not None:
+                potential_amounts.append((amount, value))
+            logger.debug("Montant potentiel trouvé: %s à la position %d", amount, match.start)
+        
+        # Montants, fournisseur et référence avec des patterns plus précis
+        ht_match = scan.first("montantHT")
+        ttc_match = scan.first("montantTTC")
+        tva_match = scan.first("tva")
+        vendor_match = scan.first("vendor")
+        ref_match = scan.first("reference")
+        
+        # Valeurs qui suivent un libellé, même abîmé par l'OCR ("TotalenTTC", "Fourniseur")
+        labeled = extract_values(clean, amount_index.currency)
+        
+        # Fournisseur/destinataire déjà confirmé (vendor_gazetteer)
+        known_name = get_gazetteer().match(clean)
+        
+        # Surcouche de l'entreprise: ses noms confirmés passent devant le répertoire commun
+        company_matches = {}
+        if overlay:
+            known_name = overlay.match_name(clean) or known_name
+            company_matches = overlay.match_patterns(clean, budget)
+        
+        # Positions rapportées dans le texte d'origine
+        for found in labeled.values():
+            found["start"] = normalized.original_offset(found["start"])
+        if known_name:
+            known_name["start"], known_name["end"] = normalized.original_span(known_name["start"], known_name["end"])
     
-    for pattern in ht_patterns:
-        ht_match = re.search(pattern, text, re.IGNORECASE)
+    with timer.stage("merge"):
+        if formatted_date:
+            entities["date"] = formatted_date
+        
+        # Trier les montants potentiels par valeur décroissante
+        potential_amounts.sort(key=lambda x: x[1], reverse=True)
+        
+        # Si des montants ont été trouvés, essayer de déterminer leur nature:
+        # le plus grand est probablement le TTC, le deuxième le HT, le troisième la TVA
+        for key, (amount, _) in zip(("montantTTC", "montantHT", "tva"), potential_amounts):
+            entities[key] = amount
+            logger.debug("%s détecté par rang: %s", key, amount)
+        
+        # Les montants libellés remplacent ceux déduits du rang
+        labeled_amounts = set()
         if ht_match:
             # Nettoyer la valeur (enlever les espaces, remplacer la virgule par un point)
-            value = ht_match.group(1).replace(" ", "").replace(",", ".")
-            entities["montantHT"] = value
-            print(f"Montant HT trouvé avec pattern {pattern}: {value}")
-            break
-    
-    # Extraire le montant TTC
-    ttc_patterns = [
-        r"[Tt]otal\s*(?:en)?\s*TTC\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Mm]ontant\s*(?:en)?\s*TTC\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"TTC\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Tt]otal\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Tt]outes\s*[Tt]axes\s*[Cc]omprises[\s\:\.]*(\d+[\s\.,]*\d*)",
-        r"[Tt][Tt][Cc][\s\:\.]*(\d+[\s\.,]*\d*)"
-    ]
-    
-    for pattern in ttc_patterns:
-        ttc_match = re.search(pattern, text, re.IGNORECASE)
+            entities["montantHT"] = normalize_amount(ht_match.value, amount_index.currency)
+            labeled_amounts.add("montantHT")
+            logger.debug("Montant HT trouvé avec pattern %s: %s",
+                         patterns["montantHT"][ht_match.priority], entities["montantHT"])
+        
         if ttc_match:
-            value = ttc_match.group(1).replace(" ", "").replace(",", ".")
-            entities["montantTTC"] = value
-            print(f"Montant TTC trouvé avec pattern {pattern}: {value}")
-            break
-    
-    # Extraire la TVA
-    tva_patterns = [
-        r"TVA\s*(?:\d+%)?(?:\s*:)?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"[Tt]axe\s*:?\s*(\d+[\s\.,]*\d*)\s*(?:€|EUR|DT|TND)?",
-        r"TVA\s*(\d+)%",
-        r"[Tt][Vv][Aa][\s\:\.]*(\d+[\s\.,]*\d*)"
-    ]
-    
-    for pattern in tva_patterns:
-        tva_match = re.search(pattern, text, re.IGNORECASE)
+            entities["montantTTC"] = normalize_amount(ttc_match.value, amount_index.currency)
+            labeled_amounts.add("montantTTC")
+            logger.debug("Montant TTC trouvé avec pattern %s: %s",
+                         patterns["montantTTC"][ttc_match.priority], entities["montantTTC"])
+        
         if tva_match:
-            value = tva_match.group(1).replace(" ", "").replace(",", ".")
+            pattern = patterns["tva"][tva_match.priority]
+            value = normalize_amount(tva_match.value, amount_index.currency)
+            number = parse_amount(value)
             # Vérifier si c'est un taux ou un montant
-            if "%" in pattern or int(float(value)) < 50:  # Si c'est moins de 50, c'est probablement un pourcentage
+            if "%" in pattern or (number is not None and number < 50):  # Si c'est moins de 50, c'est probablement un pourcentage
                 entities["tauxTVA"] = value
-                print(f"Taux de TVA trouvé: {value}%")
+                logger.debug("Taux de TVA trouvé: %s%%", value)
             else:
                 entities["tva"] = value
-                print(f"Montant TVA trouvé: {value}")
-            break
-    
-    # Extraire le nom du fournisseur/destinataire
-    vendor_patterns = [
-        r"[Nn]om\s*(?:de)?\s*(?:destinataire|fournisseur)\s*:?\s*([A-Za-zÀ-ÿ\s]+?)(?=\s*[A-Z]|\s*\d|$)",
-        r"[Dd]estinataire\s*:?\s*([A-Za-zÀ-ÿ\s]+?)(?=\s*[A-Z]|\s*\d|$)",
-        r"[Ff]ournisseur\s*:?\s*([A-Za-zÀ-ÿ\s]+?)(?=\s*[A-Z]|\s*\d|$)",
-        r"NOMDEDESTINATAIRE\s*:?\s*([A-Za-zÀ-ÿ\s]+)"
-    ]
-    
-    for pattern in vendor_patterns:
-        vendor_match = re.search(pattern, text, re.IGNORECASE)
+                labeled_amounts.add("tva")
+                logger.debug("Montant TVA trouvé: %s", value)
+        
         if vendor_match:
-            entities["vendor"] = vendor_match.group(1).strip()
-            print(f"Fournisseur/destinataire trouvé: {vendor_match.group(1).strip()}")
-            break
-    
-    # Extraire la référence ou numéro de document
-    ref_patterns = [
-        r"(?:ref|référence|facture|fac|bon|numéro)[\s\.:]*([A-Z0-9]{2,}[-\/][A-Z0-9]{2,})",
-        r"(?:ref|référence|facture|fac|bon|numéro)[\s\.:]*(\d{6,})",
-        r"\b([A-Z]{2,}\d{4,})\b",
-        r"BONDELIVRAISON.*?(\d{9,12})"
-    ]
-    
-    for pattern in ref_patterns:
-        ref_match = re.search(pattern, text, re.IGNORECASE)
+            entities["vendor"] = vendor_match.value.strip()
+            logger.debug("Fournisseur/destinataire trouvé: %s", entities["vendor"])
+        
         if ref_match:
-            entities["reference"] = ref_match.group(1).strip()
-            print(f"Référence trouvée: {ref_match.group(1).strip()}")
-            break
-
-    # Si nous avons extrait des entités montantHT et montantTTC mais pas de TVA, calculons-la
-    if "montantHT" in entities and "montantTTC" in entities and "tva" not in entities:
-        try:
-            ht = float(entities["montantHT"])
-            ttc = float(entities["montantTTC"])
-            tva = ttc - ht
-            entities["tva"] = str(round(tva, 2))
-            print(f"TVA calculée: {entities['tva']}")
-        except (ValueError, TypeError):
-            pass
+            entities["reference"] = ref_match.value.strip()
+            logger.debug("Référence trouvée: %s", entities["reference"])
+        
+        # Une valeur validée juste après son libellé l'emporte sur les patterns larges
+        # (date, fournisseur, référence) et complète les montants sans libellé exact
+        for key, found in labeled.items():
+            if key in ("date", "vendor", "reference") or (key in ("montantHT", "montantTTC", "tva") and not {
+                    "montantHT": ht_match, "montantTTC": ttc_match, "tva": tva_match}[key]):
+                entities[key] = found["value"]
+                if key in ("montantHT", "montantTTC", "tva"):
+                    labeled_amounts.add(key)
+                logger.debug("%s trouvé après le libellé '%s' (distance %d): %s",
+                             key, found["label"], found["distance"], found["value"])
+        
+        # Un nom confirmé l'emporte sur les patterns, pas sur le nom écrit après son libellé
+        # (il en donne seulement l'écriture confirmée quand les deux concordent)
+        if known_name and ("vendor" not in labeled or same_name(known_name["value"], labeled["vendor"]["value"])):
+            entities["vendor"] = known_name["value"]
+            logger.debug("Nom connu trouvé: %s (texte: %s)", known_name["value"], known_name["raw"])
+        
+        # Une combinaison arithmétiquement cohérente l'emporte sur le rang; sur les montants
+        # libellés seulement si elle les reprend ou si sa confiance est suffisante
+        if amounts:
+            contradicted = [key for key in labeled_amounts
+                            if not same_amount(entities[key], amounts[key], amount_index.currency)]
+            if not contradicted or amounts["confidence"] >= SOLVED_AMOUNTS_MIN_CONFIDENCE:
+                for key in ("montantHT", "tauxTVA", "tva", "montantTTC"):
+                    entities[key] = amounts[key]
+                logger.debug("Montants cohérents (confiance %.2f): %s", amounts["confidence"], amounts)
+            else:
+                logger.debug("Montants cohérents écartés (confiance %.2f, contredisent %s): %s",
+                             amounts["confidence"], contradicted, amounts)
+                # Une TVA déduite du rang est recalculée plus bas à partir des montants gardés
+                if "tva" not in labeled_amounts:
+                    entities.pop("tva", None)
+        
+        # Les patterns propres à l'entreprise l'emportent sur toutes les règles communes
+        for key, match in company_matches.items():
+            value = match.value.strip()
+            entities[key] = normalize_amount(value, amount_index.currency) if key in ("montantHT", "montantTTC", "tva") else value
+            logger.debug("%s trouvé par un pattern de l'entreprise: %s", key, entities[key])
+        
+        # Si nous avons extrait des entités montantHT et montantTTC mais pas de TVA, calculons-la
+        if "montantHT" in entities and "montantTTC" in entities and "tva" not in entities:
+            ht = parse_amount(entities["montantHT"])
+            ttc = parse_amount(entities["montantTTC"])
+            if ht is not None and ttc is not None:
+                entities["tva"] = format_amount(ttc - ht)
+                logger.debug("TVA calculée: %s", entities["tva"])
+    
+    # Lignes d'articles, contrôlées par quantité × prix unitaire et par le montant HT
+    line_items = None
+    if budget.allows("line_items"):
+        with timer.stage("line_items"):
+            line_items = extract_line_items(normalized_tokens(normalized), entities.get("montantHT"), amount_index.currency)
     
     # Créer un format de résultat complet compatible avec l'API
     result = {
         "entities": entities,
-        "raw_results": {},
-        "processing_time": 0.0
+        "document_type": document_type,
+        "line_items": line_items,
+        "raw_results": {
+            "amounts": amounts or {"currency": amount_index.currency, "confidence": 0.0},
+            "labels": labeled,
+            "known_name": known_name,
+            "overlay": {"company": overlay.company_id, "version": overlay.version,
+                        "fields": sorted(company_matches)} if overlay else None,
+        },
+        "processing_time": round(timer.elapsed(), 6),
+        "timings": timer.as_dict()
     }
+    if budget.skipped:
+        result["budget"] = budget.as_dict()
+        logger.warning("Budget des règles dépassé (%d ms), non évalués: %s", budget.milliseconds, budget.skipped)
     
-    print(f"Entités extraites: {entities}")
+    logger.debug("Entités extraites: %s", entities)
     
     return result
 
+def extract_entities_from_words(words, timer=None, overlay=None):
+    """
+    Extraction à partir des mots positionnés de Tesseract (TSV ou hOCR, voir layout_index).
+    Chaque libellé est associé à sa valeur par voisinage spatial; les règles sur le texte
+    reconstruit complètent les champs que la mise en page n'a pas résolus.
+    """
+    timer = timer or StageTimer()
+    budget = TimeBudget()
+    
+    with timer.stage("layout"):
+        document = LayoutDocument(words)
+        fields = document.extract_fields()
+    
+    result = extract_entities(document.text, timer, overlay, budget)
+    for field, found in fields.items():
+        result["entities"][field] = found["value"]
+        logger.debug("%s trouvé par la mise en page (%s du libellé '%s'): %s",
+                     field, found["relation"], found["label"], found["value"])
+    result["raw_results"]["layout"] = fields
+    
+    # Colonnes du tableau d'articles d'après les positions en pixels
+    if budget.allows("line_items"):
+        with timer.stage("line_items"):
+            line_items = extract_line_items(word_tokens(words), result["entities"].get("montantHT"),
+                                            result["raw_results"]["amounts"]["currency"], min_gap=word_gap(words))
+        if line_items:
+            result["line_items"] = line_items
+    if budget.skipped:
+        result["budget"] = budget.as_dict()
+    return result
+
+def normalize_amount(value, currency=None):
+    """Montant libellé sous forme décimale avec un point (1 103,36 -> 1103.36)"""
+    amount = parse_amount(value, currency)
+    if amount is None:
+        return clean_amount(value)
+    return format_amount(amount)
+
+def find_date(scan, patterns=PATTERNS):
+    """Retourne la première date valide (format AAAA-MM-JJ si possible), ou None"""
+    # Parcourir les patterns de date par ordre de priorité
+    for pattern, date_matches in zip(patterns["date"], scan.by_pattern("date")):
+        for date_match in date_matches:
+            match = date_match.value
+            logger.debug("Match potentiel trouvé pour la date avec %s: %s", pattern, match)
+            # Valider que c'est une date plausible
+            try:
+                # Si la date est au format YYYYMMDD sans séparateurs, la reformater
+                if COMPACT_DATE_PATTERN.match(match):
+                    year = match[0:4]
+                    month = match[4:6]
+                    day = match[6:8]
+                    return f"{year}-{month}-{day}"
+                
+                # Standardiser le format de date
+                parts = DATE_SEPARATORS.split(match)
+                if len(parts) != 3:
+                    return match
+                
+                # Déterminer si c'est JJ/MM/AAAA ou AAAA-MM-JJ
+                if len(parts[0]) == 4:  # Format AAAA-MM-JJ
+                    year, month, day = parts
+                else:  # Format JJ/MM/AAAA
+                    day, month, year = parts
+                    # Ajouter le siècle si nécessaire
+                    if len(year) == 2:
+                        year = '20' + year if int(year) < 50 else '19' + year
+                
+                return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+            except Exception as e:
+                logger.debug("Erreur lors de la validation de la date %s: %s", match, e)
+                continue
+    
+    logger.debug("Aucune date valide trouvée avec les patterns réguliers, recherche agressive")
+    # Chercher explicitement pour "Date:2020-11-25" ou similaire
+    raw_date_match = scan.first("date_brute")
+    if raw_date_match:
+        # Vérifier si c'est une date valide
+        date_match = RAW_DATE_PATTERN.search(raw_date_match.value)
+        if date_match:
+            return date_match.group(1)
+        logger.debug("La date brute trouvée n'est pas dans un format reconnaissable: %s", raw_date_match.value)
+    
+    return None
+
 def main():
     """
     Script utilisé par le service Python Bridge pour extraire des entités d'un document
     Arguments:
-        1: Chemin vers le fichier texte
+        1: Chemin vers le fichier texte, ou vers les mots positionnés de Tesseract
+           (.tsv ou .hocr/.html) pour l'extraction tenant compte de la mise en page
         2: (Optionnel) Chemin vers l'image source
+        --company <entreprise>: (Optionnel) applique la surcouche de l'entreprise
     """
+    timer = StageTimer()
+    
+    try:
+        company, argv = pop_company_argument(sys.argv)
+        overlay = get_overlay(company) if company else None
+    except ValueError as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+    
     # Vérifier qu'il y a au moins un argument
-    if len(sys.argv) < 2:
+    if len(argv) < 2:
         print(json.dumps({"error": "Arguments insuffisants"}))
         sys.exit(1)
     
     # Récupérer le chemin du fichier texte
-    text_path = sys.argv[1]
+    text_path = argv[1]
     
     # Vérifier que le fichier existe
     if not os.path.exists(text_path):
         print(json.dumps({"error": f"Le fichier {text_path} n'existe pas"}))
         sys.exit(1)
     
+    # Mots positionnés de Tesseract: extraction selon la mise en page
+    if text_path.lower().endswith((".tsv", ".hocr", ".html")):
+        with profile_request(label="simple_parser_layout"):
+            result = extract_entities_from_words(read_words(text_path), timer, overlay)
+            print(dumps_result(result, timer))
+        return
+    
     # Lire le contenu du fichier
     try:
         with open(text_path, 'r', encoding='utf-8') as f:
@@ -279,11 +504,13 @@ def main():
         print(json.dumps({"error": f"Erreur de lecture du fichier: {str(e)}"}))
         sys.exit(1)
     
-    # Extraire les entités
-    result = extract_entities(text)
-    
-    # Retourner le résultat en JSON
-    print(json.dumps(result, ensure_ascii=False))
+    # Extraire les entités (profil cProfile/tracemalloc si PARSER_PROFILE_DIR est défini)
+    # Un texte déjà traité avec les mêmes règles est relu dans le cache des résultats
+    with profile_request(label="simple_parser"):
+        result = cached_extract(text, cache_kind("simple", overlay), rules_version(overlay), lambda text: extract_entities(text, timer, overlay))
+        
+        # Retourner le résultat en JSON
+        print(dumps_result(result, timer))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
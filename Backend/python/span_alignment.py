@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Alignement des valeurs corrigées (feedback) sur le texte OCR du document.
+
+`text.find(valeur)` ne prend que la première occurrence exacte: un "19" ou une date
+répétée est rattaché au mauvais endroit, et une valeur saisie "1103.361" est perdue
+quand l'OCR a lu "1 103,361". Ici:
+
+- le texte est normalisé caractère par caractère (minuscules, sans accents ni espaces,
+  virgule ramenée au point) avec une table de positions vers le texte d'origine;
+- les valeurs corrigées, normalisées de la même façon (et quelques variantes d'écriture
+  des dates et des montants), forment un automate d'Aho-Corasick: un seul passage sur
+  le texte trouve toutes les occurrences de toutes les valeurs;
+- pour chaque valeur, l'occurrence retenue est la plus proche d'un libellé de son champ
+  (index approximatif de label_index), de préférence juste après; sans libellé, la
+  première. Deux entités ne partagent jamais de caractères (spaCy refuse les chevauchements).
+
+Les valeurs non alignées sont retournées avec la raison, pour le compte rendu du feedback.
+`snap_to_tokens` cale ensuite les spans sur les jetons d'un Doc spaCy avant l'entraînement.
+"""
+
+import re
+import unicodedata
+from array import array
+from collections import deque
+
+from label_index import find_anchors
+
+# Champ de label_index par étiquette d'entité (étiquette en majuscules, sans séparateurs)
+ENTITY_FIELDS = {
+    "DATE": "date",
+    "MONTANTHT": "montantHT",
+    "MONTANTTTC": "montantTTC",
+    "TVA": "tva",
+    "REFERENCE": "reference",
+    "RECIPIENT": "vendor",
+    "VENDOR": "vendor",
+    "PHONE": "phone",
+    "TELEPHONE": "phone",
+    "ADDRESS": "address",
+    "ADRESSE": "address",
+}
+
+# Une occurrence placée avant son libellé coûte ce facteur × l'écart
+BEFORE_LABEL_PENALTY = 4
+
+# Caractères qu'une entité peut gagner pour couvrir un jeton entier (devise collée)
+MAX_EXPANSION = 3
+
+ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+DECIMAL_AMOUNT = re.compile(r"^(\d+)(?:\.(\d+))?$")
+
+_char_cache = {}
+
+
+def _fold_char(char):
+    """Forme normalisée d'un caractère (chaîne vide pour un espace)"""
+    folded = _char_cache.get(char)
+    if folded is None:
+        if char.isspace():
+            folded = ""
+        elif char in ",٫":
+            folded = "."
+        else:
+            decomposed = unicodedata.normalize("NFKD", char.casefold())
+            folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+        _char_cache[char] = folded
+    return folded
+
+
+def normalize_with_offsets(text):
+    """
+    Texte normalisé et table des positions: offsets[i] est la position dans `text`
+    du caractère qui a produit le i-ème caractère normalisé
+    """
+    parts = []
+    offsets = array("i")
+    for position, char in enumerate(text):
+        folded = _fold_char(char)
+        if folded:
+            parts.append(folded)
+            offsets.extend([position] * len(folded))
+    return "".join(parts), offsets
+
+
+def normalize_value(value):
+    return "".join(_fold_char(char) for char in str(value))
+
+
+def value_variants(value):
+    """Écritures normalisées acceptées pour une valeur corrigée"""
+    normalized = normalize_value(value)
+    variants = [normalized] if normalized else []
+
+    # Date ISO saisie, date OCR au format français
+    match = ISO_DATE.match(normalized)
+    if match:
+        year, month, day = match.groups()
+        for separator in ("/", "-", "."):
+            variants.append(separator.join((day, month, year)))
+            variants.append(separator.join((day, month, year[2:])))
+
+    # Montant saisi sans séparateur de milliers, montant OCR "1.103,361" (virgule ramenée au point)
+    match = DECIMAL_AMOUNT.match(normalized)
+    if match and len(match.group(1)) > 3:
+        integer, decimals = match.groups()
+        head = len(integer) % 3 or 3
+        grouped = ".".join([integer[:head]] + [integer[i:i + 3] for i in range(head, len(integer), 3)])
+        variants.append(grouped + ("." + decimals if decimals else ""))
+    return list(dict.fromkeys(variants))
+
+
+class ValueAutomaton:
+    """Automate d'Aho-Corasick sur un ensemble de chaînes"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto[state][char] = following
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = following
+            self._output[state].append(index)
+
+        # Liens d'échec en largeur: chaque état hérite des sorties de son suffixe
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target if target != following else 0
+                self._output[following] = self._output[following] + self._output[self._fail[following]]
+
+    def find_all(self, text):
+        """Toutes les occurrences (indice du motif, début, fin), chevauchantes comprises"""
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield index, position + 1 - len(patterns[index]), position + 1
+
+
+def _isolated(text, begin, finish):
+    """
+    Un nombre ne doit pas être pris au milieu d'un autre ("19" dans "2019"). Vérifié sur
+    le texte d'origine (text[begin:finish]): la normalisation retire les espaces, qui
+    séparent pourtant deux nombres ("TVA 19 190,00", "2 9,90 19,80")
+    """
+    if text[begin].isdigit() and begin > 0 and text[begin - 1].isdigit():
+        return False
+    if text[finish - 1].isdigit() and finish < len(text) and text[finish].isdigit():
+        return False
+    return True
+
+
+def _label_cost(start, end, anchors):
+    """Écart entre une occurrence et le libellé le plus proche de son champ"""
+    best = None
+    for anchor in anchors:
+        if anchor.end <= start:
+            cost = start - anchor.end
+        else:
+            cost = BEFORE_LABEL_PENALTY * max(0, anchor.start - end) + 1
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+def align_entities(text, values):
+    """
+    Aligne des valeurs [(étiquette, valeur)] sur le texte.
+
+    Retourne (spans, rejetées): spans [(début, fin, étiquette)] triés, sans chevauchement,
+    positions dans `text`; rejetées [{"label", "value", "reason"}] avec reason "empty"
+    (valeur vide après normalisation), "not_found" ou "overlap" (seules occurrences déjà
+    prises par une autre entité).
+    """
+    dropped = []
+    patterns = []
+    owners = []
+    for index, (label, value) in enumerate(values):
+        variants = value_variants(value)
+        if not variants:
+            dropped.append({"label": label, "value": value, "reason": "empty"})
+        for variant in variants:
+            patterns.append(variant)
+            owners.append(index)
+    if not patterns:
+        return [], dropped
+
+    normalized, offsets = normalize_with_offsets(text)
+    occurrences = {}
+    for pattern_index, start, end in ValueAutomaton(patterns).find_all(normalized):
+        span = (offsets[start], offsets[end - 1] + 1)
+        if _isolated(text, *span):
+            occurrences.setdefault(owners[pattern_index], set()).add(span)
+
+    # Candidats classés par écart au libellé du champ, puis par position
+    anchors_by_field = {}
+    if occurrences:
+        for anchor in find_anchors(text):
+            anchors_by_field.setdefault(anchor.field, []).append(anchor)
+    candidates = []
+    for index, spans in occurrences.items():
+        field = ENTITY_FIELDS.get(re.sub(r"[^A-Z]", "", values[index][0].upper()))
+        anchors = anchors_by_field.get(field)
+        for start, end in spans:
+            cost = _label_cost(start, end, anchors) if anchors else 0
+            candidates.append((cost, start, -end, index))
+    candidates.sort()
+
+    chosen = {}
+    taken = []
+    for cost, start, end, index in candidates:
+        end = -end
+        if index in chosen or any(start < other_end and other_start < end for other_start, other_end in taken):
+            continue
+        chosen[index] = (start, end, values[index][0])
+        taken.append((start, end))
+
+    for index, (label, value) in enumerate(values):
+        if index not in chosen and index in occurrences:
+            dropped.append({"label": label, "value": value, "reason": "overlap"})
+        elif index not in chosen and value_variants(value):
+            dropped.append({"label": label, "value": value, "reason": "not_found"})
+    return sorted(chosen.values()), dropped
+
+
+def snap_to_tokens(doc, entities):
+    """
+    Spans spaCy des entités [(début, fin, étiquette)] calés sur les jetons de `doc`:
+    jetons entièrement couverts, sinon le jeton entier s'il ne dépasse l'entité que de
+    MAX_EXPANSION caractères ("552,685TND"). Les entités qui ne s'alignent pas sont
+    écartées plutôt que transmises à spaCy, qui les ignorerait (avertissement W030).
+    Retourne (spans sans chevauchement, nombre d'entités écartées).
+    """
+    from spacy.util import filter_spans
+
+    spans = []
+    misaligned = 0
+    for start, end, label in entities:
+        span = doc.char_span(start, end, label=label, alignment_mode="contract")
+        if span is None or not len(span):
+            span = doc.char_span(start, end, label=label, alignment_mode="expand")
+            if span is not None and span.end_char - span.start_char - (end - start) > MAX_EXPANSION:
+                span = None
+        if span is None or not len(span):
+            misaligned += 1
+            continue
+        spans.append(span)
+    return filter_spans(spans), misaligned
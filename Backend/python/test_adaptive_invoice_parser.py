@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du parser adaptatif: extraction par lots (un seul flux nlp.pipe), étages de la cascade, entraînement"""
+
+import pytest
+import spacy
+
+import adaptive_invoice_parser
+from adaptive_invoice_parser import CHUNK_CHARS, AdaptiveInvoiceParser
+from company_overlay import set_threshold
+from invoice_corpus import generate_corpus
+from model_registry import ModelRegistry
+from training_queue import feedback_to_training_sample
+
+
+@pytest.fixture(scope="module")
+def parser(tmp_path_factory):
+    # NER déterministe: un EntityRuler publié sous le nom "ner"
+    nlp = spacy.blank("fr")
+    nlp.add_pipe("entity_ruler", name="ner").add_patterns([
+        {"label": "REFERENCE", "pattern": [{"TEXT": {"REGEX": r"^\d{12}$"}}]},
+        {"label": "PHONE", "pattern": [{"TEXT": {"REGEX": r"^\d{8}$"}}]},
+        {"label": "RECIPIENT", "pattern": [{"LOWER": "électro"}, {"LOWER": "sahel"}]},
+    ])
+    _, path = ModelRegistry(str(tmp_path_factory.mktemp("models"))).publish(nlp, {"patterns": {}})
+    return AdaptiveInvoiceParser(path, shared_model=False)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    documents = [document["text"] for document in generate_corpus(160, seed=3)]
+    long_text = "\f".join(documents[10:])
+    assert len(long_text) > CHUNK_CHARS
+    return documents[:5] + [long_text, ""] + documents[5:10] + [long_text[:CHUNK_CHARS + 500]]
+
+
+def count_pipe_calls(parser, monkeypatch):
+    calls = []
+    pipe = parser.nlp.pipe
+
+    def counting_pipe(*args, **kwargs):
+        # Language.pipe(as_tuples=True) se rappelle lui-même pour les Doc
+        if kwargs.get("as_tuples"):
+            calls.append(kwargs.get("n_process"))
+        return pipe(*args, **kwargs)
+    monkeypatch.setattr(parser.nlp, "pipe", counting_pipe)
+    return calls
+
+
+def test_batch_matches_single_extraction(parser, texts, monkeypatch):
+    expected = [parser.extract_entities(text)["entities"] for text in texts]
+    calls = count_pipe_calls(parser, monkeypatch)
+    batch = [result["entities"] for result in parser.extract_entities_batch(texts, batch_size=4)]
+    assert batch == expected
+    assert any(entity["source"] == "ml_model" for entity in expected[5]["reference"])
+    # Textes courts et fenêtres des longs textes passent dans un seul flux
+    assert calls == [1]
+
+
+def test_cascade_batch_matches_single_extraction(parser, texts, monkeypatch):
+    expected = [parser.extract_entities(text, cascade=True) for text in texts]
+    calls = count_pipe_calls(parser, monkeypatch)
+    batch = list(parser.extract_entities_batch(texts, batch_size=4, cascade=True))
+    assert [result["entities"] for result in batch] == [result["entities"] for result in expected]
+    assert [result["cascade"] for result in batch] == [result["cascade"] for result in expected]
+    assert len(calls) <= 1
+
+
+def test_windowed_entities_keep_full_text_positions(parser, texts):
+    long_text = texts[5]
+    spans = parser._windowed_entities(long_text)
+    assert spans
+    assert all(long_text[span.start_char:span.end_char] == span.text for span in spans)
+    assert len({(span.start_char, span.end_char) for span in spans}) == len(spans)
+
+
+CLEAN = ("Facture FA2024-0042\nDate: 12/03/2024\nFournisseur: Ben Salah Export\n"
+         "Total HT: 1 000,00 DT\nTVA 19%: 190,00 DT\nTotal TTC: 1 190,00 DT")
+
+
+def test_cascade_accepts_confident_rules(parser):
+    result = parser.extract_entities(CLEAN, cascade=True)
+    assert result["cascade"] == {"ner_labels": []}
+    assert set(result["tiers"].values()) == {"rules"}
+
+
+def test_cascade_falls_back_to_ner_below_threshold(parser, monkeypatch):
+    # Pas de libellé "Fournisseur": les règles ne trouvent pas le destinataire
+    text = CLEAN.replace("Fournisseur: Ben Salah Export", "Électro Sahel, Sousse")
+    result = parser.extract_entities(text, cascade=True)
+    assert result["cascade"] == {"ner_labels": ["RECIPIENT"]}
+    assert result["tiers"]["recipient"] == "ner"
+    assert result["entities"]["recipient"][0]["value"] == "Électro Sahel"
+    assert result["tiers"]["montant_ttc"] == "rules"
+
+    # Seuil global relevé: les champs lus par libellé (0.75) repassent par le NER
+    monkeypatch.setattr(adaptive_invoice_parser, "CASCADE_MIN_CONFIDENCE", 0.8)
+    assert parser.extract_entities(CLEAN, cascade=True)["cascade"] == {"ner_labels": ["DATE", "RECIPIENT"]}
+
+
+def test_company_threshold_overrides_cascade(parser, tmp_path):
+    overlay = set_threshold("acme", "date", 0.9, str(tmp_path))
+    assert parser.extract_entities(CLEAN, cascade=True, overlay=overlay)["cascade"] == {"ner_labels": ["DATE"]}
+    # Un seuil d'entreprise plus bas ne descend pas sous le seuil global
+    overlay = set_threshold("acme", "date", 0.1, str(tmp_path))
+    assert parser.extract_entities(CLEAN, cascade=True, overlay=overlay)["cascade"] == {"ner_labels": []}
+
+
+def test_training_resumes_from_current_weights_and_stops_early(tmp_path, monkeypatch):
+    models_dir = str(tmp_path)
+    parser = AdaptiveInvoiceParser(shared_model=False)
+    samples = [feedback_to_training_sample(document["text"], document["entities"])
+               for document in generate_corpus(10, seed=5)]
+    parser.training_data = list(samples)
+    assert parser.train(iterations=2, models_dir=models_dir)["status"] == "success"
+
+    # Second entraînement: les mises à jour partent des poids publiés, sans réinitialisation
+    trained = parser.nlp.get_pipe("ner").to_bytes()
+    starting_weights = []
+    update = parser.nlp.update
+
+    def recording_update(*args, **kwargs):
+        if not starting_weights:
+            starting_weights.append(parser.nlp.get_pipe("ner").to_bytes())
+        return update(*args, **kwargs)
+    monkeypatch.setattr(parser.nlp, "update", recording_update)
+    monkeypatch.setattr(parser.nlp, "initialize", lambda *args, **kwargs: pytest.fail("poids réinitialisés"))
+    # F1 de validation constant: aucune amélioration après la première époque
+    monkeypatch.setattr(parser.nlp, "evaluate", lambda examples: {"ents_p": 0.5, "ents_r": 0.5, "ents_f": 0.5})
+
+    parser.training_data = list(samples)
+    result = parser.train(iterations=20, patience=2, models_dir=models_dir)
+    assert starting_weights == [trained]
+    assert result["training"]["epochs"] == 3
+    assert result["training"]["best_epoch"] == 1
+    assert result["training"]["dev_examples"] == 2
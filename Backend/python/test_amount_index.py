@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'index des montants et du solveur HT + TVA = TTC"""
+
+from decimal import Decimal
+
+import pytest
+
+import simple_invoice_parser
+from amount_index import AmountIndex, detect_currency, parse_amount, solve_amounts
+
+
+@pytest.mark.parametrize("text, currency, expected", [
+    ("1 103,36", None, Decimal("1103.36")),
+    ("1.103,36", None, Decimal("1103.36")),
+    ("1,103.36", None, Decimal("1103.36")),
+    ("1103,361", "TND", Decimal("1103.361")),
+    ("1.103.361", None, Decimal("1103361")),
+    ("1.103", "EUR", Decimal("1103")),
+    ("1.103", "TND", Decimal("1.103")),
+    ("12", None, Decimal("12")),
+    ("1,10,0", None, None),
+    ("abc", None, None),
+])
+def test_parse_amount(text, currency, expected):
+    assert parse_amount(text, currency) == expected
+
+
+def test_detect_currency_uses_majority():
+    assert detect_currency("Total 10,000 DT\nTVA 1,900 TND\nRemise 1 €") == "TND"
+    assert detect_currency("Total 10") is None
+
+
+def test_index_records_labels_and_finds_with_tolerance():
+    index = AmountIndex("Montant HT: 100,00 €\nTVA 20%: 20,00 €\nTotal TTC: 120,00 €")
+    assert [amount.label for amount in index.amounts] == ["HT", "TVA", "TTC"]
+    assert index.rates == [Decimal("20")]
+    assert index.find(120005).text == "120,00"
+    assert index.find(125000) is None
+
+
+def test_solver_finds_consistent_triplet_among_distractors():
+    text = """FACTURE FA2024-0042
+Article A 3 150,00 450,00
+Article B 2 275,00 550,00
+Total HT 1 000,00 DT
+TVA 19% 190,00 DT
+Total TTC 1 190,00 DT
+Acompte 300,00 DT"""
+    solution = solve_amounts(AmountIndex(text))
+    assert solution["montantHT"] == "1000.00"
+    assert solution["tauxTVA"] == "19"
+    assert solution["tva"] == "190.00"
+    assert solution["montantTTC"] == "1190.00"
+    assert solution["currency"] == "TND"
+    # "3 150,00" (quantité puis prix) est aussi lu comme 3150: le TTC n'est pas le plus grand
+    assert solution["confidence"] == 0.95
+
+
+def test_solver_uses_default_rates_when_none_written():
+    solution = solve_amounts(AmountIndex("Net 250,00 €\nTaxes 50,00 €\nA payer 300,00 €"))
+    assert (solution["montantHT"], solution["tauxTVA"], solution["montantTTC"]) == ("250.00", "20", "300.00")
+
+
+def test_solver_detects_tunisian_stamp_duty():
+    text = "Total HT 100,000 DT\nTVA 19% 19,000 DT\nTimbre 0,600 DT\nNet à payer TTC 119,600 DT"
+    solution = solve_amounts(AmountIndex(text))
+    assert solution["montantTTC"] == "119.600"
+    assert solution["timbreFiscal"] == "0.600"
+    assert solution["tva"] == "19.000"
+
+
+def test_solver_needs_two_amounts():
+    assert solve_amounts(AmountIndex("Total 10,00 €")) is None
+    assert solve_amounts(AmountIndex("12,00 et 17,00")) is None
+
+
+def test_deduced_tva_uses_currency_decimals():
+    solution = solve_amounts(AmountIndex("Net 250,00 €\nA payer 300,00 €"))
+    assert solution["tva"] == "50.00"
+    solution = solve_amounts(AmountIndex("Total HT 100,000 DT\nTimbre 0,600 DT\nNet à payer 119,600 DT"))
+    assert (solution["tva"], solution["timbreFiscal"]) == ("19.000", "0.600")
+
+
+def test_weak_solution_does_not_override_labeled_totals():
+    text = "Article A 1 100,00 100,00\nArticle B 1 110,00 110,00\nTotal HT: 210,00 €\nTotal TTC: 250,00 €"
+    assert solve_amounts(AmountIndex(text))["confidence"] < simple_invoice_parser.SOLVED_AMOUNTS_MIN_CONFIDENCE
+    entities = simple_invoice_parser.extract_entities(text)["entities"]
+    assert (entities["montantHT"], entities["montantTTC"], entities["tva"]) == ("210.00", "250.00", "40.00")
+    assert "tauxTVA" not in entities
+
+
+@pytest.mark.parametrize("labeled, solved, expected", [
+    ("7729", "7729.64", True),
+    ("1010", "1009.99", True),
+    ("19", "1986.24", True),
+    ("210.00", "100.00", False),
+    ("250.00", "110.00", False),
+])
+def test_truncated_labeled_amount_matches_solution(labeled, solved, expected):
+    assert simple_invoice_parser.same_amount(labeled, solved) is expected
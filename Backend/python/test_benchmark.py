@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de la notation du banc d'essai (formats des deux parsers)"""
+
+import simple_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from benchmark import FIELDS, extracted_fields, normalize_value
+
+TEXT = ("Facture FA2024-0042\nDate: 12/03/2024\nFournisseur: Ben Salah Export\n"
+        "Total HT: 1 000,00 DT\nTVA 19%: 190,00 DT\nTotal TTC: 1 190,00 DT")
+EXPECTED = {"date": "2024-03-12", "montantHT": "1000.000", "tva": "190.000", "montantTTC": "1190.000",
+            "vendor": "Ben Salah Export", "reference": "FA2024-0042"}
+
+
+def scored(kind, result):
+    found = extracted_fields(kind, result)
+    return {field: normalize_value(field, found.get(field)) == normalize_value(field, EXPECTED[field])
+            for field in FIELDS}
+
+
+def test_simple_and_adaptive_results_are_scored_alike():
+    assert all(scored("simple", simple_invoice_parser.extract_entities(TEXT)).values())
+    # Le parser adaptatif rend des clés en minuscules ("montant_ht"): elles comptent aussi
+    result = AdaptiveInvoiceParser().extract_entities(TEXT)
+    assert "montant_ht" in result["entities"]
+    assert all(scored("adaptive", result).values())
+    assert all(scored("cascade", result).values())
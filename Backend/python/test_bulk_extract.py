@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'extraction en masse (ordre de sortie, interruption et reprise)"""
+
+import json
+import os
+
+import pytest
+
+import bulk_extract
+from bulk_extract import CHECKPOINT_SUFFIX, list_documents, run_bulk
+from invoice_corpus import generate_corpus
+
+
+@pytest.fixture
+def documents(tmp_path):
+    input_dir = tmp_path / "ocr"
+    input_dir.mkdir()
+    for index, document in enumerate(generate_corpus(10, seed=21)):
+        (input_dir / f"doc{index:02d}.txt").write_text(document["text"], encoding="utf-8")
+    return list_documents(str(input_dir))
+
+
+def read_output(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [(record["id"], record.get("entities")) for record in map(json.loads, f)]
+
+
+def test_interrupted_run_resumes_from_checkpoint(documents, tmp_path, monkeypatch):
+    expected_path = str(tmp_path / "expected.jsonl")
+    run_bulk(documents, expected_path, "simple", workers=1, chunk_size=3)
+    expected = read_output(expected_path)
+    assert [doc_id for doc_id, _ in expected] == [doc_id for doc_id, _ in documents]
+    assert all(entities for _, entities in expected)
+
+    # Ctrl+C après le deuxième paquet écrit
+    update = bulk_extract.Progress.update
+
+    def interrupting_update(self, count, errors=0, force=False):
+        update(self, count, errors, force)
+        if self.done >= 6 and not force:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(bulk_extract.Progress, "update", interrupting_update)
+    output_path = str(tmp_path / "out.jsonl")
+    summary = run_bulk(documents, output_path, "simple", workers=1, chunk_size=3)
+    assert summary["interrupted"] and summary["completed"] == 6
+    checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        assert json.load(f)["completed"] == 6
+    monkeypatch.setattr(bulk_extract.Progress, "update", update)
+
+    # Ligne à moitié écrite après le point de reprise: retirée à la reprise
+    with open(output_path, "a", encoding="utf-8") as f:
+        f.write('{"id": "doc06.txt", "entit')
+
+    # Une autre liste de documents ne reprend pas ce point de reprise
+    with pytest.raises(ValueError):
+        run_bulk(documents[:-1], output_path, "simple", workers=1, chunk_size=3, resume=True)
+
+    summary = run_bulk(documents, output_path, "simple", workers=1, chunk_size=3, resume=True)
+    assert (summary["resumed_from"], summary["completed"], summary["interrupted"]) == (6, 10, False)
+    assert read_output(output_path) == expected
+    assert not os.path.exists(checkpoint_path)
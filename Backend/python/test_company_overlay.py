@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""Tests des surcouches par entreprise (identifiants, cache LRU borné en octets, clés du cache des résultats)"""
+
+import json
+import os
+
+import pytest
+
+from company_overlay import (OVERLAY_FILE, OverlayCache, add_pattern, cache_kind, company_dir, get_overlay,
+                             set_threshold)
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    root = str(tmp_path)
+    for company_id in ("alpha", "beta", "gamma"):
+        add_pattern(company_id, "reference", r"BL-(\d+)", root)
+    return root
+
+
+@pytest.mark.parametrize("company_id", ["../alpha", "a/b", "", "a" * 65, "é", 42, None])
+def test_company_dir_rejects_unsafe_ids(company_id):
+    with pytest.raises(ValueError):
+        company_dir(company_id)
+
+
+def test_company_dir_accepts_object_ids(tmp_path):
+    assert company_dir("64b7f0c2e1a9d3f4a5b6c7d8", str(tmp_path)).endswith(
+        os.path.join("companies", "64b7f0c2e1a9d3f4a5b6c7d8"))
+
+
+def test_least_recently_used_overlay_is_evicted_first(models_dir):
+    size = get_overlay("alpha", models_dir).size
+    cache = OverlayCache(max_bytes=2 * size + size // 2)
+    cache.get("alpha", models_dir)
+    cache.get("beta", models_dir)
+    cache.get("alpha", models_dir)
+    cache.get("gamma", models_dir)
+    assert [company_id for _, company_id in cache._items] == ["alpha", "gamma"]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_newest_overlay_is_kept_over_budget(models_dir):
+    cache = OverlayCache(max_bytes=1)
+    cache.get("alpha", models_dir)
+    overlay = cache.get("beta", models_dir)
+    assert [company_id for _, company_id in cache._items] == ["beta"]
+    assert cache.stats()["bytes"] == overlay.size > cache.max_bytes
+
+
+def test_hits_misses_and_reload_on_change(models_dir):
+    cache = OverlayCache()
+    first = cache.get("alpha", models_dir)
+    assert cache.get("alpha", models_dir) is first
+    assert cache.get("alpha", models_dir, check=True) is first
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 1)
+
+    # Fichier réécrit par un autre processus: rechargé à la vérification suivante
+    path = os.path.join(company_dir("alpha", models_dir), OVERLAY_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"patterns": {"reference": [r"BL-(\d+)", r"BON-(\d+)"]}, "thresholds": {}}, f)
+    reloaded = cache.get("alpha", models_dir, check=True)
+    assert reloaded is not first
+    assert reloaded.patterns["reference"] == [r"BL-(\d+)", r"BON-(\d+)"]
+    assert reloaded.version != first.version
+    assert cache.stats()["misses"] == 2
+
+
+def test_threshold_validation(models_dir):
+    assert set_threshold("alpha", "montantHT", 0.8, models_dir).threshold("montantHT") == 0.8
+    with pytest.raises(ValueError):
+        set_threshold("alpha", "montantHT", 1.5, models_dir)
+    with pytest.raises(ValueError):
+        set_threshold("alpha", "inconnu", 0.5, models_dir)
+
+
+def test_each_company_keeps_its_cached_results(models_dir, tmp_path):
+    alpha, beta = get_overlay("alpha", models_dir), get_overlay("beta", models_dir)
+    assert cache_kind("simple") == "simple"
+    assert cache_kind("simple", alpha) == "simple@alpha"
+
+    # Le cache ne garde qu'une version par type: un type par entreprise évite qu'elles s'évincent
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"))
+    result = {"entities": {"reference": "BL-1"}}
+    cache.put("BL-1", cache_kind("simple", alpha), "rules-a", result)
+    cache.put("BL-1", cache_kind("simple", beta), "rules-b", result)
+    assert cache.get("BL-1", cache_kind("simple", alpha), "rules-a")[0] == result
+    assert cache.stats()["invalidations"] == 0
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du classifieur du type de document et du repli sur tous les patterns"""
+
+import os
+
+from document_classifier import (CLASSIFIER_FILE, MIN_FEEDBACK_EXAMPLES, DocumentClassifier, add_examples,
+                                 ensure_classifier, get_classifier, train_classifier)
+from invoice_corpus import generate_corpus
+from simple_invoice_parser import PATTERNS, TYPE_PATTERNS, TYPE_PATTERN_SETS, extract_entities
+
+RECEIPT = "TICKET DE CAISSE N° 48213\nMagasin Central\nDate: 05/06/2024\nTotal TTC: 23,500 DT\nMerci"
+
+
+def test_missing_model_is_not_trained_in_the_request_path(tmp_path):
+    result = get_classifier(str(tmp_path)).classify(RECEIPT)
+    assert not os.path.exists(os.path.join(str(tmp_path), CLASSIFIER_FILE))
+    assert result["type"] is None and result["trained_on"] is None
+
+
+def test_synthetic_only_model_predicts_but_does_not_route(tmp_path):
+    classifier = ensure_classifier(str(tmp_path))
+    assert os.path.exists(os.path.join(str(tmp_path), CLASSIFIER_FILE))
+    result = classifier.classify(RECEIPT)
+    assert result["trained_on"] == "synthetic"
+    assert result["predicted"] == "receipt"
+    assert result["type"] is None
+
+
+def test_feedback_trained_model_routes_confident_documents(tmp_path):
+    models_dir = str(tmp_path)
+    samples = [(document["text"], {"cats": {document["kind"]: 1.0}})
+               for document in generate_corpus(40, seed=11, kinds=("receipt", "invoice"))]
+    assert add_examples(samples, models_dir) == 40
+    train_classifier(models_dir, seed_count=200)
+    result = get_classifier(models_dir).classify(RECEIPT)
+    assert result["trained_on"] == "feedback"
+    assert result["type"] == "receipt"
+    saved = DocumentClassifier.load(os.path.join(models_dir, CLASSIFIER_FILE))
+    assert saved.feedback_counts == get_classifier(models_dir).feedback_counts
+
+
+def test_few_feedback_examples_do_not_route(tmp_path):
+    models_dir = str(tmp_path)
+    receipts = [document for document in generate_corpus(80, seed=11, kinds=("receipt", "invoice"))
+                if document["kind"] == "receipt"]
+    samples = [(document["text"], {"cats": {"receipt": 1.0}}) for document in receipts[:MIN_FEEDBACK_EXAMPLES]]
+
+    add_examples(samples[:1], models_dir)
+    train_classifier(models_dir, seed_count=200)
+    result = get_classifier(models_dir).classify(RECEIPT)
+    assert result["trained_on"] == "synthetic"
+    assert result["predicted"] == "receipt" and result["type"] is None
+
+    add_examples(samples[1:], models_dir)
+    train_classifier(models_dir, seed_count=200)
+    assert get_classifier(models_dir).classify(RECEIPT)["type"] == "receipt"
+    # Un type sans assez de feedbacks ne choisit toujours pas les patterns
+    invoice = next(document["text"] for document in generate_corpus(10, seed=5) if document["kind"] == "invoice")
+    result = get_classifier(models_dir).classify(invoice)
+    assert result["predicted"] == "invoice" and result["type"] is None
+
+
+def test_unknown_type_uses_the_union_of_all_pattern_sets():
+    union = TYPE_PATTERN_SETS[None]
+    for family, patterns in PATTERNS.items():
+        assert union[family][:len(patterns)] == patterns
+    for type_patterns in TYPE_PATTERNS.values():
+        for family, patterns in type_patterns.items():
+            assert set(patterns) <= set(union[family])
+
+
+def test_receipt_fields_are_kept_without_a_trusted_type():
+    # Classifieur non appris (MODELS_DIR temporaire des tests): patterns de tous les types
+    entities = extract_entities(RECEIPT)["entities"]
+    assert entities["reference"] == "48213"
+    assert entities["montantTTC"] == "23.500"
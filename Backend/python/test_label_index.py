@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'index approximatif des libellés (variantes par suppression, SymSpell)"""
+
+import random
+
+import pytest
+
+from label_index import (FIELD_LABELS, FuzzyLabelIndex, allowed_distance, bounded_distance, extract_values,
+                         find_anchors, fold)
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j - 1] + (a[i - 1] != b[j - 1]), previous[j] + 1, current[j - 1] + 1)
+        previous = current
+    return previous[-1]
+
+
+def test_bounded_distance_matches_levenshtein():
+    rng = random.Random(1)
+    for _ in range(500):
+        a = "".join(rng.choice("abc") for _ in range(rng.randint(0, 9)))
+        b = "".join(rng.choice("abc") for _ in range(rng.randint(0, 9)))
+        exact = levenshtein(a, b)
+        for limit in (0, 1, 2):
+            assert bounded_distance(a, b, limit) == (exact if exact <= limit else None), (a, b, limit)
+
+
+def test_fold_removes_case_accents_spaces_and_ocr_digits():
+    assert fold("Mont4nt  HT") == "montantht"
+    assert fold("Référence") == "reference"
+    assert fold("T0tal") == "total"
+
+
+def test_allowed_distance_grows_with_label_length():
+    assert allowed_distance("tva") == 0
+    assert allowed_distance("montant") == 1
+    assert allowed_distance("nomdedestinataire") == 2
+
+
+@pytest.mark.parametrize("text, field", [
+    ("TotalenTTC: 1190,00", "montantTTC"),
+    ("NOMDEDESTINATAIRE: ALI BEN SALAH", "vendor"),
+    ("Fourniseur: SOCIETE ALPHA", "vendor"),
+    ("Mont4nt HT 1000,00", "montantHT"),
+])
+def test_damaged_labels_are_found(text, field):
+    anchors = find_anchors(text)
+    assert anchors and anchors[0].field == field
+
+
+def test_short_labels_must_be_exact():
+    assert [anchor.field for anchor in find_anchors("TVB 190,00")] == []
+    assert [anchor.field for anchor in find_anchors("TVA 190,00")] == ["tva"]
+
+
+def test_lookup_matches_brute_force_over_all_labels():
+    index = FuzzyLabelIndex()
+    keys = list(index.keys)
+    rng = random.Random(2)
+    for _ in range(300):
+        key = rng.choice(keys)
+        # Une ou deux modifications aléatoires du libellé replié
+        word = list(key)
+        for _ in range(rng.randint(1, 2)):
+            position = rng.randrange(len(word) + 1)
+            operation = rng.choice(("delete", "insert", "replace"))
+            if operation == "delete" and position < len(word):
+                del word[position]
+            elif operation == "insert":
+                word.insert(position, rng.choice("abcdexyz"))
+            elif position < len(word):
+                word[position] = rng.choice("abcdexyz")
+        folded = "".join(word)
+        if not folded:
+            continue
+
+        candidates = [(levenshtein(folded, candidate), candidate) for candidate in keys]
+        candidates = [(distance, candidate) for distance, candidate in candidates
+                      if distance <= allowed_distance(candidate)]
+        found = index.lookup(folded)
+        if not candidates:
+            assert found is None, folded
+            continue
+        best = min(distance for distance, _ in candidates)
+        fields = {index.keys[candidate][0] for distance, candidate in candidates if distance == best}
+        if len(fields) > 1:
+            assert found is None, folded
+        else:
+            assert found is not None and found[0] == best and index.keys[found[1]][0] in fields, folded
+
+
+def test_longest_label_wins_and_values_stop_at_next_label():
+    values = extract_values("Date facture: 12/03/2024 Total TTC: 1 190,00 DT\nTVA 19% 190,00 DT")
+    assert values["date"]["value"] == "2024-03-12"
+    assert values["montantTTC"]["value"] == "1190.00"
+    assert values["montantTTC"]["label"] == "Total TTC"
+    assert values["tva"]["value"] == "190.00"
+
+
+def test_every_known_label_finds_itself():
+    for field, labels in FIELD_LABELS.items():
+        for label in labels:
+            anchors = find_anchors(label)
+            assert anchors, label
+            assert anchors[0].distance == 0
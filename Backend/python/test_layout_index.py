@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'index spatial et de l'extraction selon la mise en page"""
+
+import random
+
+from layout_index import LayoutDocument, SpatialIndex, Word, read_tsv
+
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+
+
+def line(texts_and_lefts, top, line_num, height=20, page=1):
+    """Mots d'une ligne visuelle: [(texte, gauche), ...]"""
+    return [Word(text, left, top, left + 12 * len(text), top + height, page, (page, 1, 1, line_num), 95.0)
+            for text, left in texts_and_lefts]
+
+
+def brute_right_of(words, box, page):
+    left, top, right, bottom = box
+    best, best_distance = None, None
+    for index, word in enumerate(words):
+        distance = word.left - right
+        if word.page != page or word.left <= left or distance < -10:
+            continue
+        overlap = min(word.bottom, bottom) - max(word.top, top)
+        if overlap < 0.5 * min(word.bottom - word.top, bottom - top):
+            continue
+        if best is None or distance < best_distance:
+            best, best_distance = index, distance
+    return best_distance
+
+
+def test_read_tsv_keeps_only_words():
+    content = "\n".join([
+        TSV_HEADER,
+        "4\t1\t1\t1\t1\t0\t10\t10\t200\t20\t-1\t",
+        "5\t1\t1\t1\t1\t1\t10\t10\t60\t20\t96.5\tTotal",
+        "5\t1\t1\t1\t1\t2\t80\t10\t40\t20\t91\tTTC",
+    ])
+    words = read_tsv(content)
+    assert [word.text for word in words] == ["Total", "TTC"]
+    assert words[1].right == 120 and words[1].line == (1, 1, 1, 1)
+
+
+def test_right_of_matches_brute_force():
+    rng = random.Random(7)
+    words = []
+    for row in range(40):
+        lefts = sorted(rng.sample(range(0, 2000, 10), 6))
+        words += line([(f"w{row}_{i}", left) for i, left in enumerate(lefts)], row * 25 + rng.randint(0, 3), row)
+    index = SpatialIndex(words)
+    for word in words:
+        box = (word.left, word.top, word.right, word.bottom)
+        found = index.right_of(box, 1)
+        expected = brute_right_of(words, box, 1)
+        assert (None if found is None else words[found].left - word.right) == expected
+
+
+def test_value_across_other_columns_on_the_same_line():
+    words = (line([("FACTURE", 10), ("N°", 110), ("FA2024-0042", 150)], 10, 1)
+             + line([("Désignation", 10), ("Qté", 400), ("Prix", 600)], 60, 2)
+             + line([("Montant", 10), ("HT", 110), ("Remise", 400), ("néant", 500), ("1000,000", 700), ("DT", 820)], 110, 3)
+             + line([("Montant", 10), ("TTC", 110), ("1190,000", 700), ("DT", 820)], 160, 4))
+    fields = LayoutDocument(words).extract_fields()
+    assert fields["reference"]["value"] == "FA2024-0042"
+    assert fields["montantHT"]["value"] == "1000.000"
+    assert fields["montantHT"]["relation"] == "right"
+    assert fields["montantTTC"]["value"] == "1190.000"
+
+
+def test_value_below_label_and_in_the_same_word():
+    words = (line([("Fournisseur", 10)], 10, 1)
+             + line([("SOCIETE", 10), ("ALPHA", 110)], 40, 2)
+             + line([("Date:2020-11-25", 10)], 100, 3))
+    fields = LayoutDocument(words).extract_fields()
+    assert fields["vendor"]["value"] == "SOCIETE ALPHA"
+    assert fields["vendor"]["relation"] == "below"
+    assert fields["date"]["value"] == "2020-11-25"
+    assert fields["date"]["relation"] == "same_word"
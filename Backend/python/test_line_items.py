@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'extraction des lignes d'articles (colonnes alignées, lecture ligne à ligne, mots Tesseract)"""
+
+from layout_index import Word
+from line_items import extract_line_items, normalized_tokens, text_tokens, word_gap, word_tokens
+from text_normalizer import normalize_text
+
+ALIGNED = """FACTURE FA2024-0042
+Désignation          Qté     PU HT       Total HT
+Écran 24 pouces        3    1 319,73    3 959,19
+Clavier sans fil      10       25,50      255,00
+Souris                 2        9,90       19,80
+Total HT                                4 233,99
+TVA 19%                                   804,46"""
+
+IRREGULAR = """Désignation Qté PU Total
+Câble HDMI REF 4471 4 12,500 50,000
+Onduleur 1 1 103,361 1 103,361
+Total HT 1 153,361"""
+
+
+def rows(result):
+    return [(item["designation"], item["quantite"], item["prixUnitaireHT"], item["montantHT"], item["coherent"])
+            for item in result["items"]]
+
+
+def test_aligned_columns_rebuild_thousands_and_stop_at_totals():
+    result = extract_line_items(text_tokens(ALIGNED), montant_ht="4 233,99")
+    assert result["method"] == "columns"
+    assert rows(result) == [
+        ("Écran 24 pouces", "3", "1319.73", "3959.19", True),
+        ("Clavier sans fil", "10", "25.50", "255.00", True),
+        ("Souris", "2", "9.90", "19.80", True),
+    ]
+    assert result["total"] == "4233.99"
+    assert result["matches_ht"] is True
+    assert extract_line_items(text_tokens(ALIGNED), montant_ht="5000,00")["matches_ht"] is False
+
+
+def test_irregular_spacing_is_read_right_to_left():
+    result = extract_line_items(text_tokens(IRREGULAR), montant_ht="1153,361", currency="TND")
+    assert result["method"] == "tokens"
+    # La référence non utilisée reste dans la désignation; le découpage qui explique
+    # tous les nombres l'emporte sur 103,361 × 1
+    assert rows(result) == [
+        ("Câble HDMI REF 4471", "4", "12.500", "50.000", True),
+        ("Onduleur", "1", "1103.361", "1103.361", True),
+    ]
+    assert result["matches_ht"] is True
+
+
+def test_incoherent_row_is_flagged():
+    text = "Désignation Qté PU Total\nPapier A4 5 4,20 25,00\nStylos 2 1,50 3,00"
+    result = extract_line_items(text_tokens(text))
+    assert [item["coherent"] for item in result["items"]] == [False, True]
+
+
+def test_documents_without_item_rows():
+    assert extract_line_items(text_tokens("Facture\nTotal HT 100,00\nTVA 19,00")) is None
+    assert extract_line_items([]) is None
+
+
+def test_normalized_tokens_keep_original_columns():
+    # La normalisation réduit les espaces: les colonnes se lisent aux positions d'origine
+    normalized = normalize_text(ALIGNED.replace("Clavier sans fil  ", "Clavier  sans  fil"))
+    assert extract_line_items(text_tokens(normalized.text))["method"] == "tokens"
+    result = extract_line_items(normalized_tokens(normalized), montant_ht="4 233,99")
+    assert result["method"] == "columns"
+    assert rows(result)[1] == ("Clavier sans fil", "10", "25.50", "255.00", True)
+    assert result["matches_ht"] is True
+
+
+def test_tesseract_column_blocks_are_regrouped_into_lines():
+    # Tesseract rend les colonnes en blocs: les mots d'une ligne ont des hauts décalés
+    cells = [
+        ("Désignation", 10), ("Qté", 200), ("Prix", 300), ("Total", 420),
+        ("Chaise", 10), ("4", 200), ("35,000", 300), ("140,000", 420),
+        ("Table", 10), ("1", 200), ("210,000", 300), ("210,000", 420),
+    ]
+    words = []
+    for index, (text, left) in enumerate(cells):
+        top = 100 + 30 * (index // 4) + (3 if left > 100 else 0)
+        words.append(Word(text, left, top, left + 12 * len(text), top + 20, 1, 0, 95.0))
+    tokens = word_tokens(words)
+    assert [token.line for token in tokens] == [1] * 4 + [2] * 4 + [3] * 4
+
+    result = extract_line_items(tokens, montant_ht="350,000", currency="TND", min_gap=word_gap(words))
+    assert result["method"] == "columns"
+    assert rows(result) == [
+        ("Chaise", "4", "35.000", "140.000", True),
+        ("Table", "1", "210.000", "210.000", True),
+    ]
+    assert result["matches_ht"] is True
+
+
+def test_standalone_currency_tokens_are_skipped():
+    # Exemple du parser adaptatif (adaptive_invoice_parser, __main__)
+    text = """
+    FACTURE N° F-12345
+    Description                   Quantité   Prix unitaire   Total HT
+    ----------------------------------------------------------------
+    Consultation                     10        100,00 €      1000,00 €
+    Développement                    20        150,00 €      3000,00 €
+    ----------------------------------------------------------------
+    Total HT                                              4000,00 €
+    TVA 20%                                                800,00 €
+    """
+    result = extract_line_items(text_tokens(text), montant_ht="4000,00")
+    assert rows(result) == [
+        ("Consultation", "10", "100.00", "1000.00", True),
+        ("Développement", "20", "150.00", "3000.00", True),
+    ]
+    assert result["matches_ht"] is True
+    result = extract_line_items(text_tokens("Désignation Qté PU Total\nCâble 2 12,500 DT 25,000 DT\nTotal 25,000"))
+    assert rows(result) == [("Câble", "2", "12.500", "25.000", True)]
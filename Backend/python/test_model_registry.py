@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du registre des versions du modèle"""
+
+import os
+
+import spacy
+
+from model_registry import ModelRegistry, active_model_path, load_language
+
+
+def test_publish_writes_only_the_spacy_directory(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    version, path = registry.publish(spacy.blank("fr"), {"patterns": {}})
+    assert active_model_path(str(tmp_path)) == path
+    assert os.path.basename(path) == f"invoice_model_v{version}"
+    assert not os.path.exists(os.path.join(path, "pipeline.bin"))
+    assert os.path.exists(os.path.join(path, "config.cfg"))
+
+
+def test_shared_pipelines_come_from_the_cache(tmp_path):
+    _, path = ModelRegistry(str(tmp_path)).publish(spacy.blank("fr"), {"patterns": {}})
+    shared = load_language(path)
+    assert load_language(path) is shared
+    assert load_language(path, shared=False) is not shared
+
+
+def test_rollback_restores_previous_version(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    first, first_path = registry.publish(spacy.blank("fr"), {"patterns": {}})
+    second, _ = registry.publish(spacy.blank("fr"), {"patterns": {}})
+    assert registry.active_version() == second
+    registry.rollback()
+    assert registry.active_version() == first
+    assert active_model_path(str(tmp_path)) == first_path
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du protocole du serveur résident (requêtes JSON Lines, réponses par identifiant)"""
+
+import io
+import json
+
+import pytest
+
+import parser_server
+from parser_server import ParserServer, decode_request, serve_stdio
+
+INVOICE = """FACTURE N° FAC-2024-0042
+Date: 12/03/2024
+Fournisseur: SOCIETE ALPHA SARL
+Montant HT: 1 000,00 DT
+TVA 19%: 190,00 DT
+Montant TTC: 1 190,00 DT
+"""
+
+
+@pytest.fixture(scope="module")
+def server():
+    return ParserServer(train_worker=False)
+
+
+def test_ping_keeps_request_id(server):
+    assert server.handle({"id": "7", "op": "ping"}) == {"id": "7", "ok": True, "result": {"pong": True}}
+
+
+def test_unknown_operation_is_an_error_response(server):
+    response = server.handle({"id": "8", "op": "nope"})
+    assert response["id"] == "8"
+    assert response["ok"] is False
+    assert "nope" in response["error"]
+
+
+def test_non_object_request_is_rejected(server):
+    response = server.handle(["extract"])
+    assert response == {"id": None, "ok": False, "error": "La requête doit être un objet JSON"}
+
+
+def test_decode_request_reports_invalid_json():
+    request, error = decode_request("{pas du json")
+    assert request is None
+    assert error["id"] is None and error["ok"] is False
+    assert error["error"].startswith("JSON invalide")
+
+
+def test_extract_simple_text(server):
+    response = server.handle({"id": "9", "op": "extract", "parser": "simple", "text": INVOICE})
+    assert response["ok"], response
+    assert response["result"]["entities"]["montantTTC"] == "1190.00"
+
+
+def test_extract_rejects_empty_text(server):
+    response = server.handle({"id": "10", "op": "extract", "parser": "simple", "text": "  "})
+    assert response["ok"] is False
+
+
+def test_feedback_requires_all_keys(server):
+    response = server.handle({"id": "11", "op": "feedback", "text": INVOICE})
+    assert response["ok"] is False
+    assert "original" in response["error"] and "corrected" in response["error"]
+
+
+def test_stats_counts_requests(server):
+    before = server.handle({"id": "12", "op": "stats"})["result"]["requests"]
+    server.handle({"id": "13", "op": "ping"})
+    after = server.handle({"id": "14", "op": "stats"})["result"]
+    assert after["requests"] == before + 2
+    assert "model_version" in after
+
+
+def test_serve_stdio_answers_each_line_with_its_id(server, monkeypatch):
+    lines = [json.dumps({"id": str(i), "op": "ping"}) for i in range(5)] + ["{cassé"]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines) + "\n"))
+    output = io.StringIO()
+    serve_stdio(server, 2, output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    by_id = {response["id"]: response for response in responses}
+    assert {str(i) for i in range(5)} <= set(by_id)
+    assert all(by_id[str(i)]["result"] == {"pong": True} for i in range(5))
+    assert by_id[None]["ok"] is False
+
+
+def test_shutdown_is_confirmed_after_pending_requests(server, monkeypatch):
+    lines = [json.dumps({"id": "a", "op": "ping"}), json.dumps({"id": "b", "op": "shutdown"}),
+             json.dumps({"id": "c", "op": "ping"})]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines) + "\n"))
+    output = io.StringIO()
+    serve_stdio(server, 1, output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [response["id"] for response in responses] == ["a", "b"]
+    assert responses[-1]["result"] == {"shutdown": True}
+
+
+def test_training_runs_outside_the_serving_process(server, monkeypatch):
+    assert server.training_worker is None
+    spawned = []
+    monkeypatch.setattr(parser_server, "spawn_background_training", lambda: spawned.append(True))
+    monkeypatch.setattr(server.training_queue, "pending_count", lambda: parser_server.TRAINING_THRESHOLD - 1)
+    request = {"id": "12", "op": "feedback", "text": INVOICE, "original": {},
+               "corrected": {"montant_ttc": "1 190,00 DT"}}
+    response = server.handle(request)
+    assert response["ok"], response
+    assert response["result"]["queued"] and response["result"]["training_started"] is False
+
+    monkeypatch.setattr(server.training_queue, "pending_count", lambda: parser_server.TRAINING_THRESHOLD)
+    assert server.handle(request)["result"]["training_started"] is True
+    assert spawned == [True]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du registre de patterns partagé"""
+
+import pattern_registry
+from pattern_registry import PatternRegistry, get_registry, patterns_fingerprint
+from adaptive_invoice_parser import AdaptiveInvoiceParser, DEFAULT_PATTERNS
+
+FAMILIES = {"REFERENCE": [r"[Ff]acture\s*n°\s*([A-Z0-9-]+)"], "DATE": [r"(\d{2}/\d{2}/\d{4})"]}
+
+
+def test_same_patterns_share_one_registry():
+    registry = get_registry(dict(FAMILIES))
+    assert get_registry(dict(FAMILIES)) is registry
+    assert registry.fingerprint == patterns_fingerprint(FAMILIES)
+
+
+def test_scan_returns_first_match_per_family():
+    scan = PatternRegistry(FAMILIES).scan("Facture n° FAC-12 du 01/02/2024")
+    assert scan.first("REFERENCE").value == "FAC-12"
+    assert scan.first("DATE").value == "01/02/2024"
+
+
+def test_parser_keeps_its_registry_between_documents(monkeypatch):
+    parser = AdaptiveInvoiceParser()
+    assert parser.registry is get_registry(DEFAULT_PATTERNS)
+
+    # Aucune empreinte n'est recalculée pendant l'extraction
+    def fail(families):
+        raise AssertionError("empreinte recalculée pendant l'extraction")
+    monkeypatch.setattr(pattern_registry, "patterns_fingerprint", fail)
+    for _ in range(3):
+        parser.extract_entities("Facture N° FAC-2024-001\nDate: 12/03/2024\nTotal TTC: 119,00 DT")
+
+
+def test_new_patterns_rebuild_the_registry():
+    parser = AdaptiveInvoiceParser()
+    before = parser.registry
+    parser.patterns = {**parser.patterns, "REFERENCE": [r"BON\s+(\d+)"]}
+    assert parser.registry is not before
+    assert parser.registry.families["REFERENCE"] == [r"BON\s+(\d+)"]
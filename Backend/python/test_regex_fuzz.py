@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de la garde contre le retour arrière catastrophique (banc d'entrées adverses, budget par document)"""
+
+import os
+
+import pytest
+
+import pattern_registry
+import simple_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from company_overlay import add_pattern, company_dir
+from pattern_registry import TimeBudget
+from regex_fuzz import FUZZ_MAX_MS, check_pattern, run_fuzz
+
+# Entrées plus courtes que FUZZ_SIZE pour garder la suite rapide: un pattern quadratique
+# y dépasse déjà largement FUZZ_MAX_MS
+TEST_FUZZ_SIZE = 4000
+
+TEXT = "Facture FA2024-0042\nDate: 12/03/2024\nTotal HT: 1 000,00 DT\nTVA 19%: 190,00 DT\nTotal TTC: 1 190,00 DT"
+
+
+@pytest.mark.parametrize("source", [r"(a+)+$", r"(\d+\s?)+$", r"total\s*(.*?)\s*(.*?)€"])
+def test_check_pattern_rejects_backtracking(source):
+    with pytest.raises(ValueError, match="retour arrière"):
+        check_pattern(source)
+
+
+def test_check_pattern_accepts_linear_patterns():
+    check_pattern(r"BL-(\d+)")
+    check_pattern(r"total\s+ttc\s*:?\s*(\d[\d\s.,]*)")
+
+
+def test_company_overlay_refuses_slow_pattern(tmp_path):
+    with pytest.raises(ValueError):
+        add_pattern("acme", "reference", r"(\w+\s?)+$", str(tmp_path))
+    assert not os.path.exists(company_dir("acme", str(tmp_path)))
+
+
+def test_budget_stops_simple_rules_and_reports_skipped_patterns():
+    result = simple_invoice_parser.extract_entities(TEXT, budget=TimeBudget(1e-6))
+    assert "entities" in result
+    assert result["budget"]["budget_ms"] == 1e-6
+    assert result["budget"]["skipped"]
+
+    assert "budget" not in simple_invoice_parser.extract_entities(TEXT, budget=TimeBudget(0))
+
+
+def test_budget_stops_adaptive_rules(monkeypatch):
+    monkeypatch.setattr(pattern_registry, "REGEX_BUDGET_MS", 1e-6)
+    result = AdaptiveInvoiceParser().extract_entities(TEXT)
+    assert result["budget"]["skipped"]
+
+
+def test_registered_patterns_stay_under_latency_bound():
+    report = run_fuzz(size=TEST_FUZZ_SIZE)
+    assert report["patterns"] > 0
+    assert report["failures"] == [], report["failures"]
+    assert report["slowest"][0]["worst_ms"] <= FUZZ_MAX_MS
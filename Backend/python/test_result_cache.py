@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du cache des résultats (mémoire puis SQLite, une version par parser)"""
+
+import adaptive_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from result_cache import ResultCache, cache_key, cached_extract
+
+TEXT = "Facture FA2024-0042\nTotal TTC 119,00 €"
+RESULT = {"entities": {"reference": "FA2024-0042"}, "processing_time": 0.2, "timings": {}}
+
+
+def test_key_ignores_line_endings_and_trailing_spaces():
+    assert cache_key("Total TTC 119  \r\nTVA\r\n\n", "simple", "v1") == cache_key("Total TTC 119\nTVA", "simple", "v1")
+    assert cache_key("Total  TTC", "simple", "v1") != cache_key("Total TTC", "simple", "v1")
+    assert cache_key(TEXT, "simple", "v1") != cache_key(TEXT, "adaptive", "v1")
+
+
+def test_memory_then_disk_hits(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path)
+    assert cache.get(TEXT, "simple", "v1") == (None, None)
+    cache.put(TEXT, "simple", "v1", RESULT)
+    assert cache.get(TEXT, "simple", "v1") == ({"entities": {"reference": "FA2024-0042"}}, "memory")
+
+    # Un autre processus ne voit que la base SQLite
+    other = ResultCache(path)
+    assert other.get(TEXT, "simple", "v1")[1] == "disk"
+    assert other.get(TEXT, "simple", "v1")[1] == "memory"
+    assert other.stats()["hit_rate"] == 1.0
+
+
+def test_new_version_invalidates_previous_results(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path)
+    cache.put(TEXT, "adaptive", "v1", RESULT)
+    assert cache.get(TEXT, "adaptive", "v2") == (None, None)
+    assert ResultCache(path).get(TEXT, "adaptive", "v1") == (None, None)
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_failed_or_truncated_results_are_not_kept(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"))
+    cache.put(TEXT, "simple", "v1", {"error": "boom"})
+    cache.put(TEXT + " budget", "simple", "v1", {"entities": {}, "budget": {"skipped": ["date"]}})
+    assert cache.get(TEXT, "simple", "v1") == (None, None)
+    assert cache.get(TEXT + " budget", "simple", "v1") == (None, None)
+
+
+def test_disk_size_is_bounded(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"), memory_size=2, max_bytes=2000)
+    for i in range(50):
+        cache.put(f"document {i}", "simple", "v1", {"entities": {"text": "x" * 100}})
+    assert cache.stats()["disk_bytes"] <= 2000
+    assert cache.stats()["evictions"] > 0
+    assert cache.get("document 49", "simple", "v1")[0] is not None
+
+
+def test_cached_extract_without_cache_calls_extract():
+    # RESULT_CACHE=false pendant les tests (conftest)
+    calls = []
+    assert cached_extract(TEXT, "simple", "v1", lambda text: calls.append(text) or {"ok": 1}) == {"ok": 1}
+    assert calls == [TEXT]
+
+
+def test_adaptive_cache_version_follows_rule_changes(monkeypatch):
+    parser = AdaptiveInvoiceParser()
+    before = parser.cache_version
+    monkeypatch.setattr(adaptive_invoice_parser, "RULES_VERSION", "rules-changed")
+    assert parser.cache_version != before
+    monkeypatch.undo()
+    parser.patterns = {**parser.patterns, "REFERENCE": [r"BON\s+(\d+)"]}
+    assert parser.cache_version != before
+
+
+def test_offsets_are_dropped_for_another_raw_text(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    raw = "\r\nFacture FA2024-0042  \r\nFournisseur: Ben Salah Export\r\n"
+    clean = "Facture FA2024-0042\nFournisseur: Ben Salah Export"
+    start = raw.index("Ben")
+    result = {"entities": {"vendor": [{"value": "Ben Salah Export", "start": start, "end": start + 16}]},
+              "raw_results": {"labels": {"vendor": {"value": "Ben Salah Export", "start": start}}}}
+    cache = ResultCache(path)
+    cache.put(raw, "adaptive", "v1", result)
+
+    # Même texte brut: positions conservées, dans les deux niveaux
+    assert cache.get(raw, "adaptive", "v1") == (result, "memory")
+    assert ResultCache(path).get(raw, "adaptive", "v1") == (result, "disk")
+
+    # Même texte normalisé mais positions différentes: le résultat sert, sans les positions
+    for other in (cache, ResultCache(path)):
+        cached, _ = other.get(clean, "adaptive", "v1")
+        assert cached == {"entities": {"vendor": [{"value": "Ben Salah Export"}]},
+                          "raw_results": {"labels": {"vendor": {"value": "Ben Salah Export"}}}}
+    assert cache.get(raw, "adaptive", "v1")[0] == result
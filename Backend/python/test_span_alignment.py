@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de l'alignement des valeurs corrigées et du calage sur les jetons spaCy"""
+
+import warnings
+
+import spacy
+
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from span_alignment import align_entities, snap_to_tokens
+
+TEXT = "Facture FA2024-0042\nDate: 12/03/2024\nTVA 19%: 190,00\nTotal TTC: 1 190,00\nCODEFA2024XYZ 552,685TND"
+
+
+def test_align_prefers_occurrence_after_the_field_label():
+    text = "Ref 19\nTVA 19%: 19,00\nTaux: 19"
+    spans, dropped = align_entities(text, [("TVA", "19.00")])
+    assert dropped == []
+    assert text[spans[0][0]:spans[0][1]] == "19,00"
+
+
+def test_align_reports_missing_and_overlapping_values():
+    spans, dropped = align_entities(TEXT, [("MONTANT_TTC", "1190.00"), ("VENDOR", "Absent SARL")])
+    assert TEXT[spans[0][0]:spans[0][1]] == "1 190,00"
+    assert dropped == [{"label": "VENDOR", "value": "Absent SARL", "reason": "not_found"}]
+
+
+def test_snap_expands_glued_currency_and_drops_misaligned_spans():
+    doc = spacy.blank("fr").make_doc(TEXT)
+    amount_start = TEXT.index("552,685")
+    code_start = TEXT.index("FA2024XYZ")
+    spans, misaligned = snap_to_tokens(doc, [
+        (amount_start, amount_start + len("552,685"), "MONTANT_TTC"),
+        (code_start, code_start + 6, "REFERENCE"),
+    ])
+    assert misaligned == 1
+    assert [(span.text, span.label_) for span in spans] == [("552,685TND", "MONTANT_TTC")]
+
+
+def test_in_memory_training_snaps_spans_without_spacy_warnings(tmp_path):
+    amount_start = TEXT.index("552,685")
+    code_start = TEXT.index("FA2024XYZ")
+    parser = AdaptiveInvoiceParser()
+    parser.training_data = [(TEXT, {"entities": [
+        (TEXT.index("FA2024-0042"), TEXT.index("FA2024-0042") + 11, "REFERENCE"),
+        (amount_start, amount_start + len("552,685"), "MONTANT_TTC"),
+        (code_start, code_start + 6, "REFERENCE"),
+    ]})]
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        result = parser.train(iterations=2, models_dir=str(tmp_path))
+    assert result["status"] == "success"
+    assert result["training"]["misaligned_entities"] == 1
+    assert not [warning for warning in caught if "W030" in str(warning.message)]
+
+
+def test_value_after_another_number_is_aligned():
+    # Les espaces retirés par la normalisation séparent bien deux nombres
+    text = "Souris 2 9,90 19,80"
+    spans, dropped = align_entities(text, [("MONTANT_HT", "19.80")])
+    assert dropped == [] and text[spans[0][0]:spans[0][1]] == "19,80"
+    text = "TVA 19 190,00"
+    spans, dropped = align_entities(text, [("TVA", "190.00")])
+    assert dropped == [] and text[spans[0][0]:spans[0][1]] == "190,00"
+
+
+def test_value_inside_a_number_is_not_aligned():
+    spans, dropped = align_entities("Date 2019", [("TVA", "19")])
+    assert spans == [] and dropped[0]["reason"] == "not_found"
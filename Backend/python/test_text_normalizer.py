@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de la normalisation du texte OCR et de la table des positions d'origine"""
+
+import re
+
+import pytest
+
+from text_normalizer import clean_amount, normalize_text
+
+TEXT = "  FACTURE   N° 42 \nTotal HT :\t\t1 000,00 DT  \n\n   TVA   19% : 1O3,5O\r\n"
+
+
+def test_text_is_normalized():
+    normalized = normalize_text(TEXT)
+    assert normalized.text == "FACTURE N° 42\nTotal HT : 1 000,00 DT\n\nTVA 19% : 103,50\n"
+    assert len(normalized) == len(normalized.text)
+
+
+def test_every_character_maps_back_to_its_original():
+    normalized = normalize_text(TEXT)
+    assert len(normalized.offsets) == len(normalized.text)
+    assert list(normalized.offsets) == sorted(set(normalized.offsets))
+    for position, char in enumerate(normalized.text):
+        original = TEXT[normalized.original_offset(position)]
+        # Seuls les espaces et les confusions lettre/chiffre changent de caractère
+        assert original == char or (char == " " and original.isspace()) or original in "OoIlS"
+
+
+@pytest.mark.parametrize("value, original", [
+    ("FACTURE N° 42", "FACTURE   N° 42"),          # espaces réduits au milieu du span
+    ("Total HT : 1 000,00 DT", "Total HT :\t\t1 000,00 DT"),
+    ("TVA 19%", "TVA   19%"),                      # espaces de début de ligne retirés avant le span
+    ("103,50", "1O3,5O"),                          # confusions corrigées, même longueur
+])
+def test_normalized_spans_map_back_to_original_slices(value, original):
+    normalized = normalize_text(TEXT)
+    start = normalized.text.index(value)
+    begin, finish = normalized.original_span(start, start + len(value))
+    assert TEXT[begin:finish] == original
+
+
+def test_spans_around_removed_characters():
+    normalized = normalize_text(TEXT)
+    # Fin de ligne: les espaces retirés après "42" et "DT" restent hors du span
+    start = normalized.text.index("42")
+    assert normalized.original_span(start, start + 3) == (TEXT.index("42"), TEXT.index("42") + 4)
+    # Positions vides et fin du texte
+    assert normalized.original_span(5, 5) == (normalized.original_offset(5),) * 2
+    assert normalized.original_offset(len(normalized)) == len(TEXT)
+
+
+def test_pattern_matches_map_back_to_original_values():
+    normalized = normalize_text(TEXT)
+    match = re.search(r"total\s+ht\s*:\s*([\d\s,]+?)\s*dt", normalized.text, re.IGNORECASE)
+    begin, finish = normalized.original_span(*match.span(1))
+    assert TEXT[begin:finish] == "1 000,00"
+    assert clean_amount(match.group(1)) == "1000.00"
+
+
+def test_text_without_removed_characters_keeps_identity_offsets():
+    normalized = normalize_text("Total HT: 1O,5O\nTVA: 2,00")
+    assert normalized.offsets is None
+    assert normalized.text == "Total HT: 10,50\nTVA: 2,00"
+    assert normalized.original_span(10, 15) == (10, 15)
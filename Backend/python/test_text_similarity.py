@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de la similarité (automate des suffixes) et de l'évaluation parallèle"""
+
+import random
+
+import pytest
+
+import adaptive_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from invoice_corpus import generate_corpus
+from text_similarity import SuffixAutomaton, is_similar, longest_common_substring
+
+
+def naive_lcs(s1, s2):
+    """Référence en O(n x m x k)"""
+    s1, s2 = s1.lower(), s2.lower()
+    best = 0
+    for i in range(len(s1)):
+        for j in range(len(s2)):
+            length = 0
+            while i + length < len(s1) and j + length < len(s2) and s1[i + length] == s2[j + length]:
+                length += 1
+            best = max(best, length)
+    return best
+
+
+@pytest.mark.parametrize("s1, s2, expected", [
+    ("FA2024-0042", "Facture FA2024-0042 du", 11),
+    ("abc", "xyz", 0),
+    ("", "abc", 0),
+    ("SOCIETE ALPHA", "societe alpha sarl", 13),
+    ("1190.00", "1 190,00", 3),
+])
+def test_longest_common_substring(s1, s2, expected):
+    assert longest_common_substring(s1, s2) == expected
+    assert longest_common_substring(s2, s1) == expected
+
+
+def test_matches_naive_reference_on_random_strings():
+    rng = random.Random(3)
+    for _ in range(300):
+        s1 = "".join(rng.choice("ab1 ") for _ in range(rng.randint(0, 20)))
+        s2 = "".join(rng.choice("ab1 ") for _ in range(rng.randint(0, 20)))
+        assert longest_common_substring(s1, s2) == naive_lcs(s1, s2), (s1, s2)
+
+
+def test_automaton_is_reusable_across_queries():
+    automaton = SuffixAutomaton("montant ttc")
+    assert automaton.longest_common_substring("total ttc") == 4
+    assert automaton.longest_common_substring("montant") == 7
+
+
+def test_is_similar_threshold():
+    assert is_similar("SOCIETE ALPHA SARL", "SOCIETE ALPHA SARL.")
+    assert not is_similar("SOCIETE ALPHA", "SOCIETE BETA")
+    assert not is_similar("1190.00", "1.19")
+
+
+def test_parallel_evaluation_matches_serial(monkeypatch):
+    test_data = list(generate_corpus(24, seed=5))
+    parser = AdaptiveInvoiceParser()
+    serial = parser.evaluate(test_data, n_process=1)
+
+    # Un seul processeur ici: forcer le pool pour vérifier l'extraction dans les processus
+    monkeypatch.setattr(adaptive_invoice_parser.os, "cpu_count", lambda: 2)
+    parallel = parser.evaluate(test_data, n_process=2)
+    assert parallel == serial
+    assert serial["true_positives"] > 0
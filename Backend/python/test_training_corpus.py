@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du corpus d'entraînement compilé (quasi-doublons MinHash/LSH, fichiers DocBin)"""
+
+import spacy
+
+import training_corpus
+from invoice_corpus import generate_corpus
+from span_alignment import snap_to_tokens
+from training_corpus import DUPLICATE_THRESHOLD, LSHIndex, TrainingCorpus, minhash
+from training_queue import feedback_to_training_sample
+
+
+def samples(count, seed=7):
+    return [feedback_to_training_sample(document["text"], document["entities"])
+            for document in generate_corpus(count, seed=seed)]
+
+
+def test_minhash_estimates_similarity():
+    text = samples(1)[0][0]
+    index = LSHIndex()
+    index.add(minhash(text))
+    assert index.best_match(minhash(text)) == 1.0
+    assert index.best_match(minhash(text.replace("TVA", "TVa", 1))) >= DUPLICATE_THRESHOLD
+    assert index.best_match(minhash("Reçu de paiement n° 77\nMontant réglé: 45,000 DT")) < DUPLICATE_THRESHOLD
+
+
+def test_near_duplicates_are_rejected(tmp_path):
+    corpus = TrainingCorpus(str(tmp_path))
+    (text, annotations), other = samples(2)
+    # Même document corrigé à nouveau, à une lettre près
+    near_duplicate = (text.replace("TVA", "TVa", 1), annotations)
+    stats = corpus.add([(text, annotations), near_duplicate, other])
+    assert (stats["added"], stats["duplicates"]) == (2, 1)
+
+    # Les signatures sont conservées: le doublon est encore écarté à l'exécution suivante
+    stats = TrainingCorpus(str(tmp_path)).add([near_duplicate, ("", {"entities": []})])
+    assert (stats["added"], stats["duplicates"], stats["skipped"]) == (0, 1, 1)
+    assert TrainingCorpus(str(tmp_path)).stats()["duplicates"] == 2
+
+
+def test_docbin_shards_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(training_corpus, "SHARD_SIZE", 3)
+    batch = samples(12, seed=3)
+    corpus = TrainingCorpus(str(tmp_path))
+    assert corpus.add(batch[:5])["added"] == 5
+    # Un second ajout complète le dernier fichier avant d'en créer d'autres
+    assert corpus.add(batch[5:])["added"] == 7
+
+    reopened = TrainingCorpus(str(tmp_path))
+    shards = reopened.manifest["shards"]
+    assert reopened.count("train") + reopened.count("dev") == 12
+    assert all(shard["docs"] <= 3 for split in shards.values() for shard in split)
+    assert all(shard["docs"] == 3 for split in shards.values() for shard in split[:-1])
+
+    # Entités ramenées aux limites des tokens à la compilation (span_alignment)
+    nlp = spacy.blank("fr")
+    expected = {}
+    for text, annotations in batch:
+        spans = snap_to_tokens(nlp.make_doc(text), annotations["entities"])[0]
+        expected[text] = sorted((span.start_char, span.end_char, span.label_) for span in spans)
+    docs = list(reopened.docs(nlp.vocab, "train")) + list(reopened.docs(nlp.vocab, "dev"))
+    assert sorted(doc.text for doc in docs) == sorted(expected)
+    for doc in docs:
+        assert sorted((span.start_char, span.end_char, span.label_) for span in doc.ents) == expected[doc.text]
+    assert set(reopened.labels) == {label for spans in expected.values() for _, _, label in spans}
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""Tests de la file d'entraînement: réservations abandonnées et verrou du worker"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from training_queue import FeedbackQueue, worker_lock
+
+SAMPLE = ("Facture FAC-1 total 10,00 DT", {"entities": [(8, 13, "REFERENCE")]})
+
+LOCK_THEN_CRASH = """
+import os, sys
+sys.path.insert(0, {here!r})
+from training_queue import FeedbackQueue, worker_lock
+lock = worker_lock({models_dir!r})
+assert lock.__enter__()
+FeedbackQueue({models_dir!r}).claim()
+os._exit(1)
+"""
+
+
+def test_claim_then_release_restores_pending(tmp_path):
+    queue = FeedbackQueue(str(tmp_path))
+    queue.put(SAMPLE)
+    token, samples = queue.claim()
+    assert samples == [SAMPLE] and queue.pending_count() == 0
+    queue.release(token)
+    assert queue.pending_count() == 1
+
+
+def test_lock_is_exclusive_and_released(tmp_path):
+    with worker_lock(str(tmp_path)) as first:
+        assert first
+        with worker_lock(str(tmp_path)) as second:
+            assert not second
+    with worker_lock(str(tmp_path)) as again:
+        assert again
+
+
+def test_old_lock_of_a_running_trainer_is_not_taken(tmp_path):
+    with worker_lock(str(tmp_path)) as held:
+        assert held
+        # L'âge du fichier n'est pas un critère: seul le détenteur vivant compte
+        lock_path = os.path.join(str(tmp_path), "feedback_queue", "worker.lock")
+        os.utime(lock_path, (0, 0))
+        with worker_lock(str(tmp_path)) as second:
+            assert not second
+        with open(lock_path) as f:
+            assert f.read() == str(os.getpid())
+
+
+@pytest.mark.skipif(os.name == "nt", reason="processus enfant POSIX")
+def test_crashed_trainer_releases_lock_and_claims_are_recovered(tmp_path):
+    models_dir = str(tmp_path)
+    queue = FeedbackQueue(models_dir)
+    for _ in range(3):
+        queue.put(SAMPLE)
+
+    script = LOCK_THEN_CRASH.format(here=os.path.dirname(os.path.abspath(__file__)), models_dir=models_dir)
+    subprocess.run([sys.executable, "-c", script], check=False, timeout=60)
+    assert queue.pending_count() == 0
+    assert os.listdir(queue.processing_dir)
+
+    with worker_lock(models_dir) as acquired:
+        assert acquired
+        assert queue.recover() == 3
+    assert queue.pending_count() == 3
+    assert os.listdir(queue.processing_dir) == []
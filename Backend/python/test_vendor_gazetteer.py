@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""Tests du répertoire des noms confirmés (limites de mot, rang face aux libellés, feedbacks)"""
+
+import os
+
+import pytest
+
+import adaptive_invoice_parser
+import simple_invoice_parser
+from adaptive_invoice_parser import AdaptiveInvoiceParser
+from company_overlay import company_dir
+from model_registry import MODELS_DIR
+from vendor_gazetteer import GAZETTEER_FILE, STAGING_FILE, Gazetteer, get_gazetteer, promote_names, same_name
+
+GAZETTEER = Gazetteer(["Électro Sahel", "Moez Zrig"])
+LABELED = "Facture FA2024-0042\nFournisseur: Ben Salah Export\nLivré par Électro Sahel\nTotal TTC 119,00 €"
+
+
+@pytest.fixture
+def gazetteer(monkeypatch):
+    monkeypatch.setattr(simple_invoice_parser, "get_gazetteer", lambda *args, **kwargs: GAZETTEER)
+    monkeypatch.setattr(adaptive_invoice_parser, "get_gazetteer", lambda *args, **kwargs: GAZETTEER)
+    return GAZETTEER
+
+
+def test_names_match_across_spaces_accents_and_case():
+    match = GAZETTEER.match("Livraison: ELECTRO  SAHEL, Sousse")
+    assert match["value"] == "Électro Sahel"
+    assert match["raw"] == "ELECTRO  SAHEL"
+
+
+@pytest.mark.parametrize("text", [
+    "Commande Sahelienne Électrosahelmarket",
+    "Réf XMoez Zrig",
+    "Moez Zrigui et fils",
+])
+def test_names_inside_other_words_are_ignored(text):
+    assert Gazetteer(["Sahel", "Électro Sahel", "Moez Zrig"]).find_all(text) == []
+
+
+def test_name_glued_to_its_label_by_ocr():
+    assert GAZETTEER.match("NOMDEDESTINATAIREMoezzrig\nTotal")["value"] == "Moez Zrig"
+    assert GAZETTEER.match("ABCMoezzrig\nTotal") is None
+
+
+def test_same_name_accepts_truncated_values():
+    assert same_name("Électro Sahel", "ELECTRO SAHEL")
+    assert same_name("Moez Zrig", "Moez")
+    assert not same_name("Moez Zrig", "Ben Salah Export")
+
+
+def test_labeled_name_outranks_gazetteer_in_simple_parser(gazetteer):
+    assert simple_invoice_parser.extract_entities(LABELED)["entities"]["vendor"] == "Ben Salah Export"
+    # Sans libellé qui le contredise, le nom connu reste retenu
+    text = "Facture FA2024-0042\nLivré par Électro Sahel\nTotal TTC 119,00 €"
+    assert simple_invoice_parser.extract_entities(text)["entities"]["vendor"] == "Électro Sahel"
+
+
+def test_labeled_name_outranks_gazetteer_in_adaptive_parser(gazetteer):
+    recipients = AdaptiveInvoiceParser().extract_entities(LABELED)["entities"]["recipient"]
+    assert [(entity["value"], entity["source"]) for entity in recipients] == [
+        ("Ben Salah Export", "label_index"), ("Électro Sahel", "gazetteer")]
+
+    text = "Facture FA2024-0042\nFournisseur: ELECTRO SAHEL\nTotal TTC 119,00 €"
+    recipients = AdaptiveInvoiceParser().extract_entities(text)["entities"]["recipient"]
+    assert recipients[0] == {"value": "Électro Sahel", "confidence": 0.95, "source": "gazetteer"}
+
+
+def test_feedback_never_writes_the_shared_gazetteer():
+    parser = AdaptiveInvoiceParser()
+    result = parser.record_feedback(LABELED, {}, {"vendor": "Ben Salah Export"})
+    assert (result["known_names_added"], result["known_names_staged"]) == (0, 1)
+    assert not os.path.exists(os.path.join(MODELS_DIR, GAZETTEER_FILE))
+
+    result = parser.record_feedback(LABELED, {}, {"vendor": "Ben Salah Export"}, company="acme")
+    assert result["known_names_added"] == 1
+    assert os.path.exists(os.path.join(company_dir("acme"), GAZETTEER_FILE))
+    assert not os.path.exists(os.path.join(MODELS_DIR, GAZETTEER_FILE))
+
+
+def test_confirmed_staged_names_are_promoted(tmp_path):
+    parser = AdaptiveInvoiceParser()
+    staging = os.path.join(MODELS_DIR, STAGING_FILE)
+    if os.path.exists(staging):
+        os.remove(staging)
+    for _ in range(2):
+        parser.record_feedback(LABELED, {}, {"vendor": "Ben Salah Export", "recipient": "Électro Sahel"})
+    parser.record_feedback(LABELED, {}, {"vendor": "BEN SALAH  EXPORT"})
+    models_dir = str(tmp_path)
+    os.replace(staging, os.path.join(models_dir, STAGING_FILE))
+
+    assert promote_names(models_dir=models_dir) == 1
+    gazetteer = get_gazetteer(models_dir, check=True)
+    assert "Ben Salah Export" in gazetteer and "Électro Sahel" not in gazetteer
+    # Les noms pas encore assez confirmés restent en attente
+    assert promote_names(models_dir=models_dir) == 0
+    assert promote_names(min_confirmations=2, models_dir=models_dir) == 1
+    assert "Électro Sahel" in get_gazetteer(models_dir, check=True)
+    assert os.path.getsize(os.path.join(models_dir, STAGING_FILE)) == 0
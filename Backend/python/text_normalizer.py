@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Normalisation du texte OCR, une seule fois par document, avec table des positions.
+
+Les extracteurs (patterns, index des montants, libellés, classifieur, répertoire des
+noms) lisent tous le même texte normalisé:
+
+- chiffres arabes-indiens (٠-٩, ۰-۹ de la traineddata `ara`) ramenés aux chiffres
+  ASCII, séparateur décimal arabe (٫) ramené à la virgule et séparateur de milliers (٬)
+  à l'espace;
+- espaces Unicode (insécables, fines, tabulations, retours chariot) ramenés à l'espace,
+  espaces répétés réduits à un seul, espaces en début et fin de ligne supprimés;
+- confusions OCR lettre/chiffre dans les nombres seulement ("1O3,5O" -> "103,50",
+  "2l5" -> "215"): un mot ordinaire n'est jamais modifié.
+
+Les deux premières étapes sont des tables `str.translate` précalculées, la dernière
+une substitution de même longueur. Seule la réduction des espaces retire des
+caractères: `NormalizedText.offsets` (tableau NumPy uint32, absent si rien n'a été
+retiré) donne pour chaque caractère normalisé sa position dans le texte d'origine.
+"""
+
+import re
+
+import numpy as np
+
+ARABIC_INDIC_DIGITS = "٠١٢٣٤٥٦٧٨٩"
+EXTENDED_ARABIC_INDIC_DIGITS = "۰۱۲۳۴۵۶۷۸۹"
+
+# Table appliquée à tout le texte: même longueur, caractère pour caractère
+CHARACTER_TABLE = str.maketrans({
+    **{digit: str(value) for value, digit in enumerate(ARABIC_INDIC_DIGITS)},
+    **{digit: str(value) for value, digit in enumerate(EXTENDED_ARABIC_INDIC_DIGITS)},
+    "٫": ",",
+    "٬": " ",
+    "\t": " ",
+    "\r": " ",
+    "\v": " ",
+    "\u00a0": " ",
+    "\u2007": " ",
+    "\u2009": " ",
+    "\u200a": " ",
+    "\u202f": " ",
+    "\u3000": " ",
+})
+
+# Lettres lues à la place de chiffres, corrigées seulement au milieu d'un nombre
+# ("|" n'en fait pas partie: c'est aussi un séparateur de colonnes, "100|200")
+NUMERIC_CONFUSION_TABLE = str.maketrans("OoIlS", "00115")
+NUMERIC_CONFUSION_PATTERN = re.compile(
+    r"(?<=\d)[OoIlS]+(?=[\d.,])"            # entre chiffres: 1O3 ; 1O,5
+    r"|(?<=\d[.,])[OoIlS]+(?![^\W\d_])"     # après le séparateur décimal: 3,OO
+    r"|(?<=\d)[Oo]+(?![^\W\d_])"            # zéros en fin de nombre: 2O2O ; 10O DT
+)
+
+# Espaces à retirer: début et fin de ligne, et au-delà du premier d'une suite
+SPACE_PATTERN = re.compile(r"^ +| +$| {2,}", re.MULTILINE)
+
+# Nettoyage d'un montant brut ("1 103,36" -> "1103.36")
+AMOUNT_CLEANUP_TABLE = str.maketrans({" ": None, ",": "."})
+
+
+class NormalizedText:
+    """Texte normalisé d'un document et positions correspondantes dans le texte d'origine"""
+
+    __slots__ = ("original", "text", "offsets")
+
+    def __init__(self, original, text, offsets=None):
+        self.original = original
+        self.text = text
+        # offsets[i]: position dans `original` du i-ème caractère de `text` (None: identité)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.text)
+
+    def original_offset(self, position):
+        """Position dans le texte d'origine d'une position du texte normalisé"""
+        if self.offsets is None:
+            return position
+        if position >= len(self.offsets):
+            return len(self.original)
+        return int(self.offsets[position])
+
+    def original_span(self, start, end):
+        """Intervalle du texte d'origine couvert par text[start:end]"""
+        if self.offsets is None or end <= start:
+            return self.original_offset(start), self.original_offset(end)
+        return int(self.offsets[start]), int(self.offsets[end - 1]) + 1
+
+
+def _fix_numeric_confusions(match):
+    return match.group(0).translate(NUMERIC_CONFUSION_TABLE)
+
+
+def normalize_text(text):
+    """Normalise un texte OCR (voir le module) et retourne un NormalizedText"""
+    translated = NUMERIC_CONFUSION_PATTERN.sub(_fix_numeric_confusions, text.translate(CHARACTER_TABLE))
+
+    # Intervalles de caractères retirés (les seules modifications de longueur)
+    removed = []
+    for match in SPACE_PATTERN.finditer(translated):
+        start, end = match.span()
+        at_line_edge = start == 0 or translated[start - 1] == "\n" or end == len(translated) or translated[end] == "\n"
+        removed.append((start if at_line_edge else start + 1, end))
+    if not removed:
+        return NormalizedText(text, translated)
+
+    pieces = []
+    keep = np.ones(len(translated), dtype=bool)
+    previous = 0
+    for start, end in removed:
+        pieces.append(translated[previous:start])
+        keep[start:end] = False
+        previous = end
+    pieces.append(translated[previous:])
+    return NormalizedText(text, "".join(pieces), np.flatnonzero(keep).astype(np.uint32))
+
+
+def clean_amount(value):
+    """Montant brut sans espaces, virgule décimale remplacée par un point"""
+    return value.translate(AMOUNT_CLEANUP_TABLE)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Similarité de chaînes pour l'évaluation des extractions.
+
+La plus longue sous-chaîne commune est calculée avec un automate des suffixes:
+construction en O(m) sur une des chaînes, puis parcours de l'autre en O(n), sans
+table de programmation dynamique n x m. Les automates des valeurs attendues sont
+mis en cache, car chaque valeur attendue est comparée à plusieurs valeurs extraites.
+"""
+
+from functools import lru_cache
+
+
+class SuffixAutomaton:
+    """Automate des suffixes d'une chaîne (états stockés dans des listes parallèles)"""
+
+    __slots__ = ("transitions", "link", "length")
+
+    def __init__(self, text):
+        self.transitions = [{}]
+        self.link = [-1]
+        self.length = [0]
+        last = 0
+
+        for char in text:
+            current = len(self.length)
+            self.transitions.append({})
+            self.link.append(0)
+            self.length.append(self.length[last] + 1)
+
+            state = last
+            while state != -1 and char not in self.transitions[state]:
+                self.transitions[state][char] = current
+                state = self.link[state]
+
+            if state != -1:
+                target = self.transitions[state][char]
+                if self.length[state] + 1 == self.length[target]:
+                    self.link[current] = target
+                else:
+                    clone = len(self.length)
+                    self.transitions.append(dict(self.transitions[target]))
+                    self.link.append(self.link[target])
+                    self.length.append(self.length[state] + 1)
+                    while state != -1 and self.transitions[state].get(char) == target:
+                        self.transitions[state][char] = clone
+                        state = self.link[state]
+                    self.link[target] = clone
+                    self.link[current] = clone
+            last = current
+
+    def longest_common_substring(self, other):
+        """Longueur de la plus longue sous-chaîne commune avec `other`, en O(len(other))"""
+        transitions, link, length = self.transitions, self.link, self.length
+        state, current, best = 0, 0, 0
+
+        for char in other:
+            while state and char not in transitions[state]:
+                state = link[state]
+                current = length[state]
+            if char in transitions[state]:
+                state = transitions[state][char]
+                current += 1
+                if current > best:
+                    best = current
+            else:
+                state, current = 0, 0
+
+        return best
+
+
+@lru_cache(maxsize=4096)
+def _automaton(text):
+    return SuffixAutomaton(text)
+
+
+def longest_common_substring(s1, s2):
+    """Longueur de la plus longue sous-chaîne commune (insensible à la casse)"""
+    s1, s2 = s1.lower(), s2.lower()
+    if not s1 or not s2:
+        return 0
+    # L'automate est construit sur la chaîne la plus courte (moins d'états à allouer)
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    return _automaton(s2).longest_common_substring(s1)
+
+
+def is_similar(s1, s2, threshold=0.7):
+    """
+    Vrai si la plus longue sous-chaîne commune couvre au moins `threshold` de la plus
+    longue des deux chaînes. Rejet immédiat quand la plus courte est trop courte.
+    """
+    required = threshold * max(len(s1), len(s2))
+    if min(len(s1), len(s2)) < required:
+        return False
+    return longest_common_substring(s1, s2) >= required
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Corpus d'entraînement NER compilé en fichiers DocBin spaCy, sans quasi-doublons.
+
+Les corrections répétées de factures presque identiques (même fournisseur, même modèle
+de document) dominaient les données d'entraînement sans rien apporter. Le compilateur
+convertit les échantillons de feedback (text, {"entities": ...}) une seule fois en
+documents spaCy, rangés dans des fichiers DocBin de SHARD_SIZE documents
+(models/training_corpus/):
+
+- Quasi-doublons: signature MinHash (NUM_PERM permutations) des 5-grammes de caractères
+  du texte, indexée par LSH (BANDS bandes de ROWS valeurs). Un échantillon dont une
+  signature candidate ressemble à plus de DUPLICATE_THRESHOLD (Jaccard estimé) est écarté.
+- Incrémental: le manifeste (manifest.json) garde les fichiers, leur nombre de documents,
+  les étiquettes rencontrées et, pour un fichier d'export JSON Lines, la position déjà
+  lue; les signatures sont conservées dans signatures.npy. Chaque exécution ne traite
+  que les nouveaux échantillons et complète le dernier fichier.
+- Validation: un échantillon va dans le jeu "dev" selon l'empreinte de son texte
+  (DEV_PERCENT %), toujours le même d'une exécution à l'autre.
+
+L'entraînement lit le corpus fichier par fichier (`TrainingCorpus.examples`), dans un
+ordre mélangé, sans reconstruire les exemples depuis les tuples.
+
+Le compilateur écrit dans le dossier des modèles: il tourne sous le verrou du worker
+d'entraînement (training_queue.worker_lock).
+
+Usage:
+    python training_corpus.py compile feedbacks.jsonl
+    python training_corpus.py stats
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from model_registry import MODELS_DIR, write_json_atomic
+from span_alignment import snap_to_tokens
+
+CORPUS_DIR = "training_corpus"
+MANIFEST_FILE = "manifest.json"
+SIGNATURES_FILE = "signatures.npy"
+SPLITS = ("train", "dev")
+
+SHARD_SIZE = 256
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+DUPLICATE_THRESHOLD = 0.9
+DEV_PERCENT = 20
+
+# Permutations MinHash: (a·h + b) mod p, avec p = 2^31 - 1 (les produits tiennent sur 64 bits)
+_PRIME = np.uint64((1 << 31) - 1)
+_HASH_PRIME = np.uint64(1099511628211)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+_permutations = np.random.RandomState(20240501)
+_PERM_A = _permutations.randint(1, (1 << 31) - 1, size=(NUM_PERM, 1)).astype(np.uint64)
+_PERM_B = _permutations.randint(0, (1 << 31) - 1, size=(NUM_PERM, 1)).astype(np.uint64)
+
+
+def shingle_hashes(text):
+    """Empreintes (31 bits, uniques) des n-grammes de caractères du texte sans espaces"""
+    normalized = "".join(text.lower().split())
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    count = len(codes) - SHINGLE_SIZE + 1
+    if count <= 0:
+        codes = np.concatenate([codes, np.zeros(SHINGLE_SIZE - len(codes), dtype=np.uint64)])
+        count = 1
+    with np.errstate(over="ignore"):
+        value = np.zeros(count, dtype=np.uint64)
+        for offset in range(SHINGLE_SIZE):
+            value = value * _HASH_PRIME + codes[offset:offset + count]
+        value = (value ^ (value >> np.uint64(29))) * _HASH_MIX
+    return np.unique(value >> np.uint64(33)) % _PRIME
+
+
+def minhash(text):
+    """Signature MinHash (NUM_PERM valeurs uint32) d'un texte"""
+    hashes = shingle_hashes(text)
+    return ((_PERM_A * hashes + _PERM_B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class LSHIndex:
+    """Index LSH par bandes des signatures MinHash"""
+
+    def __init__(self, bands=BANDS, rows=ROWS):
+        self.bands = bands
+        self.rows = rows
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+
+    def _keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, signature):
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in self._keys(signature):
+            self.buckets[band].setdefault(key, []).append(index)
+        return index
+
+    def best_match(self, signature):
+        """Plus forte similarité estimée parmi les candidats (0.0 sans candidat)"""
+        candidates = set()
+        for band, key in self._keys(signature):
+            candidates.update(self.buckets[band].get(key, ()))
+        best = 0.0
+        for index in candidates:
+            best = max(best, float(np.mean(self.signatures[index] == signature)))
+        return best
+
+
+def _split(text):
+    digest = hashlib.sha1(text.encode("utf-8")).digest()
+    return "dev" if int.from_bytes(digest[:4], "big") % 100 < DEV_PERCENT else "train"
+
+
+class TrainingCorpus:
+    """Corpus de documents annotés en fichiers DocBin, avec dédoublonnage MinHash/LSH"""
+
+    def __init__(self, models_dir=None):
+        self.root = os.path.join(models_dir or MODELS_DIR, CORPUS_DIR)
+        self.manifest_path = os.path.join(self.root, MANIFEST_FILE)
+        self.signatures_path = os.path.join(self.root, SIGNATURES_FILE)
+        self.manifest = self._load_manifest()
+        self.index = LSHIndex()
+        if os.path.exists(self.signatures_path):
+            # Des signatures écrites après le dernier manifeste (arrêt brutal) sont ignorées
+            for signature in np.load(self.signatures_path)[:self.manifest["records"]]:
+                self.index.add(signature)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {
+                "records": 0,
+                "duplicates": 0,
+                "skipped": 0,
+                "misaligned_entities": 0,
+                "labels": [],
+                "shards": {split: [] for split in SPLITS},
+                "sources": {},
+            }
+
+    @property
+    def labels(self):
+        return list(self.manifest["labels"])
+
+    def count(self, split="train"):
+        return sum(shard["docs"] for shard in self.manifest["shards"][split])
+
+    def add(self, samples, nlp=None):
+        """
+        Ajoute des échantillons (text, annotations) au corpus; ceux sans entités et les
+        quasi-doublons sont écartés. Retourne {"added", "duplicates", "skipped", "misaligned_entities"}.
+        """
+        nlp = nlp or _blank_language()
+
+        stats = {"added": 0, "duplicates": 0, "skipped": 0, "misaligned_entities": 0}
+        docs = {split: [] for split in SPLITS}
+        signatures = []
+        labels = set(self.manifest["labels"])
+        for text, annotations in samples:
+            entities = annotations.get("entities") or []
+            if not text or not entities:
+                stats["skipped"] += 1
+                continue
+            signature = minhash(text)
+            if self.index.best_match(signature) >= DUPLICATE_THRESHOLD:
+                stats["duplicates"] += 1
+                continue
+
+            doc = nlp.make_doc(text)
+            spans, misaligned = snap_to_tokens(doc, entities)
+            stats["misaligned_entities"] += misaligned
+            if not spans:
+                stats["skipped"] += 1
+                continue
+            doc.ents = spans
+
+            self.index.add(signature)
+            signatures.append(signature)
+            labels.update(span.label_ for span in doc.ents)
+            docs[_split(text)].append(doc)
+            stats["added"] += 1
+
+        if signatures:
+            os.makedirs(self.root, exist_ok=True)
+            for split in SPLITS:
+                self._write_docs(split, docs[split])
+            self._save_signatures()
+        self.manifest["records"] += stats["added"]
+        self.manifest["labels"] = sorted(labels)
+        for key in ("duplicates", "skipped", "misaligned_entities"):
+            self.manifest[key] += stats[key]
+        if any(stats.values()):
+            os.makedirs(self.root, exist_ok=True)
+            write_json_atomic(self.manifest_path, self.manifest)
+        return stats
+
+    def compile_file(self, path, nlp=None):
+        """
+        Ajoute les échantillons d'un fichier JSON Lines ({"text", "annotations"} ou
+        {"text", "corrected"} par ligne) à partir de la position lue à l'exécution précédente
+        """
+        from training_queue import feedback_to_training_sample
+
+        key = os.path.abspath(path)
+        source = self.manifest["sources"].get(key, {"offset": 0})
+        if os.path.getsize(path) < source["offset"]:
+            # Fichier remplacé par un plus court: tout relire
+            source = {"offset": 0}
+
+        samples = []
+        with open(path, "rb") as f:
+            f.seek(source["offset"])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Ligne en cours d'écriture: elle sera lue à la prochaine exécution
+                    break
+                source["offset"] += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "annotations" in record:
+                    annotations = record["annotations"]
+                    annotations["entities"] = [tuple(entity) for entity in annotations.get("entities", [])]
+                    samples.append((record["text"], annotations))
+                else:
+                    sample = feedback_to_training_sample(record["text"], record.get("corrected", {}))
+                    if sample:
+                        samples.append(sample)
+
+        stats = self.add(samples, nlp)
+        self.manifest["sources"][key] = source
+        os.makedirs(self.root, exist_ok=True)
+        write_json_atomic(self.manifest_path, self.manifest)
+        return stats
+
+    def _write_docs(self, split, docs):
+        """Complète le dernier fichier du jeu puis en crée de nouveaux (SHARD_SIZE documents)"""
+        from spacy.tokens import DocBin
+        shards = self.manifest["shards"][split]
+        while docs:
+            if shards and shards[-1]["docs"] < SHARD_SIZE:
+                shard = shards[-1]
+                doc_bin = self._read_shard(shard)
+            else:
+                shard = {"file": f"{split}-{len(shards):05d}.spacy", "docs": 0}
+                shards.append(shard)
+                doc_bin = DocBin(attrs=["ENT_IOB", "ENT_TYPE"])
+            room = SHARD_SIZE - shard["docs"]
+            for doc in docs[:room]:
+                doc_bin.add(doc)
+            docs = docs[room:]
+
+            path = os.path.join(self.root, shard["file"])
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(doc_bin.to_bytes())
+            os.replace(temp_path, path)
+            shard["docs"] = len(doc_bin)
+
+    def _read_shard(self, shard):
+        """DocBin d'un fichier, limité aux documents enregistrés dans le manifeste"""
+        from spacy.tokens import DocBin
+        with open(os.path.join(self.root, shard["file"]), "rb") as f:
+            doc_bin = DocBin().from_bytes(f.read())
+        if len(doc_bin) > shard["docs"]:
+            # Documents écrits avant un arrêt brutal, absents du manifeste
+            kept = DocBin(attrs=["ENT_IOB", "ENT_TYPE"])
+            for doc in list(doc_bin.get_docs(_blank_language().vocab))[:shard["docs"]]:
+                kept.add(doc)
+            doc_bin = kept
+        return doc_bin
+
+    def _save_signatures(self):
+        temp_path = f"{self.signatures_path}.tmp.npy"
+        np.save(temp_path, np.array(self.index.signatures, dtype=np.uint32).reshape(-1, NUM_PERM))
+        os.replace(temp_path, self.signatures_path)
+
+    def docs(self, vocab, split="train", rng=None):
+        """Documents annotés d'un jeu, fichier par fichier (ordre mélangé si rng est donné)"""
+        shards = list(self.manifest["shards"][split])
+        if rng is not None:
+            rng.shuffle(shards)
+        for shard in shards:
+            docs = list(self._read_shard(shard).get_docs(vocab))
+            if rng is not None:
+                rng.shuffle(docs)
+            yield from docs
+
+    def examples(self, nlp, split="train", rng=None):
+        """Exemples d'entraînement spaCy, lus au fil des fichiers"""
+        from spacy.training import Example
+        for doc in self.docs(nlp.vocab, split, rng):
+            yield Example(nlp.make_doc(doc.text), doc)
+
+    def stats(self):
+        return {
+            "records": self.manifest["records"],
+            "train_docs": self.count("train"),
+            "dev_docs": self.count("dev"),
+            "shards": sum(len(shards) for shards in self.manifest["shards"].values()),
+            "duplicates": self.manifest["duplicates"],
+            "skipped": self.manifest["skipped"],
+            "misaligned_entities": self.manifest["misaligned_entities"],
+            "labels": self.labels,
+        }
+
+
+def _blank_language():
+    """Tokenizer français par défaut (celui du parser adaptatif sans modèle)"""
+    import spacy
+    return spacy.blank("fr")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compilation du corpus d'entraînement NER")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    compile_command = commands.add_parser("compile", help="Ajouter les nouveaux échantillons d'un fichier JSON Lines")
+    compile_command.add_argument("path")
+    commands.add_parser("stats", help="Afficher l'état du corpus")
+    arg_parser.add_argument("--models-dir", help="Dossier des modèles (par défaut: models/)")
+    args = arg_parser.parse_args()
+
+    from training_queue import worker_lock
+    if args.command == "stats":
+        print(json.dumps(TrainingCorpus(args.models_dir).stats(), ensure_ascii=False))
+        return
+
+    with worker_lock(args.models_dir) as acquired:
+        if not acquired:
+            print(json.dumps({"error": "Un entraînement est en cours, réessayer plus tard"}))
+            sys.exit(1)
+        corpus = TrainingCorpus(args.models_dir)
+        result = corpus.compile_file(args.path)
+        result["corpus"] = corpus.stats()
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+File d'entraînement en arrière-plan et publication atomique des modèles.
+
+- Les feedbacks utilisateurs sont convertis en échantillons d'entraînement et déposés
+  dans `models/feedback_queue/pending/`, un fichier par échantillon (écriture dans un
+  fichier temporaire puis os.replace): l'enregistrement d'un feedback ne coûte que
+  quelques millisecondes et ne charge pas spaCy.
+- Un worker (thread du serveur de parsing, ou `python training_queue.py --watch`)
+  réclame les échantillons par os.rename vers `processing/`, entraîne une copie du
+  modèle actif et la publie via model_registry (staging, renommage, puis mise à jour
+  atomique du manifeste): un extracteur ne voit jamais un dossier à moitié écrit.
+- Un seul entraînement à la fois (worker_lock, verrou du système sur un fichier,
+  libéré par le système si le processus meurt). Le worker qui prend le verrou remet
+  d'abord en attente les échantillons restés dans `processing/` après un arrêt brutal.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import subprocess
+
+from model_registry import MODELS_DIR, write_json_atomic, active_model_path
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+QUEUE_DIR = "feedback_queue"
+
+# Nombre d'échantillons en attente qui déclenche un entraînement
+TRAINING_THRESHOLD = 10
+
+# Clés des entités corrigées qui portent le type du document (classifieur, pas NER)
+DOCUMENT_TYPE_KEYS = ("documentType", "document_type")
+
+
+def feedback_to_training_sample(text, corrected_entities, report=None):
+    """
+    Convertit les entités corrigées en échantillon d'entraînement spaCy
+    (text, {"entities": [(début, fin, LABEL), ...]}), ou None si rien n'a été retrouvé.
+    Un type de document corrigé ("documentType") est placé dans annotations["cats"]
+    pour le classifieur de type (document_classifier).
+
+    Les valeurs sont retrouvées dans le texte par span_alignment (toutes les occurrences,
+    celle la plus proche du libellé du champ). Si `report` est un dictionnaire, il reçoit
+    le nombre de valeurs alignées et celles qui n'ont pas pu l'être.
+    """
+    from document_classifier import DOCUMENT_TYPES, document_type_label
+    from span_alignment import align_entities
+
+    values = []
+    document_type = None
+
+    for entity_name, entities in corrected_entities.items():
+        if not entities:
+            continue
+
+        if entity_name in DOCUMENT_TYPE_KEYS:
+            document_type = document_type_label(entities)
+            continue
+
+        # Une liste de valeurs ({"value": ...} ou chaînes) ou une valeur seule
+        for entity in (entities if isinstance(entities, list) else [entities]):
+            value = entity.get("value") if isinstance(entity, dict) else entity
+            if value is not None:
+                values.append((entity_name.upper(), str(value)))
+
+    training_entities, dropped = align_entities(text, values)
+    if report is not None:
+        report.update({"aligned": len(training_entities), "dropped": len(dropped), "dropped_entities": dropped})
+
+    if not training_entities and document_type is None:
+        return None
+    annotations = {"entities": training_entities}
+    if document_type is not None:
+        annotations["cats"] = {label: float(label == document_type) for label in DOCUMENT_TYPES}
+    return (text, annotations)
+
+
+class FeedbackQueue:
+    """File d'échantillons sur disque, partagée entre processus sans verrou de fichier"""
+
+    def __init__(self, models_dir=None):
+        self.root = os.path.join(models_dir or MODELS_DIR, QUEUE_DIR)
+        self.pending_dir = os.path.join(self.root, "pending")
+        self.processing_dir = os.path.join(self.root, "processing")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.processing_dir, exist_ok=True)
+
+    def put(self, sample):
+        """Ajoute un échantillon (text, annotations) à la file"""
+        text, annotations = sample
+        name = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}.json"
+        write_json_atomic(os.path.join(self.pending_dir, name), {"text": text, "annotations": annotations})
+
+    def pending_count(self):
+        return sum(1 for name in os.listdir(self.pending_dir) if name.endswith(".json"))
+
+    def claim(self, limit=None):
+        """
+        Réserve les échantillons en attente (os.rename vers processing/).
+        Retourne (jeton, échantillons); un échantillon déjà réservé par un autre worker est ignoré.
+        """
+        token = uuid.uuid4().hex
+        claim_dir = os.path.join(self.processing_dir, token)
+        os.makedirs(claim_dir)
+
+        samples = []
+        for name in sorted(n for n in os.listdir(self.pending_dir) if n.endswith(".json")):
+            if limit is not None and len(samples) >= limit:
+                break
+            target = os.path.join(claim_dir, name)
+            try:
+                os.rename(os.path.join(self.pending_dir, name), target)
+            except OSError:
+                continue
+            with open(target, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            entities = [tuple(entity) for entity in record["annotations"].get("entities", [])]
+            samples.append((record["text"], {**record["annotations"], "entities": entities}))
+
+        return token, samples
+
+    def complete(self, token):
+        """Supprime les échantillons d'une réservation terminée"""
+        claim_dir = os.path.join(self.processing_dir, token)
+        for name in os.listdir(claim_dir):
+            os.unlink(os.path.join(claim_dir, name))
+        os.rmdir(claim_dir)
+
+    def release(self, token):
+        """Remet en attente les échantillons d'une réservation échouée"""
+        claim_dir = os.path.join(self.processing_dir, token)
+        for name in os.listdir(claim_dir):
+            os.rename(os.path.join(claim_dir, name), os.path.join(self.pending_dir, name))
+        os.rmdir(claim_dir)
+
+    def recover(self):
+        """
+        Remet en attente les réservations abandonnées (worker arrêté en cours
+        d'entraînement). À appeler en tenant worker_lock: seul le détenteur du verrou
+        réserve des échantillons, toute réservation présente est donc orpheline.
+        Retourne le nombre d'échantillons remis en attente.
+        """
+        recovered = 0
+        for token in os.listdir(self.processing_dir):
+            if os.path.isdir(os.path.join(self.processing_dir, token)):
+                recovered += len(os.listdir(os.path.join(self.processing_dir, token)))
+                self.release(token)
+        return recovered
+
+
+def train_pending(models_dir=None, threshold=TRAINING_THRESHOLD, **train_options):
+    """
+    Entraîne une copie du modèle actif sur les échantillons en attente (si le seuil est
+    atteint) et publie le résultat. Retourne le résultat de l'entraînement, ou None.
+    """
+    queue = FeedbackQueue(models_dir)
+    if queue.pending_count() < threshold:
+        return None
+
+    # Import tardif: le dépôt de feedback n'a pas besoin de spaCy
+    from adaptive_invoice_parser import AdaptiveInvoiceParser
+    from document_classifier import add_examples, train_classifier
+    from training_corpus import TrainingCorpus
+
+    token, samples = queue.claim()
+    if not samples:
+        queue.complete(token)
+        return None
+
+    try:
+        # Types de document corrigés: le classifieur est réappris (moins d'une seconde)
+        classifier_result = None
+        if add_examples(samples, models_dir):
+            classifier_result = train_classifier(models_dir)
+
+        # Le NER apprend du corpus compilé: les nouveaux échantillons à entités y sont
+        # ajoutés (quasi-doublons écartés), puis l'entraînement lit les fichiers DocBin
+        result = {"status": "no_data"}
+        if any(annotations["entities"] for _, annotations in samples):
+            corpus = TrainingCorpus(models_dir)
+            parser = AdaptiveInvoiceParser(active_model_path(models_dir), shared_model=False)
+            corpus_stats = corpus.add(samples, parser.nlp)
+            if corpus_stats["added"]:
+                result = parser.train(models_dir=models_dir, corpus=corpus, **train_options)
+            result["corpus"] = corpus_stats
+        if classifier_result:
+            result["document_classifier"] = classifier_result
+    except Exception:
+        queue.release(token)
+        raise
+
+    queue.complete(token)
+    return result
+
+
+class TrainingWorker(threading.Thread):
+    """Thread d'arrière-plan qui vérifie régulièrement la file et entraîne si nécessaire"""
+
+    def __init__(self, models_dir=None, threshold=TRAINING_THRESHOLD, poll_seconds=5.0, logger=None):
+        super().__init__(name="training-worker", daemon=True)
+        self.models_dir = models_dir
+        self.threshold = threshold
+        self.poll_seconds = poll_seconds
+        self.logger = logger
+        self.wake = threading.Event()
+        self.last_result = None
+
+    def run(self):
+        while True:
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+            try:
+                with worker_lock(self.models_dir) as acquired:
+                    if acquired:
+                        recovered = FeedbackQueue(self.models_dir).recover()
+                        if recovered and self.logger:
+                            self.logger.warning("%d échantillon(s) abandonné(s) remis en attente", recovered)
+                        result = train_pending(self.models_dir, self.threshold)
+                        if result:
+                            self.last_result = result
+            except Exception as e:
+                if self.logger:
+                    self.logger.error("Échec de l'entraînement en arrière-plan: %s", e)
+
+
+class worker_lock:
+    """
+    Verrou inter-processus pour un seul entraînement à la fois: verrou du système
+    (flock, ou msvcrt.locking sous Windows) sur un fichier qui contient le PID du
+    détenteur. Le système libère le verrou à la mort du processus; un entraînement
+    long n'est jamais considéré comme abandonné.
+    """
+
+    def __init__(self, models_dir=None):
+        self.path = os.path.join(models_dir or MODELS_DIR, QUEUE_DIR, "worker.lock")
+        self.fd = None
+        self.acquired = False
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        try:
+            if os.name == "nt":
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            self.acquired = False
+            return False
+
+        # PID du détenteur, pour le diagnostic
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self.fd = fd
+        self.acquired = True
+        return True
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            if os.name == "nt":
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+            self.acquired = False
+
+
+def spawn_background_training(models_dir=None):
+    """Lance un worker détaché (une passe) sans attendre la fin de l'entraînement"""
+    args = [sys.executable, os.path.abspath(__file__), "--once"]
+    if models_dir:
+        args += ["--models-dir", models_dir]
+    kwargs = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    subprocess.Popen(args, **kwargs)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Worker d'entraînement des modèles de factures")
+    arg_parser.add_argument("--models-dir", help="Dossier des modèles (par défaut: python/models)")
+    arg_parser.add_argument("--threshold", type=int, default=TRAINING_THRESHOLD)
+    arg_parser.add_argument("--once", action="store_true", help="Une seule passe puis arrêt")
+    arg_parser.add_argument("--watch", action="store_true", help="Surveiller la file en continu")
+    arg_parser.add_argument("--poll", type=float, default=5.0, help="Intervalle de surveillance (secondes)")
+    args = arg_parser.parse_args()
+
+    while True:
+        with worker_lock(args.models_dir) as acquired:
+            result = None
+            if acquired:
+                FeedbackQueue(args.models_dir).recover()
+                result = train_pending(args.models_dir, args.threshold)
+        if result:
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+        if not args.watch:
+            break
+        time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()
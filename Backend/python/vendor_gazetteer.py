@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Répertoire des noms de fournisseurs et de destinataires confirmés.
+
+La plupart des documents viennent de quelques centaines de fournisseurs récurrents:
+un nom déjà confirmé est reconnu ensuite directement, sans regex fragile ni
+réentraînement du NER.
+
+- Le répertoire commun, models/vendor_gazetteer.jsonl (une ligne par nom), n'est
+  modifié que par les commandes "add" et "promote" ci-dessous. Les noms confirmés par
+  les feedbacks (entités corrigées "vendor"/"recipient" retrouvées dans le texte) vont
+  dans le répertoire de l'entreprise concernée (company_overlay): le feedback d'une
+  entreprise ne change jamais les noms reconnus pour les autres.
+- Les feedbacks sans entreprise déposent leurs noms dans models/vendor_gazetteer_staging.jsonl
+  (une ligne par confirmation). "promote" passe dans le répertoire commun les noms
+  confirmés par au moins PROMOTE_CONFIRMATIONS feedbacks; un nom isolé, peut-être mal
+  corrigé, ne change pas la reconnaissance de tous.
+- Chaque nom est ramené à une clé normalisée (minuscules, sans accents ni espaces, voir
+  span_alignment), et l'ensemble des clés est compilé en un automate d'Aho-Corasick: un
+  seul passage linéaire sur le texte normalisé trouve tous les noms connus. Seules les
+  occurrences qui commencent et finissent sur une limite de mot du texte sont retenues
+  ("Sahel" n'est pas reconnu dans "Sahelienne"), ou qui suivent directement un libellé
+  de nom collé par l'OCR ("NOMDEDESTINATAIREMoezzrig").
+- Le répertoire est rechargé quand le fichier change (vérification au plus toutes les
+  RELOAD_CHECK_SECONDS): un nom ajouté sert aussitôt, dans tous les processus.
+
+Usage:
+    python vendor_gazetteer.py add "Électro Sahel" "Moez Zrig"
+    python vendor_gazetteer.py promote [--min-confirmations 3]
+    python vendor_gazetteer.py match <fichier texte>
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+
+from label_index import FIELD_LABELS
+from model_registry import MODELS_DIR
+from span_alignment import ValueAutomaton, normalize_value, normalize_with_offsets
+
+GAZETTEER_FILE = "vendor_gazetteer.jsonl"
+STAGING_FILE = "vendor_gazetteer_staging.jsonl"
+
+# Clés des entités corrigées qui portent un nom de fournisseur ou de destinataire
+NAME_KEYS = ("vendor", "recipient", "fournisseur", "destinataire")
+# Une clé plus courte reconnaîtrait des fragments de mots ordinaires
+MIN_KEY_LENGTH = 5
+MATCH_CONFIDENCE = 0.95
+RELOAD_CHECK_SECONDS = 2.0
+# Feedbacks sans entreprise qui doivent confirmer un nom avant qu'il entre au répertoire commun
+PROMOTE_CONFIRMATIONS = 3
+# Libellés de nom (label_index) auxquels l'OCR colle parfois le nom qui suit
+NAME_LABEL_KEYS = tuple(sorted({normalize_value(label) for label in FIELD_LABELS["vendor"]}))
+
+
+def name_key(name):
+    """Clé normalisée d'un nom (même normalisation que le texte parcouru)"""
+    return normalize_value(name)
+
+
+def same_name(name, value):
+    """Vrai si `value` désigne le nom `name` (une clé contient l'autre: valeur tronquée ou complétée)"""
+    key, other = name_key(name), name_key(value)
+    return bool(key and other) and (key in other or other in key)
+
+
+def _word_bounded(text, begin, finish):
+    """
+    Vrai si text[begin:finish] ne coupe pas de mot: un caractère alphanumérique ne le
+    précède que si c'est la fin d'un libellé de nom collé par l'OCR
+    """
+    if finish < len(text) and text[finish].isalnum():
+        return False
+    if begin == 0 or not text[begin - 1].isalnum():
+        return True
+    word_start = begin - 1
+    while word_start > 0 and text[word_start - 1].isalnum():
+        word_start -= 1
+    return normalize_value(text[word_start:begin]).endswith(NAME_LABEL_KEYS)
+
+
+class Gazetteer:
+    """Noms connus (clé normalisée -> nom confirmé) et automate de recherche"""
+
+    def __init__(self, names=()):
+        self.names = {}
+        for name in names:
+            key = name_key(name)
+            if len(key) >= MIN_KEY_LENGTH:
+                self.names.setdefault(key, name)
+        self._keys = list(self.names)
+        self._automaton = ValueAutomaton(self._keys) if self._keys else None
+        self.version = hashlib.sha1("\n".join(sorted(self._keys)).encode("utf-8")).hexdigest()[:12]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name_key(name) in self.names
+
+    @classmethod
+    def load(cls, path):
+        names = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        names.append(json.loads(line)["name"])
+        return cls(names)
+
+    def find_all(self, text):
+        """
+        Noms connus présents dans le texte, sur des limites de mot: [{"value", "raw",
+        "start", "end"}] dans l'ordre du texte
+        """
+        if self._automaton is None:
+            return []
+        normalized, offsets = normalize_with_offsets(text)
+        found = []
+        for index, start, end in self._automaton.find_all(normalized):
+            key = self._keys[index]
+            begin, finish = offsets[start], offsets[end - 1] + 1
+            if not _word_bounded(text, begin, finish):
+                continue
+            found.append({"value": self.names[key], "raw": text[begin:finish], "start": begin, "end": finish})
+        found.sort(key=lambda match: (match["start"], -match["end"]))
+        return found
+
+    def match(self, text):
+        """Nom connu le plus long du texte (le premier à longueur égale), ou None"""
+        found = self.find_all(text)
+        if not found:
+            return None
+        best = max(found, key=lambda match: (len(name_key(match["value"])), -match["start"]))
+        best["confidence"] = MATCH_CONFIDENCE
+        return best
+
+
+def feedback_names(text, corrected_entities):
+    """Noms de fournisseur/destinataire d'un feedback qui figurent bien dans le texte"""
+    normalized = None
+    names = []
+    for entity_name, entities in corrected_entities.items():
+        if entity_name.lower() not in NAME_KEYS or not entities:
+            continue
+        for entity in (entities if isinstance(entities, list) else [entities]):
+            name = entity.get("value") if isinstance(entity, dict) else entity
+            if not isinstance(name, str) or len(name_key(name)) < MIN_KEY_LENGTH:
+                continue
+            if normalized is None:
+                normalized = normalize_with_offsets(text)[0]
+            if name_key(name) in normalized:
+                names.append(" ".join(name.split()))
+    return names
+
+
+def append_names(path, names, gazetteer):
+    """Ajoute au fichier `path` les noms absents de `gazetteer`; retourne le nombre de noms ajoutés"""
+    lines = []
+    seen = set()
+    for name in names:
+        key = name_key(name)
+        if len(key) < MIN_KEY_LENGTH or key in gazetteer.names or key in seen:
+            continue
+        seen.add(key)
+        lines.append(json.dumps({"name": name, "added": time.time()}, ensure_ascii=False))
+    if lines:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def add_names(names, models_dir=None):
+    """Ajoute les noms encore inconnus au répertoire; retourne le nombre de noms ajoutés"""
+    root = os.path.abspath(models_dir or MODELS_DIR)
+    added = append_names(os.path.join(root, GAZETTEER_FILE), names, get_gazetteer(models_dir, check=True))
+    if added:
+        _gazetteer_cache.pop(root, None)
+    return added
+
+
+def stage_feedback_names(text, corrected_entities, models_dir=None):
+    """
+    Dépose en attente les noms confirmés par un feedback sans entreprise (voir
+    promote_names); retourne le nombre de noms déposés
+    """
+    root = os.path.abspath(models_dir or MODELS_DIR)
+    names = feedback_names(text, corrected_entities)
+    if not names:
+        return 0
+    return append_names(os.path.join(root, STAGING_FILE), names, get_gazetteer(models_dir))
+
+
+def promote_names(min_confirmations=PROMOTE_CONFIRMATIONS, models_dir=None):
+    """
+    Passe au répertoire commun les noms en attente confirmés par au moins
+    `min_confirmations` feedbacks; les autres restent en attente. Retourne le nombre
+    de noms ajoutés
+    """
+    root = os.path.abspath(models_dir or MODELS_DIR)
+    path = os.path.join(root, STAGING_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+
+    # Le premier nom déposé représente la clé; chaque ligne compte une confirmation
+    names, counts = {}, {}
+    for line in lines:
+        name = json.loads(line)["name"]
+        key = name_key(name)
+        names.setdefault(key, name)
+        counts[key] = counts.get(key, 0) + 1
+    promoted = {key for key, count in counts.items() if count >= min_confirmations}
+    if not promoted:
+        return 0
+
+    added = add_names([names[key] for key in promoted], models_dir)
+    remaining = [line for line in lines if name_key(json.loads(line)["name"]) not in promoted]
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.writelines(remaining)
+    os.replace(temporary, path)
+    return added
+
+
+# Répertoire chargé par dossier de modèles: (répertoire, mtime du fichier, dernière vérification)
+_gazetteer_cache = {}
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer(models_dir=None, check=False):
+    """Répertoire courant, rechargé quand le fichier a changé (vide s'il n'existe pas)"""
+    root = os.path.abspath(models_dir or MODELS_DIR)
+    now = time.monotonic()
+    cached = _gazetteer_cache.get(root)
+    if not check and cached is not None and now - cached[2] < RELOAD_CHECK_SECONDS:
+        return cached[0]
+
+    with _gazetteer_lock:
+        path = os.path.join(root, GAZETTEER_FILE)
+        try:
+            stat = os.stat(path)
+            mtime = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            mtime = None
+        if cached is not None and cached[1] == mtime:
+            gazetteer = cached[0]
+        else:
+            gazetteer = Gazetteer.load(path)
+        _gazetteer_cache[root] = (gazetteer, mtime, now)
+        return gazetteer
+
+
+def match_name(text, models_dir=None):
+    """Nom connu du texte (voir Gazetteer.match)"""
+    return get_gazetteer(models_dir).match(text)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Répertoire des fournisseurs et destinataires")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    add_command = commands.add_parser("add", help="Ajouter des noms confirmés")
+    add_command.add_argument("names", nargs="+")
+    promote_command = commands.add_parser("promote", help="Ajouter les noms confirmés par les feedbacks sans entreprise")
+    promote_command.add_argument("--min-confirmations", type=int, default=PROMOTE_CONFIRMATIONS)
+    match_command = commands.add_parser("match", help="Chercher les noms connus dans un fichier texte")
+    match_command.add_argument("path")
+    args = arg_parser.parse_args()
+
+    if args.command == "add":
+        added = add_names(args.names)
+        print(json.dumps({"added": added, "names": len(get_gazetteer(check=True))}))
+        return
+    if args.command == "promote":
+        added = promote_names(args.min_confirmations)
+        print(json.dumps({"added": added, "names": len(get_gazetteer(check=True))}))
+        return
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        text = f.read()
+    gazetteer = get_gazetteer()
+    started = time.perf_counter()
+    result = {"match": gazetteer.match(text), "all": gazetteer.find_all(text)}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 4)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
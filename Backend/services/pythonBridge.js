@@ -2,6 +2,19 @@
 const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs').promises;
+const readline = require('readline');
+
+// Délai maximal d'attente d'une réponse du serveur de parsing résident
+const SERVER_REQUEST_TIMEOUT = 30000;
+// Délai maximal de chargement des modèles au démarrage du serveur
+const SERVER_START_TIMEOUT = Number(process.env.PYTHON_SERVER_START_TIMEOUT) || 60000;
+// Attente maximale d'un serveur encore en démarrage par une requête: au-delà, la requête
+// passe par le script pendant que le serveur finit de charger. Doit rester bien en
+// dessous de ML_ANALYSIS_TIMEOUT (ocr.controller.js) pour laisser le temps au script
+const SERVER_WAIT_TIMEOUT = Number(process.env.PYTHON_SERVER_WAIT_TIMEOUT) || 10000;
+// Après un échec, le serveur n'est pas relancé avant ce délai (doublé à chaque échec)
+const SERVER_RETRY_DELAY = 30000;
+const SERVER_MAX_RETRY_DELAY = 10 * 60 * 1000;
 
 /**
  * Service de pont vers les scripts Python pour l'analyse avancée par ML
@@ -14,6 +27,155 @@ class PythonBridgeService {
       lastCheck: null,
       version: null
     };
+
+    // Serveur Python résident (parser_server.py): les modèles sont chargés une
+    // seule fois et les requêtes passent par stdin/stdout sans fichier temporaire
+    this.useServer = process.env.PYTHON_PARSER_SERVER !== 'false';
+    this.serverProcess = null;
+    this.serverReady = null;
+    this.pendingRequests = new Map();
+    this.nextRequestId = 1;
+    // Échecs consécutifs du serveur et date avant laquelle il n'est pas relancé:
+    // les appels passent alors directement par les scripts
+    this.serverFailures = 0;
+    this.serverRetryAt = 0;
+
+    // Démarrage dès le chargement du module: les modèles sont prêts avant la première
+    // requête (l'échec éventuel est déjà journalisé par startServer)
+    if (this.useServer) {
+      this.startServer().catch(() => {});
+    }
+  }
+
+  /**
+   * Démarre le serveur de parsing résident s'il n'est pas déjà lancé.
+   * Un serveur qui n'est pas prêt après SERVER_START_TIMEOUT est arrêté; après un
+   * échec, il n'est relancé qu'une fois le délai d'attente (croissant) écoulé.
+   * @returns {Promise<void>} - Résolue quand les modèles sont chargés
+   */
+  startServer() {
+    if (this.serverReady) {
+      return this.serverReady;
+    }
+    if (Date.now() < this.serverRetryAt) {
+      return Promise.reject(new Error(
+        `Serveur Python désactivé jusqu'à ${new Date(this.serverRetryAt).toISOString()} après ${this.serverFailures} échec(s)`
+      ));
+    }
+
+    this.serverReady = new Promise((resolve, reject) => {
+      const scriptFullPath = path.join(this.scriptPath, 'parser_server.py');
+      const serverProcess = spawn(this.pythonPath, [scriptFullPath], { cwd: this.scriptPath });
+      this.serverProcess = serverProcess;
+      let stopped = false;
+
+      const startTimeoutId = setTimeout(() => {
+        handleExit(new Error(`Le serveur Python n'est pas prêt après ${SERVER_START_TIMEOUT} ms`));
+        serverProcess.kill();
+      }, SERVER_START_TIMEOUT);
+
+      const lines = readline.createInterface({ input: serverProcess.stdout });
+      lines.on('line', (line) => {
+        let response;
+        try {
+          response = JSON.parse(line);
+        } catch (err) {
+          console.error('Réponse invalide du serveur Python:', line);
+          return;
+        }
+
+        // Message de disponibilité envoyé après le chargement des modèles
+        if (response.id === null && response.result && response.result.ready) {
+          clearTimeout(startTimeoutId);
+          this.serverFailures = 0;
+          resolve();
+          return;
+        }
+
+        const pending = this.pendingRequests.get(response.id);
+        if (!pending) {
+          return;
+        }
+        this.pendingRequests.delete(response.id);
+        clearTimeout(pending.timeoutId);
+
+        if (response.ok) {
+          pending.resolve(response.result);
+        } else {
+          pending.reject(new Error(`Erreur du serveur Python: ${response.error}`));
+        }
+      });
+
+      serverProcess.stderr.on('data', (data) => {
+        console.error(`Serveur Python: ${data}`);
+      });
+
+      const handleExit = (err) => {
+        // 'error' et 'exit' peuvent se suivre pour le même processus
+        if (stopped) {
+          return;
+        }
+        stopped = true;
+        clearTimeout(startTimeoutId);
+
+        const error = err || new Error('Le serveur Python s\'est arrêté');
+        this.serverFailures += 1;
+        const retryDelay = Math.min(SERVER_RETRY_DELAY * 2 ** (this.serverFailures - 1), SERVER_MAX_RETRY_DELAY);
+        this.serverRetryAt = Date.now() + retryDelay;
+        console.error(`Serveur de parsing Python indisponible (nouvel essai dans ${retryDelay} ms):`, error.message);
+        reject(error);
+
+        // Rejeter les requêtes en cours; le serveur sera relancé au premier appel après le délai
+        for (const pending of this.pendingRequests.values()) {
+          clearTimeout(pending.timeoutId);
+          pending.reject(error);
+        }
+        this.pendingRequests.clear();
+        this.serverProcess = null;
+        this.serverReady = null;
+      };
+
+      serverProcess.on('error', handleExit);
+      serverProcess.on('exit', () => handleExit());
+    });
+
+    return this.serverReady;
+  }
+
+  /**
+   * Attend que le serveur soit prêt, au plus SERVER_WAIT_TIMEOUT: une requête ne reste
+   * pas bloquée derrière un chargement de modèles plus long que son propre délai
+   * @returns {Promise<void>} - Rejetée si le serveur n'est pas prêt à temps
+   */
+  waitForServer() {
+    let waitTimeoutId;
+    const timeout = new Promise((resolve, reject) => {
+      waitTimeoutId = setTimeout(() => {
+        reject(new Error(`Le serveur Python n'est pas encore prêt après ${SERVER_WAIT_TIMEOUT} ms`));
+      }, SERVER_WAIT_TIMEOUT);
+    });
+    return Promise.race([this.startServer(), timeout]).finally(() => clearTimeout(waitTimeoutId));
+  }
+
+  /**
+   * Envoie une requête au serveur de parsing résident
+   * @param {string} op - Opération (extract, feedback, stats)
+   * @param {Object} payload - Données de la requête
+   * @returns {Promise<any>} - Résultat de l'opération
+   */
+  async sendRequest(op, payload = {}) {
+    await this.waitForServer();
+
+    const id = String(this.nextRequestId++);
+    return new Promise((resolve, reject) => {
+      const timeoutId = setTimeout(() => {
+        this.pendingRequests.delete(id);
+        reject(new Error(`Délai dépassé pour la requête Python ${op}`));
+      }, SERVER_REQUEST_TIMEOUT);
+
+      this.pendingRequests.set(id, { resolve, reject, timeoutId });
+      this.serverProcess.stdin.write(JSON.stringify({ id, op, ...payload }) + '\n');
+    });
   }
 
   /**
@@ -68,13 +230,22 @@ class PythonBridgeService {
    * Analyse un texte avec le parser simple Python
    * @param {string} imagePath - Chemin vers l'image
    * @param {string} text - Texte à analyser
+   * @param {string} company - Identifiant de l'entreprise (surcouche de règles et de noms, optionnel)
    * @returns {Promise<Object>} - Entités extraites
    */
-  async analyzeWithSimpleParser(imagePath, text) {
+  async analyzeWithSimpleParser(imagePath, text, company = null) {
     if (!text || typeof text !== 'string' || text.trim().length === 0) {
       console.error('Erreur: Texte OCR vide ou invalide');
       return { entities: {}, raw_results: {}, processing_time: 0 };
     }
+
+    if (this.useServer) {
+      try {
+        return await this.sendRequest('extract', { parser: 'simple', text, ...(company && { company: String(company) }) });
+      } catch (error) {
+        console.error('Serveur Python indisponible, exécution du script:', error.message);
+      }
+    }
     
     // Sauvegarder le texte dans un fichier temporaire
     const tempTextPath = path.join(this.scriptPath, `temp_${Date.now()}.txt`);
@@ -95,7 +266,11 @@ class PythonBridgeService {
       console.log(`Texte OCR écrit dans ${tempTextPath}, longueur: ${text.length} caractères`);
       
       // Appeler le script Python
-      const result = await this.executeScript('simple_invoice_parser.py', [tempTextPath, imagePath]);
+      const args = [tempTextPath, imagePath];
+      if (company) {
+        args.push('--company', String(company));
+      }
+      const result = await this.executeScript('simple_invoice_parser.py', args);
       return result;
     } catch (error) {
       console.error('Erreur lors de l\'analyse avec le parser Python:', error);
@@ -114,13 +289,31 @@ class PythonBridgeService {
    * Analyse un texte avec le parser adaptatif qui utilise le ML
    * @param {string} text - Texte à analyser
    * @param {string} imagePath - Chemin vers l'image (optionnel)
-   * @returns {Promise<Object>} - Entités extraites avec confiance
+   * @param {string} company - Identifiant de l'entreprise (surcouche de règles et de noms, optionnel)
+   * @param {Object} options - { cascade: true } pour n'appeler le NER que sur les champs que les règles n'ont pas sûrs
+   * @returns {Promise<Object>} - Entités extraites avec confiance, et l'étage (rules/ner) de chaque champ
    */
-  async analyzeWithAdaptiveParser(text, imagePath = null) {
+  async analyzeWithAdaptiveParser(text, imagePath = null, company = null, options = {}) {
+    const parser = options.cascade ? 'cascade' : 'adaptive';
     if (!text || typeof text !== 'string' || text.trim().length === 0) {
       console.error('Erreur: Texte OCR vide ou invalide');
       return { entities: {}, model_stats: { model_version: 1 } };
     }
+
+    if (this.useServer) {
+      try {
+        const result = await this.sendRequest('extract', { parser, text, ...(company && { company: String(company) }) });
+        if (result.model_stats) {
+          this.modelStats = {
+            lastCheck: new Date(),
+            version: result.model_stats.model_version
+          };
+        }
+        return result;
+      } catch (error) {
+        console.error('Serveur Python indisponible, exécution du script:', error.message);
+      }
+    }
     
     // Sauvegarder le texte dans un fichier temporaire
     const tempTextPath = path.join(this.scriptPath, `temp_${Date.now()}.txt`);
@@ -143,6 +336,12 @@ class PythonBridgeService {
       if (imagePath) {
         args.push(imagePath);
       }
+      if (company) {
+        args.push('--company', String(company));
+      }
+      if (options.cascade) {
+        args.push('--cascade');
+      }
       
       // Appeler le script Python qui utilise AdaptiveInvoiceParser
       const result = await this.executeScript('run_adaptive_parser.py', args);
@@ -174,15 +373,35 @@ class PythonBridgeService {
    * @param {string} text - Texte original
    * @param {Object} extractedEntities - Entités extraites automatiquement
    * @param {Object} correctedEntities - Entités corrigées par l'utilisateur
+   * @param {string} company - Identifiant de l'entreprise: les noms confirmés vont dans sa surcouche (optionnel)
    * @returns {Promise<Object>} - Résultat de l'enregistrement
    */
-  async sendFeedbackToModel(text, extractedEntities, correctedEntities) {
+  async sendFeedbackToModel(text, extractedEntities, correctedEntities, company = null) {
+    if (this.useServer) {
+      try {
+        const result = await this.sendRequest('feedback', {
+          text,
+          original: extractedEntities,
+          corrected: correctedEntities,
+          ...(company && { company: String(company) })
+        });
+        if (result.model_version) {
+          this.modelStats.version = result.model_version;
+          this.modelStats.lastCheck = new Date();
+        }
+        return result;
+      } catch (error) {
+        console.error('Serveur Python indisponible, exécution du script:', error.message);
+      }
+    }
+
     // Créer un fichier temporaire avec les données JSON
     const tempDataPath = path.join(this.scriptPath, `feedback_${Date.now()}.json`);
     const feedbackData = JSON.stringify({
       text,
       original: extractedEntities,
-      corrected: correctedEntities
+      corrected: correctedEntities,
+      ...(company && { company: String(company) })
     });
     
     try {
@@ -235,8 +454,18 @@ class PythonBridgeService {
     }
     
     try {
-      // Appeler le script Python pour obtenir les stats
-      const result = await this.executeScript('get_model_stats.py');
+      let result = null;
+      if (this.useServer) {
+        try {
+          // Interroger le serveur résident pour obtenir les stats
+          result = await this.sendRequest('stats');
+        } catch (error) {
+          console.error('Serveur Python indisponible, exécution du script:', error.message);
+        }
+      }
+      if (!result) {
+        result = await this.executeScript('run_adaptive_parser.py', ['--stats']);
+      }
       
       // Mettre à jour les stats en cache
       this.modelStats = {